@@ -0,0 +1,176 @@
+"""
+Per-order, per-time-bucket running aggregates for analysis reports
+
+Each ReportAggregate row holds counts, sums and a KLL sentiment sketch for one order
+and one time bucket (by review publish date). New reviews are folded into the rows
+of the buckets they fall in, so refreshing a report touches only the new reviews,
+and every field merges associatively, so aggregates built by different workers
+combine exactly like aggregates built by one.
+"""
+from datetime import datetime, timezone
+from sqlalchemy import text, DateTime
+from app.sketches import KLLSketch
+import os
+import numpy as np
+
+REPORT_BUCKET_SECONDS = int(os.getenv("REPORT_BUCKET_SECONDS", str(7 * 86400)))
+REPORT_QUANTILES = (0.1, 0.25, 0.5, 0.75, 0.9)
+
+SELECT_BUCKETS = """
+SELECT bucket, review_count, sentiment_sum, negative_count, neutral_count, positive_count,
+       rating_1, rating_2, rating_3, rating_4, rating_5, sentiment_sketch
+FROM "ReportAggregate" WHERE order_id = :order_id
+"""
+
+UPSERT_BUCKET = """
+INSERT INTO "ReportAggregate" (order_id, bucket, review_count, sentiment_sum,
+    negative_count, neutral_count, positive_count,
+    rating_1, rating_2, rating_3, rating_4, rating_5, sentiment_sketch, "updatedAt")
+VALUES (:order_id, :bucket, :review_count, :sentiment_sum,
+    :negative_count, :neutral_count, :positive_count,
+    :rating_1, :rating_2, :rating_3, :rating_4, :rating_5, :sentiment_sketch, :now)
+ON CONFLICT (order_id, bucket) DO UPDATE SET
+    review_count = excluded.review_count,
+    sentiment_sum = excluded.sentiment_sum,
+    negative_count = excluded.negative_count,
+    neutral_count = excluded.neutral_count,
+    positive_count = excluded.positive_count,
+    rating_1 = excluded.rating_1,
+    rating_2 = excluded.rating_2,
+    rating_3 = excluded.rating_3,
+    rating_4 = excluded.rating_4,
+    rating_5 = excluded.rating_5,
+    sentiment_sketch = excluded.sentiment_sketch,
+    "updatedAt" = excluded."updatedAt"
+"""
+
+class BucketAggregate:
+    """Running totals for one time bucket"""
+    __slots__ = ("review_count", "sentiment_sum", "polarity_counts", "rating_counts", "sentiment")
+
+    def __init__(self):
+        self.review_count = 0
+        self.sentiment_sum = 0.0
+        self.polarity_counts = np.zeros(3, dtype=np.int64)  # negative, neutral, positive
+        self.rating_counts = np.zeros(5, dtype=np.int64)    # 1..5 stars
+        self.sentiment = KLLSketch()
+
+    def merge(self, other: "BucketAggregate") -> "BucketAggregate":
+        merged = BucketAggregate()
+        merged.review_count = self.review_count + other.review_count
+        merged.sentiment_sum = self.sentiment_sum + other.sentiment_sum
+        merged.polarity_counts = self.polarity_counts + other.polarity_counts
+        merged.rating_counts = self.rating_counts + other.rating_counts
+        merged.sentiment = self.sentiment.merge(other.sentiment)
+        return merged
+
+    @classmethod
+    def from_row(cls, row) -> "BucketAggregate":
+        aggregate = cls()
+        aggregate.review_count = row.review_count
+        aggregate.sentiment_sum = row.sentiment_sum
+        aggregate.polarity_counts = np.array([row.negative_count, row.neutral_count, row.positive_count], dtype=np.int64)
+        aggregate.rating_counts = np.array([row.rating_1, row.rating_2, row.rating_3, row.rating_4, row.rating_5], dtype=np.int64)
+        aggregate.sentiment = KLLSketch.from_bytes(bytes(row.sentiment_sketch))
+        return aggregate
+
+    def to_params(self) -> dict:
+        params = {
+            "review_count": self.review_count,
+            "sentiment_sum": self.sentiment_sum,
+            "negative_count": int(self.polarity_counts[0]),
+            "neutral_count": int(self.polarity_counts[1]),
+            "positive_count": int(self.polarity_counts[2]),
+            "sentiment_sketch": self.sentiment.to_bytes(),
+        }
+        for stars in range(1, 6):
+            params[f"rating_{stars}"] = int(self.rating_counts[stars - 1])
+        return params
+
+def bucket_batch(timestamps: np.ndarray, scores: np.ndarray, polarity: np.ndarray, ratings: np.ndarray,
+                 bucket_seconds: int = REPORT_BUCKET_SECONDS) -> dict:
+    """Aggregate one scored batch into {bucket start (epoch seconds): BucketAggregate}.
+    polarity is -1 / 0 / 1 per review."""
+    if len(scores) == 0:
+        return {}
+    starts = timestamps - timestamps % bucket_seconds
+    buckets, inverse = np.unique(starts, return_inverse=True)
+    count = len(buckets)
+    review_counts = np.bincount(inverse, minlength=count)
+    sentiment_sums = np.bincount(inverse, weights=scores, minlength=count)
+    polarity_counts = np.bincount(inverse * 3 + polarity + 1, minlength=count * 3).reshape(count, 3)
+    ratings = ratings.astype(np.int64)
+    rated = (ratings >= 1) & (ratings <= 5)
+    rating_counts = np.bincount(inverse[rated] * 5 + ratings[rated] - 1, minlength=count * 5).reshape(count, 5)
+    order = np.argsort(inverse, kind="stable")
+    bounds = np.zeros(count + 1, dtype=np.int64)
+    np.cumsum(review_counts, out=bounds[1:])
+
+    result = {}
+    for i, start in enumerate(buckets):
+        aggregate = BucketAggregate()
+        aggregate.review_count = int(review_counts[i])
+        aggregate.sentiment_sum = float(sentiment_sums[i])
+        aggregate.polarity_counts = polarity_counts[i].astype(np.int64)
+        aggregate.rating_counts = rating_counts[i].astype(np.int64)
+        aggregate.sentiment.update_many(scores[order[bounds[i]:bounds[i + 1]]])
+        result[int(start)] = aggregate
+    return result
+
+def merge_buckets(left: dict, right: dict) -> dict:
+    """Union of two bucket maps, merging buckets present in both"""
+    merged = dict(left)
+    for start, aggregate in right.items():
+        merged[start] = merged[start].merge(aggregate) if start in merged else aggregate
+    return merged
+
+def _to_datetime(start: int) -> datetime:
+    return datetime.fromtimestamp(start, tz=timezone.utc).replace(tzinfo=None)
+
+def _to_epoch(value: datetime) -> int:
+    return int(value.replace(tzinfo=timezone.utc).timestamp())
+
+def load_buckets(db, order_id: str) -> dict:
+    rows = db.execute(text(SELECT_BUCKETS).columns(bucket=DateTime), {"order_id": order_id}).fetchall()
+    return {_to_epoch(row.bucket): BucketAggregate.from_row(row) for row in rows}
+
+def save_buckets(db, order_id: str, buckets: dict):
+    """Upsert the given buckets; the caller commits"""
+    if not buckets:
+        return
+    now = datetime.utcnow()
+    db.execute(text(UPSERT_BUCKET), [
+        {"order_id": order_id, "bucket": _to_datetime(start), "now": now, **aggregate.to_params()}
+        for start, aggregate in sorted(buckets.items())
+    ])
+
+def delete_buckets(db, order_id: str):
+    db.execute(text('DELETE FROM "ReportAggregate" WHERE order_id = :order_id'), {"order_id": order_id})
+
+def _rating_quantiles(rating_counts: np.ndarray) -> dict:
+    """Exact quantiles from the 1-5 star histogram"""
+    total = rating_counts.sum()
+    if total == 0:
+        return {f"p{round(q * 100)}": None for q in REPORT_QUANTILES}
+    cumulative = np.cumsum(rating_counts)
+    return {f"p{round(q * 100)}": int(np.searchsorted(cumulative, q * total) + 1) for q in REPORT_QUANTILES}
+
+def summarize(buckets: dict) -> dict:
+    """Quantiles and a per-bucket timeline for the report"""
+    overall = BucketAggregate()
+    timeline = []
+    for start, aggregate in sorted(buckets.items()):
+        overall = overall.merge(aggregate)
+        rated = int(aggregate.rating_counts.sum())
+        timeline.append({
+            "bucket": _to_datetime(start).isoformat(),
+            "reviews": aggregate.review_count,
+            "average_sentiment": aggregate.sentiment_sum / aggregate.review_count if aggregate.review_count else 0.0,
+            "median_sentiment": aggregate.sentiment.quantile(0.5),
+            "average_rating": float(np.dot(aggregate.rating_counts, np.arange(1, 6)) / rated) if rated else None,
+        })
+    return {
+        "sentiment_quantiles": dict(zip((f"p{round(q * 100)}" for q in REPORT_QUANTILES), overall.sentiment.quantiles(REPORT_QUANTILES))),
+        "rating_quantiles": _rating_quantiles(overall.rating_counts),
+        "timeline": timeline,
+    }
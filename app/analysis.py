@@ -0,0 +1,720 @@
+"""
+Batched, NumPy-vectorized review analysis
+
+Reviews are tokenized a batch at a time into one flat array of integer token ids plus
+per-review offsets. Lexicon weights, negation, intensifiers and aspect keywords are then
+applied as array lookups over the whole batch, and per-review / per-aspect figures are
+reduced with bincount, so there is no per-review Python loop in the scoring path.
+
+Each batch produces a PartialReport; partial reports merge associatively, so batches
+can be scored in any order (or in other processes) and combined at the end.
+"""
+from datetime import datetime
+from typing import NamedTuple
+from sqlalchemy import text, column, BigInteger, Text, Integer, DateTime, Boolean
+from app.aggregates import bucket_batch, merge_buckets, load_buckets, save_buckets, delete_buckets, summarize
+from app.business import business_key, result_key
+from app.result_cache import result_cache, ANALYSIS_CACHE_ENABLED
+from app.review_store import review_store, ReviewColumns, REVIEW_STORE_ENABLED
+import argparse
+import io
+import json
+import os
+import re
+import sys
+import time
+import numpy as np
+
+ANALYSIS_BATCH_SIZE = int(os.getenv("ANALYSIS_BATCH_SIZE", "20000"))
+# Distinct phrases kept while merging batches (least frequent are dropped beyond this)
+PHRASE_CAPACITY = int(os.getenv("ANALYSIS_PHRASE_CAPACITY", "50000"))
+TOP_PHRASES = 10
+# Worker processes for one order's analysis (app/parallel.py); orders with fewer reviews stay in-process
+ANALYSIS_WORKERS = int(os.getenv("ANALYSIS_WORKERS", "1"))
+ANALYSIS_PARALLEL_MIN_REVIEWS = int(os.getenv("ANALYSIS_PARALLEL_MIN_REVIEWS", "100000"))
+
+# VADER-style normalization constant and polarity thresholds
+NORMALIZATION_ALPHA = 15.0
+POSITIVE_THRESHOLD = 0.05
+NEGATIVE_THRESHOLD = -0.05
+NEGATION_FACTOR = -0.75
+INTENSIFIER_FACTOR = 1.3
+
+LEXICON = {
+    # positive
+    "amazing": 3.0, "awesome": 3.0, "excellent": 3.0, "outstanding": 3.0, "perfect": 3.0,
+    "fantastic": 3.0, "superb": 3.0, "incredible": 3.0, "best": 3.0, "delicious": 3.0,
+    "wonderful": 3.0, "love": 2.5, "loved": 2.5, "great": 2.5, "tasty": 2.0, "yummy": 2.0,
+    "fresh": 1.5, "friendly": 2.0, "attentive": 2.0, "helpful": 2.0, "polite": 1.5,
+    "welcoming": 2.0, "cozy": 1.5, "clean": 1.5, "spotless": 2.0, "quick": 1.5, "fast": 1.5,
+    "prompt": 1.5, "efficient": 1.5, "good": 1.5, "nice": 1.5, "pleasant": 1.5, "lovely": 2.0,
+    "beautiful": 2.0, "recommend": 2.0, "recommended": 2.0, "enjoyed": 2.0, "enjoy": 1.5,
+    "happy": 2.0, "fair": 1.0, "reasonable": 1.0, "affordable": 1.5, "generous": 1.5,
+    "worth": 1.5, "professional": 1.5, "comfortable": 1.5, "authentic": 1.5, "hot": 0.5,
+    "fine": 0.5, "ok": 0.3, "okay": 0.3, "decent": 1.0, "solid": 1.0,
+    # negative
+    "terrible": -3.0, "awful": -3.0, "horrible": -3.0, "disgusting": -3.0, "worst": -3.0,
+    "inedible": -3.0, "rude": -2.5, "dirty": -2.5, "filthy": -3.0, "bad": -2.0, "poor": -2.0,
+    "cold": -1.5, "stale": -2.0, "bland": -1.5, "soggy": -1.5, "burnt": -2.0, "greasy": -1.0,
+    "salty": -1.0, "raw": -1.5, "slow": -1.5, "late": -1.0, "wait": -0.5, "waited": -1.0,
+    "overpriced": -2.0, "expensive": -1.0, "pricey": -1.0, "noisy": -1.0, "loud": -1.0,
+    "crowded": -0.5, "disappointing": -2.0, "disappointed": -2.0, "mediocre": -1.5,
+    "unfriendly": -2.0, "ignored": -2.0, "wrong": -1.5, "mistake": -1.5, "sick": -2.5,
+    "never": -1.0, "avoid": -2.5, "hate": -2.5, "hated": -2.5, "angry": -2.0, "unprofessional": -2.0,
+    "smelly": -2.0, "sticky": -1.0, "broken": -1.5, "lukewarm": -1.0, "tasteless": -2.0,
+}
+
+NEGATORS = ("not", "no", "never", "nothing", "nobody", "none", "dont", "don't", "didn't", "didnt",
+            "isn't", "isnt", "wasn't", "wasnt", "won't", "wont", "can't", "cant", "couldn't", "hardly")
+INTENSIFIERS = ("very", "really", "extremely", "super", "so", "incredibly", "absolutely", "totally")
+STOPWORDS = ("a", "an", "the", "and", "or", "but", "to", "of", "in", "on", "at", "for", "with",
+             "is", "was", "were", "are", "be", "been", "it", "its", "it's", "this", "that", "i",
+             "we", "you", "they", "he", "she", "my", "our", "their", "me", "us", "them", "had",
+             "have", "has", "as", "by", "from", "there", "here", "what", "which", "all", "just",
+             "also", "too", "then", "than", "if", "when", "would", "will", "could", "did", "do",
+             "got", "get", "one", "out", "up", "about", "again", "only", "some", "any", "i'm")
+
+ASPECTS = {
+    "food": ("food", "dish", "dishes", "meal", "taste", "flavor", "flavour", "pizza", "burger",
+             "pasta", "steak", "salad", "dessert", "menu", "portion", "portions", "bread", "soup"),
+    "service": ("service", "staff", "waiter", "waitress", "server", "servers", "host", "hostess",
+                "manager", "bartender", "employees", "team"),
+    "price": ("price", "prices", "value", "cost", "bill", "money", "overpriced", "expensive",
+              "cheap", "affordable", "pricey"),
+    "ambience": ("ambience", "ambiance", "atmosphere", "decor", "music", "vibe", "interior",
+                 "patio", "noisy", "loud", "cozy", "view"),
+    "cleanliness": ("clean", "dirty", "bathroom", "restroom", "toilet", "tables", "hygiene",
+                    "filthy", "spotless", "smelly", "sticky"),
+    "speed": ("wait", "waited", "waiting", "slow", "fast", "quick", "prompt", "late", "minutes",
+              "hour", "delay", "quickly"),
+}
+ASPECT_NAMES = tuple(ASPECTS)
+
+SEPARATOR = "\x1e"
+TOKEN_RE = re.compile(r"[a-z][a-z']*|\x1e")
+
+# Phrase keys: first token id * KEY_BASE + second token id (0 for unigrams)
+KEY_BASE = np.int64(1 << 31)
+
+class Vocabulary:
+    """Token <-> id mapping. Id 0 is the review separator; lexicon, negators,
+    intensifiers, stopwords and aspect words take the next ids, so the lookup
+    tables below only cover ids < fixed_size and every later id is neutral."""
+    def __init__(self):
+        self.words = [SEPARATOR]
+        self.index = {SEPARATOR: 0}
+        for word in (*LEXICON, *NEGATORS, *INTENSIFIERS, *STOPWORDS,
+                     *(word for words in ASPECTS.values() for word in words)):
+            self.add(word)
+        self.fixed_size = len(self.words)
+
+    def add(self, word: str) -> int:
+        token_id = self.index.get(word)
+        if token_id is None:
+            token_id = self.index[word] = len(self.words)
+            self.words.append(word)
+        return token_id
+
+    @classmethod
+    def from_words(cls, words) -> "Vocabulary":
+        """The vocabulary whose ids are the positions in words, or None if words was
+        built from a different lexicon"""
+        vocabulary = cls()
+        if list(words[:vocabulary.fixed_size]) != vocabulary.words:
+            return None
+        for word in words[vocabulary.fixed_size:]:
+            vocabulary.add(word)
+        return vocabulary
+
+    def __len__(self):
+        return len(self.words)
+
+    def phrase(self, key: int) -> str:
+        first, second = divmod(int(key), int(KEY_BASE))
+        return self.words[first] if second == 0 else f"{self.words[first]} {self.words[second]}"
+
+def build_tables(vocabulary: Vocabulary) -> dict:
+    """Per-id lookup arrays for the fixed part of the vocabulary, plus one neutral slot
+    at the end that every id >= fixed_size is clipped to"""
+    size = vocabulary.fixed_size + 1
+    weights = np.zeros(size, dtype=np.float64)
+    negator = np.zeros(size, dtype=bool)
+    intensifier = np.zeros(size, dtype=bool)
+    stopword = np.zeros(size, dtype=bool)
+    aspect = np.full(size, -1, dtype=np.int64)
+    index = vocabulary.index
+    for word, weight in LEXICON.items():
+        weights[index[word]] = weight
+    for word in NEGATORS:
+        negator[index[word]] = True
+    for word in INTENSIFIERS:
+        intensifier[index[word]] = True
+    for word in STOPWORDS:
+        stopword[index[word]] = True
+    stopword[0] = True
+    for aspect_id, words in enumerate(ASPECTS.values()):
+        for word in words:
+            aspect[index[word]] = aspect_id
+    return {"weights": weights, "negator": negator, "intensifier": intensifier,
+            "stopword": stopword, "aspect": aspect}
+
+class TokenizedBatch(NamedTuple):
+    """A batch of reviews as flat arrays"""
+    ids: np.ndarray         # int32 token ids of all reviews, concatenated
+    offsets: np.ndarray     # int64, len(reviews) + 1; review i is ids[offsets[i]:offsets[i + 1]]
+    ratings: np.ndarray     # int8, 0 where missing
+    timestamps: np.ndarray  # int64 epoch seconds, 0 where missing
+    review_ids: np.ndarray  # int64 Review.id, or positions when not from the database
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+class PartialReport:
+    """Mergeable aggregates for some subset of an order's reviews"""
+    def __init__(self):
+        self.review_count = 0
+        self.duplicate_count = 0  # near-duplicates seen but left out of every other figure
+        self.sentiment_sum = 0.0
+        self.polarity_counts = np.zeros(3, dtype=np.int64)    # negative, neutral, positive
+        self.rating_counts = np.zeros(5, dtype=np.int64)      # 1..5 stars
+        self.aspect_mentions = np.zeros(len(ASPECTS), dtype=np.int64)
+        self.aspect_sentiment = np.zeros(len(ASPECTS), dtype=np.float64)
+        self.aspect_positive = np.zeros(len(ASPECTS), dtype=np.int64)
+        self.aspect_negative = np.zeros(len(ASPECTS), dtype=np.int64)
+        self.phrase_keys = np.zeros(0, dtype=np.int64)
+        self.phrase_counts = np.zeros(0, dtype=np.int64)
+        self.phrase_sentiment = np.zeros(0, dtype=np.float64)
+
+    def merge(self, other: "PartialReport") -> "PartialReport":
+        merged = PartialReport()
+        merged.review_count = self.review_count + other.review_count
+        merged.duplicate_count = self.duplicate_count + other.duplicate_count
+        merged.sentiment_sum = self.sentiment_sum + other.sentiment_sum
+        for name in ("polarity_counts", "rating_counts", "aspect_mentions",
+                     "aspect_sentiment", "aspect_positive", "aspect_negative"):
+            setattr(merged, name, getattr(self, name) + getattr(other, name))
+        merged.phrase_keys, merged.phrase_counts, merged.phrase_sentiment = merge_phrases(
+            np.concatenate([self.phrase_keys, other.phrase_keys]),
+            np.concatenate([self.phrase_counts, other.phrase_counts]),
+            np.concatenate([self.phrase_sentiment, other.phrase_sentiment])
+        )
+        return merged
+
+    def to_report(self, vocabulary: Vocabulary) -> dict:
+        """Final report as a JSON-serializable dict"""
+        count = self.review_count
+        rated = int(self.rating_counts.sum())
+        aspects = {}
+        for aspect_id, name in enumerate(ASPECT_NAMES):
+            mentions = int(self.aspect_mentions[aspect_id])
+            aspects[name] = {
+                "mentions": mentions,
+                "score": float(self.aspect_sentiment[aspect_id] / mentions) if mentions else 0.0,
+                "positive": int(self.aspect_positive[aspect_id]),
+                "negative": int(self.aspect_negative[aspect_id]),
+            }
+        return {
+            "review_count": count,
+            "duplicate_count": self.duplicate_count,
+            "average_sentiment": self.sentiment_sum / count if count else 0.0,
+            "sentiment_distribution": {
+                "negative": int(self.polarity_counts[0]),
+                "neutral": int(self.polarity_counts[1]),
+                "positive": int(self.polarity_counts[2]),
+            },
+            "average_rating": float(np.dot(self.rating_counts, np.arange(1, 6)) / rated) if rated else None,
+            "rating_distribution": {str(stars): int(self.rating_counts[stars - 1]) for stars in range(1, 6)},
+            "aspects": aspects,
+            "top_positive_phrases": self.top_phrases(vocabulary, positive=True),
+            "top_negative_phrases": self.top_phrases(vocabulary, positive=False),
+        }
+
+    def to_state(self, vocabulary: Vocabulary) -> bytes:
+        """Serialized aggregates. Phrases are stored as text because token ids
+        are only meaningful within one Vocabulary."""
+        buffer = io.BytesIO()
+        np.savez_compressed(
+            buffer,
+            counters=np.array([self.review_count, self.duplicate_count], dtype=np.int64),
+            sentiment_sum=np.array([self.sentiment_sum]),
+            polarity_counts=self.polarity_counts,
+            rating_counts=self.rating_counts,
+            aspect_mentions=self.aspect_mentions,
+            aspect_sentiment=self.aspect_sentiment,
+            aspect_positive=self.aspect_positive,
+            aspect_negative=self.aspect_negative,
+            phrases=np.array([vocabulary.phrase(key) for key in self.phrase_keys], dtype=np.str_),
+            phrase_counts=self.phrase_counts,
+            phrase_sentiment=self.phrase_sentiment,
+        )
+        return buffer.getvalue()
+
+    @classmethod
+    def from_state(cls, data: bytes, vocabulary: Vocabulary) -> "PartialReport":
+        """Inverse of to_state, re-encoding phrases into vocabulary"""
+        report = cls()
+        with np.load(io.BytesIO(data), allow_pickle=False) as state:
+            report.review_count, report.duplicate_count = (int(value) for value in state["counters"])
+            report.sentiment_sum = float(state["sentiment_sum"][0])
+            for name in ("polarity_counts", "rating_counts", "aspect_mentions",
+                         "aspect_sentiment", "aspect_positive", "aspect_negative",
+                         "phrase_counts", "phrase_sentiment"):
+                setattr(report, name, state[name])
+            keys = np.zeros(len(state["phrases"]), dtype=np.int64)
+            for i, phrase in enumerate(state["phrases"]):
+                first, _, second = str(phrase).partition(" ")
+                keys[i] = vocabulary.add(first) * KEY_BASE + (vocabulary.add(second) if second else 0)
+        order = np.argsort(keys)
+        report.phrase_keys = keys[order]
+        report.phrase_counts = report.phrase_counts[order]
+        report.phrase_sentiment = report.phrase_sentiment[order]
+        return report
+
+    def top_phrases(self, vocabulary: Vocabulary, positive: bool, limit: int = TOP_PHRASES) -> list:
+        """Most frequent phrases weighted by the sentiment of the reviews they appear in"""
+        if len(self.phrase_keys) == 0:
+            return []
+        min_mentions = max(2, self.review_count // 1000)
+        means = self.phrase_sentiment / np.maximum(self.phrase_counts, 1)
+        if positive:
+            eligible = (self.phrase_counts >= min_mentions) & (means >= POSITIVE_THRESHOLD)
+            order = np.argsort(-self.phrase_sentiment[eligible], kind="stable")
+        else:
+            eligible = (self.phrase_counts >= min_mentions) & (means <= NEGATIVE_THRESHOLD)
+            order = np.argsort(self.phrase_sentiment[eligible], kind="stable")
+        keys = self.phrase_keys[eligible][order][:limit]
+        counts = self.phrase_counts[eligible][order][:limit]
+        scores = means[eligible][order][:limit]
+        return [
+            {"phrase": vocabulary.phrase(key), "mentions": int(mentions), "score": float(score)}
+            for key, mentions, score in zip(keys, counts, scores)
+        ]
+
+def merge_phrases(keys, counts, sentiment, capacity: int = PHRASE_CAPACITY):
+    """Sum duplicate phrase keys and keep the capacity most frequent"""
+    if len(keys) == 0:
+        return keys, counts, sentiment
+    unique, inverse = np.unique(keys, return_inverse=True)
+    counts = np.bincount(inverse, weights=counts, minlength=len(unique)).astype(np.int64)
+    sentiment = np.bincount(inverse, weights=sentiment, minlength=len(unique))
+    if len(unique) > capacity:
+        keep = np.argpartition(-counts, capacity)[:capacity]
+        keep.sort()
+        unique, counts, sentiment = unique[keep], counts[keep], sentiment[keep]
+    return unique, counts, sentiment
+
+class Analyzer:
+    """Tokenizes review batches and scores them"""
+    def __init__(self, vocabulary: Vocabulary = None):
+        self.vocabulary = vocabulary or Vocabulary()
+        self.tables = build_tables(self.vocabulary)
+
+    def tokenize(self, texts, ratings=None, timestamps=None, review_ids=None) -> TokenizedBatch:
+        """Turn a batch of review texts into a TokenizedBatch"""
+        texts = list(texts)
+        count = len(texts)
+        ids, offsets = self.tokenize_joined(join_texts(texts), count)
+        return TokenizedBatch(
+            ids=ids,
+            offsets=offsets,
+            ratings=_as_array(ratings, count, np.int8),
+            timestamps=_as_timestamps(timestamps, count),
+            review_ids=_as_array(review_ids, count, np.int64) if review_ids is not None else np.arange(count, dtype=np.int64),
+        )
+
+    def tokenize_joined(self, joined: str, count: int):
+        """Token ids and per-review offsets of count reviews joined by join_texts"""
+        tokens = TOKEN_RE.findall(joined.lower())
+        index = self.vocabulary.index
+        try:
+            all_ids = np.fromiter(map(index.__getitem__, tokens), dtype=np.int32, count=len(tokens))
+        except KeyError:
+            # Sorted so ids do not depend on set iteration order
+            for word in sorted(set(tokens).difference(index)):
+                self.vocabulary.add(word)
+            all_ids = np.fromiter(map(index.__getitem__, tokens), dtype=np.int32, count=len(tokens))
+        is_separator = all_ids == 0
+        review_of_token = np.cumsum(is_separator)[~is_separator]
+        lengths = np.bincount(review_of_token, minlength=count) if count else np.zeros(0, dtype=np.int64)
+        offsets = np.zeros(count + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        return all_ids[~is_separator], offsets
+
+    def score(self, batch: TokenizedBatch) -> np.ndarray:
+        """Sentiment in [-1, 1] for each review in the batch"""
+        return score_reviews(batch.ids, batch.offsets, self.tables)
+
+    def analyze_batch(self, batch: TokenizedBatch, include=None, scores=None) -> PartialReport:
+        """Aggregate a batch; include is an optional boolean mask of reviews to count,
+        scores the batch's already computed review scores"""
+        return partial_report(batch.ids, batch.offsets, batch.ratings, self.tables, include, scores)
+
+    def analyze(self, reviews, batch_size: int = ANALYSIS_BATCH_SIZE) -> dict:
+        """Analyze an iterable of (text, rating) pairs and return the report"""
+        partial = PartialReport()
+        batch_texts, batch_ratings = [], []
+        for body, rating in reviews:
+            batch_texts.append(body)
+            batch_ratings.append(rating)
+            if len(batch_texts) >= batch_size:
+                partial = partial.merge(self.analyze_batch(self.tokenize(batch_texts, batch_ratings)))
+                batch_texts, batch_ratings = [], []
+        if batch_texts:
+            partial = partial.merge(self.analyze_batch(self.tokenize(batch_texts, batch_ratings)))
+        return partial.to_report(self.vocabulary)
+
+def join_texts(texts) -> str:
+    """Reviews as one string, separated by SEPARATOR (which is removed from the texts)"""
+    joined = SEPARATOR.join(texts)
+    if joined.count(SEPARATOR) != max(0, len(texts) - 1):
+        joined = SEPARATOR.join(t.replace(SEPARATOR, " ") for t in texts)
+    return joined
+
+def _as_array(values, count: int, dtype) -> np.ndarray:
+    if values is None:
+        return np.zeros(count, dtype=dtype)
+    return np.fromiter((value or 0 for value in values), dtype=dtype, count=count)
+
+def _as_timestamps(values, count: int) -> np.ndarray:
+    if values is None:
+        return np.zeros(count, dtype=np.int64)
+    stamps = np.array(list(values), dtype="datetime64[s]")
+    seconds = stamps.astype(np.int64)
+    seconds[np.isnat(stamps)] = 0
+    return seconds
+
+def _review_index(offsets: np.ndarray) -> np.ndarray:
+    """Review number of every token"""
+    lengths = np.diff(offsets)
+    return np.repeat(np.arange(len(lengths), dtype=np.int64), lengths)
+
+def token_weights(ids: np.ndarray, offsets: np.ndarray, tables: dict):
+    """Per-token sentiment after negation and intensifiers, and each token's review"""
+    clipped = np.minimum(ids, len(tables["weights"]) - 1)
+    review = _review_index(offsets)
+    weights = tables["weights"][clipped]
+    if len(ids) > 1:
+        # Modifiers only apply to the next token of the same review
+        same_review = np.zeros(len(ids), dtype=bool)
+        same_review[1:] = review[1:] == review[:-1]
+        previous_negator = np.zeros(len(ids), dtype=bool)
+        previous_negator[1:] = tables["negator"][clipped[:-1]]
+        previous_intensifier = np.zeros(len(ids), dtype=bool)
+        previous_intensifier[1:] = tables["intensifier"][clipped[:-1]]
+        weights = weights * np.where(previous_negator & same_review, NEGATION_FACTOR, 1.0)
+        weights = weights * np.where(previous_intensifier & same_review, INTENSIFIER_FACTOR, 1.0)
+    return weights, review, clipped
+
+def score_reviews(ids: np.ndarray, offsets: np.ndarray, tables: dict) -> np.ndarray:
+    """Normalized sentiment in [-1, 1] per review"""
+    weights, review, _ = token_weights(ids, offsets, tables)
+    totals = np.bincount(review, weights=weights, minlength=len(offsets) - 1)
+    return totals / np.sqrt(totals * totals + NORMALIZATION_ALPHA)
+
+def polarity(scores: np.ndarray) -> np.ndarray:
+    """-1 / 0 / 1 per review"""
+    return (scores >= POSITIVE_THRESHOLD).astype(np.int64) - (scores <= NEGATIVE_THRESHOLD)
+
+def partial_report(ids, offsets, ratings, tables: dict, include=None, scores=None) -> PartialReport:
+    """Score a batch and reduce it to a PartialReport"""
+    count = len(offsets) - 1
+    if scores is None:
+        weights, review, clipped = token_weights(ids, offsets, tables)
+        totals = np.bincount(review, weights=weights, minlength=count)
+        scores = totals / np.sqrt(totals * totals + NORMALIZATION_ALPHA)
+    else:
+        review = _review_index(offsets)
+        clipped = np.minimum(ids, len(tables["weights"]) - 1)
+
+    keep_review = np.ones(count, dtype=bool) if include is None else np.asarray(include, dtype=bool)
+    keep_token = keep_review[review]
+
+    report = PartialReport()
+    kept_scores = scores[keep_review]
+    report.review_count = int(keep_review.sum())
+    report.sentiment_sum = float(kept_scores.sum())
+    report.polarity_counts = np.bincount(polarity(kept_scores) + 1, minlength=3).astype(np.int64)
+
+    kept_ratings = ratings[keep_review].astype(np.int64)
+    kept_ratings = kept_ratings[(kept_ratings >= 1) & (kept_ratings <= 5)]
+    report.rating_counts = np.bincount(kept_ratings - 1, minlength=5).astype(np.int64)
+
+    # Each review counts once per aspect it mentions, with the review's overall sentiment
+    aspect_count = len(ASPECTS)
+    aspect = tables["aspect"][clipped]
+    mentioned = (aspect >= 0) & keep_token
+    pairs = np.bincount(review[mentioned] * aspect_count + aspect[mentioned], minlength=count * aspect_count)
+    pair_review, pair_aspect = np.divmod(np.flatnonzero(pairs), aspect_count)
+    pair_scores = scores[pair_review]
+    report.aspect_mentions = np.bincount(pair_aspect, minlength=aspect_count).astype(np.int64)
+    report.aspect_sentiment = np.bincount(pair_aspect, weights=pair_scores, minlength=aspect_count)
+    report.aspect_positive = np.bincount(pair_aspect[pair_scores >= POSITIVE_THRESHOLD], minlength=aspect_count).astype(np.int64)
+    report.aspect_negative = np.bincount(pair_aspect[pair_scores <= NEGATIVE_THRESHOLD], minlength=aspect_count).astype(np.int64)
+
+    # Unigrams (content words) and bigrams within a review, weighted by review sentiment
+    ids64 = ids.astype(np.int64)
+    stop = tables["stopword"][clipped]
+    negator = tables["negator"][clipped]
+    unigram = keep_token & ~stop & ~negator & ~tables["intensifier"][clipped]
+    keys = [ids64[unigram] * KEY_BASE]
+    key_reviews = [review[unigram]]
+    if len(ids) > 1:
+        bigram = (review[1:] == review[:-1]) & keep_token[1:] & (~stop[:-1] | negator[:-1]) & ~stop[1:]
+        keys.append(ids64[:-1][bigram] * KEY_BASE + ids64[1:][bigram])
+        key_reviews.append(review[1:][bigram])
+    keys = np.concatenate(keys)
+    key_reviews = np.concatenate(key_reviews)
+    report.phrase_keys, report.phrase_counts, report.phrase_sentiment = merge_phrases(
+        keys, np.ones(len(keys), dtype=np.int64), scores[key_reviews]
+    )
+    return report
+
+# -- Order jobs ---------------------------------------------------------------
+
+SELECT_ORDER_REVIEWS = """
+SELECT id, body, rating, COALESCE(published_at, "createdAt") AS published_at, is_duplicate
+FROM "Review" WHERE order_id = :order_id AND id > :after_id ORDER BY id
+"""
+
+SELECT_ORDER = 'SELECT business_name, business_address, reviews_version, review_count, reviews_digest FROM "Order" WHERE id = :id'
+
+SELECT_LAST_REVIEW_ID = 'SELECT MAX(id) FROM "Review" WHERE order_id = :order_id'
+# Stored timestamps fall back to "createdAt", which the review digest does not cover
+SELECT_UNDATED_REVIEW = 'SELECT 1 FROM "Review" WHERE order_id = :order_id AND published_at IS NULL LIMIT 1'
+
+SELECT_REPORT_STATE = 'SELECT last_review_id, state FROM "AnalysisReport" WHERE order_id = :order_id'
+
+UPSERT_REPORT = """
+INSERT INTO "AnalysisReport" (order_id, reviews_version, review_count, report, last_review_id, state, "createdAt", "updatedAt")
+VALUES (:order_id, :reviews_version, :review_count, :report, :last_review_id, :state, :now, :now)
+ON CONFLICT (order_id) DO UPDATE SET
+    reviews_version = excluded.reviews_version,
+    review_count = excluded.review_count,
+    report = excluded.report,
+    last_review_id = excluded.last_review_id,
+    state = excluded.state,
+    "updatedAt" = excluded."updatedAt"
+"""
+
+class NoReviewsYet(Exception):
+    """The order has no ingested reviews; the job is retried later"""
+
+class OrderAnalysis(NamedTuple):
+    """Everything process_order persists for an order"""
+    partial: PartialReport
+    buckets: dict           # bucket start -> BucketAggregate, all buckets
+    touched: dict           # the subset changed by this run
+    last_review_id: int
+
+def iter_review_batches(db, order_id: str, batch_size: int = ANALYSIS_BATCH_SIZE, after_id: int = 0):
+    """Stream an order's reviews with id > after_id as lists of (id, body, rating, published_at, is_duplicate) rows"""
+    query = text(SELECT_ORDER_REVIEWS).columns(
+        column("id", BigInteger),
+        column("body", Text),
+        column("rating", Integer),
+        column("published_at", DateTime),
+        column("is_duplicate", Boolean)
+    )
+    result = db.execute(
+        query,
+        {"order_id": order_id, "after_id": after_id},
+        execution_options={"stream_results": True, "yield_per": batch_size}
+    )
+    for rows in result.partitions(batch_size):
+        yield rows
+
+def tokenize_rows(analyzer: Analyzer, rows) -> TokenizedBatch:
+    review_ids, bodies, ratings, published = zip(*(row[:4] for row in rows))
+    return analyzer.tokenize(bodies, ratings, published, review_ids)
+
+def score_batches(analyzer: Analyzer, row_batches):
+    """Tokenize and score lists of review rows in this process; yields
+    (TokenizedBatch, scores, PartialReport) per list"""
+    for rows in row_batches:
+        batch = tokenize_rows(analyzer, rows)
+        scores = analyzer.score(batch)
+        yield batch, scores, analyzer.analyze_batch(batch, scores=scores)
+
+def analyze_order(db, order_id: str, analyzer: Analyzer = None, batch_size: int = ANALYSIS_BATCH_SIZE,
+                  previous: OrderAnalysis = None, workers: int = 1, writer=None) -> OrderAnalysis:
+    """Score an order's reviews batch by batch. With previous, only reviews after
+    its watermark are read and folded into its aggregates. With workers > 1 the
+    batches are scored in a process pool (app/parallel.py). Tokenized batches are
+    also appended to writer, a ReviewStoreWriter, if given."""
+    analyzer = analyzer or Analyzer()
+    partial = previous.partial if previous else PartialReport()
+    progress = {"last_review_id": previous.last_review_id if previous else 0, "duplicates": 0}
+
+    def distinct_batches():
+        for rows in iter_review_batches(db, order_id, batch_size, progress["last_review_id"]):
+            progress["last_review_id"] = rows[-1].id
+            # Near-duplicates (flagged at ingest) are counted but not scored
+            distinct = [row for row in rows if not row.is_duplicate]
+            progress["duplicates"] += len(rows) - len(distinct)
+            if distinct:
+                yield distinct
+
+    if workers > 1:
+        from app.parallel import ParallelAnalyzer
+        scored = ParallelAnalyzer(analyzer, workers).score_rows(distinct_batches())
+    else:
+        scored = score_batches(analyzer, distinct_batches())
+    touched = {}
+    for batch, scores, batch_partial in scored:
+        if writer is not None:
+            writer.append(batch.ids, batch.offsets, batch.ratings, batch.timestamps, batch.review_ids)
+        partial = partial.merge(batch_partial)
+        touched = merge_buckets(touched, bucket_batch(batch.timestamps, scores, polarity(scores), batch.ratings))
+    partial.duplicate_count += progress["duplicates"]
+    buckets = merge_buckets(previous.buckets, touched) if previous else touched
+    return OrderAnalysis(partial, buckets, {start: buckets[start] for start in touched}, progress["last_review_id"])
+
+def analyze_columns(columns: ReviewColumns, analyzer: Analyzer, batch_size: int = ANALYSIS_BATCH_SIZE) -> OrderAnalysis:
+    """Full analysis from a review store entry; analyzer must use the entry's vocabulary"""
+    partial = PartialReport()
+    buckets = {}
+    for ids, offsets, ratings, timestamps, _ in columns.batches(batch_size):
+        scores = score_reviews(ids, offsets, analyzer.tables)
+        partial = partial.merge(partial_report(ids, offsets, ratings, analyzer.tables, scores=scores))
+        buckets = merge_buckets(buckets, bucket_batch(timestamps, scores, polarity(scores), ratings))
+    partial.duplicate_count = columns.duplicate_count
+    return OrderAnalysis(partial, buckets, buckets, columns.last_review_id)
+
+def load_analysis(db, order_id: str, vocabulary: Vocabulary) -> OrderAnalysis:
+    """The stored aggregates of an order's last analysis, or None"""
+    row = db.execute(text(SELECT_REPORT_STATE), {"order_id": order_id}).fetchone()
+    if row is None or row.state is None:
+        return None
+    partial = PartialReport.from_state(bytes(row.state), vocabulary)
+    return OrderAnalysis(partial, load_buckets(db, order_id), {}, row.last_review_id)
+
+def build_report(analysis: OrderAnalysis, vocabulary: Vocabulary) -> dict:
+    report = analysis.partial.to_report(vocabulary)
+    report.update(summarize(analysis.buckets))
+    return report
+
+def store_report(db, order_id: str, reviews_version: int, review_count: int, report: str,
+                 last_review_id: int = 0, state: bytes = None):
+    db.execute(text(UPSERT_REPORT), {
+        "order_id": order_id,
+        "reviews_version": reviews_version,
+        "review_count": review_count,
+        "report": report,
+        "last_review_id": last_review_id,
+        "state": state,
+        "now": datetime.utcnow()
+    })
+
+def save_report(db, order_id: str, reviews_version: int, analysis: OrderAnalysis, vocabulary: Vocabulary) -> dict:
+    """Store (or replace) an order's report and aggregates; the caller commits"""
+    report = build_report(analysis, vocabulary)
+    save_buckets(db, order_id, analysis.touched)
+    store_report(db, order_id, reviews_version, report["review_count"], json.dumps(report),
+                 analysis.last_review_id, analysis.partial.to_state(vocabulary))
+    return report
+
+def process_order(db, job):
+    """app.jobs handler: serve the order from the result cache, or fold its new reviews into its report"""
+    row = db.execute(text(SELECT_ORDER), {"id": job.id}).fetchone()
+    if row is None or not row.review_count:
+        raise NoReviewsYet(f"Order {job.id} has no reviews ingested yet")
+    key = None
+    if ANALYSIS_CACHE_ENABLED and row.reviews_digest is not None:
+        key = result_key(row.business_name, row.business_address, row.reviews_digest)
+        cached = result_cache.get(db, key)
+        if cached is not None:
+            # No incremental state comes with a cached report: the next refresh starts over
+            delete_buckets(db, job.id)
+            store_report(db, job.id, row.reviews_version, json.loads(cached)["review_count"], cached)
+            db.commit()
+            print(f"Order {job.id}: report served from cache (hit rate {result_cache.stats()['hit_rate']:.1%})")
+            return
+    workers = ANALYSIS_WORKERS if row.review_count >= ANALYSIS_PARALLEL_MIN_REVIEWS else 1
+    analyzer = Analyzer()
+    previous = load_analysis(db, job.id, analyzer.vocabulary)
+    analysis = None
+    if previous is not None:
+        analysis = analyze_order(db, job.id, analyzer, previous=previous, workers=workers)
+        analyzed = analysis.partial.review_count + analysis.partial.duplicate_count
+        if analyzed != row.review_count:
+            # Reviews committed behind the watermark (e.g. by an overlapping ingest): start over
+            print(f"Order {job.id}: {analyzed} reviews analyzed, {row.review_count} expected; rebuilding")
+            delete_buckets(db, job.id)
+            analysis = None
+    if analysis is None:
+        analyzer, analysis = rebuild_analysis(db, job.id, row, workers)
+    report = save_report(db, job.id, row.reviews_version, analysis, analyzer.vocabulary)
+    if key is not None:
+        result_cache.put(db, key, business_key(row.business_name, row.business_address), job.id,
+                         report["review_count"], json.dumps(report))
+    db.commit()
+
+def rebuild_analysis(db, order_id: str, order, workers: int = 1):
+    """(analyzer, full analysis) of an order, from the review store when it holds this
+    order's review set, otherwise from the database (refilling the store)"""
+    key = business_key(order.business_name, order.business_address)
+    shared = order.reviews_digest is not None and \
+        db.execute(text(SELECT_UNDATED_REVIEW), {"order_id": order_id}).scalar() is None
+    if shared:
+        # Stamped by content, so orders for the business with the same reviews share the entry
+        stamp = f"digest/{order.reviews_digest}/{order.review_count}"
+    else:
+        # Undated reviews are stamped with their ingest time, so the entry is this order's own
+        stamp = f"{order_id}/{order.reviews_version}"
+    if REVIEW_STORE_ENABLED:
+        columns = review_store.open(key, stamp)
+        vocabulary = Vocabulary.from_words(columns.words) if columns is not None else None
+        if vocabulary is not None:
+            analyzer = Analyzer(vocabulary)
+            analysis = analyze_columns(columns, analyzer)
+            if shared:
+                # The entry's review ids may be another order's: watermark this order's own reviews
+                last_review_id = db.execute(text(SELECT_LAST_REVIEW_ID), {"order_id": order_id}).scalar()
+                analysis = analysis._replace(last_review_id=last_review_id or 0)
+            return analyzer, analysis
+    analyzer = Analyzer()
+    writer = review_store.writer(key, stamp) if REVIEW_STORE_ENABLED else None
+    try:
+        analysis = analyze_order(db, order_id, analyzer, workers=workers, writer=writer)
+    except Exception:
+        if writer is not None:
+            writer.abort()
+        raise
+    if writer is not None:
+        if analysis.partial.review_count + analysis.partial.duplicate_count == order.review_count:
+            writer.commit(analyzer.vocabulary.words, analysis.partial.duplicate_count, analysis.last_review_id)
+        else:
+            # Reviews arrived while reading: the columns are not this version of the review set
+            writer.abort()
+    return analyzer, analysis
+
+def regenerate_report(db, order_id: str, workers: int = ANALYSIS_WORKERS) -> dict:
+    """Rebuild an order's report from scratch"""
+    order = db.execute(text(SELECT_ORDER), {"id": order_id}).fetchone()
+    if order is None or not order.review_count:
+        raise NoReviewsYet(f"Order {order_id} has no reviews ingested yet")
+    delete_buckets(db, order_id)
+    analyzer, analysis = rebuild_analysis(db, order_id, order, workers)
+    report = save_report(db, order_id, order.reviews_version, analysis, analyzer.vocabulary)
+    db.commit()
+    return report
+
+def main(argv=None):
+    from app.database import SessionLocal
+    parser = argparse.ArgumentParser(description="Regenerate analysis reports from scratch")
+    parser.add_argument("order_ids", nargs="+")
+    parser.add_argument("--workers", type=int, default=ANALYSIS_WORKERS)
+    args = parser.parse_args(argv)
+
+    db = SessionLocal()
+    try:
+        for order_id in args.order_ids:
+            start = time.perf_counter()
+            report = regenerate_report(db, order_id, args.workers)
+            print(f"Order {order_id}: {report['review_count']:,} reviews in {time.perf_counter() - start:.2f}s")
+    finally:
+        db.close()
+    print(json.dumps(review_store.stats()), file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
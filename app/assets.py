@@ -0,0 +1,214 @@
+"""
+Fingerprinted, precompressed static assets
+
+At startup (or ahead of time with `python -m app.assets`) every file under
+app/static is copied to the build directory under a content-hashed name, e.g.
+css/style.css -> css/style.1a2b3c4d5e6f.css, next to gzip (and, when the optional
+brotli / zstandard packages are installed, br / zstd) variants compressed once at
+the highest level. Templates link assets with {{ static_url("css/style.css") }}, so
+a changed file gets a new URL and the old one can be cached forever.
+
+Requests for a fingerprinted name get the smallest variant the client accepts with
+Cache-Control: immutable; anything else falls back to the plain file in app/static.
+"""
+from typing import NamedTuple
+from fastapi.staticfiles import StaticFiles
+from fastapi.responses import FileResponse
+from starlette.datastructures import Headers
+from starlette.exceptions import HTTPException
+from starlette.staticfiles import NotModifiedResponse
+from app import metrics
+import gzip
+import hashlib
+import mimetypes
+import os
+import tempfile
+import threading
+import time
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+STATIC_DIR = os.getenv("STATIC_DIR", "app/static")
+STATIC_BUILD_DIR = os.getenv("STATIC_BUILD_DIR", os.path.join(tempfile.gettempdir(), "static-build"))
+STATIC_FINGERPRINT_ENABLED = os.getenv("STATIC_FINGERPRINT_ENABLED", "true").lower() == "true"
+# Smaller files are not worth a compressed variant
+STATIC_COMPRESS_MIN_BYTES = int(os.getenv("STATIC_COMPRESS_MIN_BYTES", "512"))
+STATIC_MAX_AGE = int(os.getenv("STATIC_MAX_AGE", str(365 * 24 * 3600)))
+
+FINGERPRINT_LENGTH = 12
+# Formats that are already compressed
+INCOMPRESSIBLE = {".png", ".jpg", ".jpeg", ".gif", ".webp", ".avif", ".ico", ".woff", ".woff2", ".gz", ".br", ".zst", ".zip"}
+IMMUTABLE_CACHE_CONTROL = f"public, max-age={STATIC_MAX_AGE}, immutable"
+# Unversioned URLs may change under the same name
+FALLBACK_CACHE_CONTROL = "public, no-cache"
+
+def _compressors():
+    """(encoding, file suffix, compress) in order of preference for equal sizes"""
+    available = []
+    if brotli is not None:
+        available.append(("br", ".br", lambda data: brotli.compress(data, quality=11)))
+    if zstandard is not None:
+        available.append(("zstd", ".zst", lambda data: zstandard.ZstdCompressor(level=19).compress(data)))
+    available.append(("gzip", ".gz", lambda data: gzip.compress(data, compresslevel=9, mtime=0)))
+    return available
+
+class Asset(NamedTuple):
+    """A fingerprinted file and its encoded variants"""
+    url_path: str       # fingerprinted path relative to /static
+    media_type: str
+    variants: dict      # encoding ("identity", "gzip", ...) -> (file path, bytes)
+
+def fingerprinted_name(path: str, digest: str) -> str:
+    root, extension = os.path.splitext(path)
+    return f"{root}.{digest[:FINGERPRINT_LENGTH]}{extension}"
+
+def _write_once(path: str, data: bytes):
+    """Build outputs are named by content, so an existing file is already right"""
+    if os.path.exists(path):
+        return
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    scratch = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(scratch, "wb") as f:
+        f.write(data)
+    os.replace(scratch, path)
+
+def accepted_encodings(header: str) -> dict:
+    """Accept-Encoding as {coding: q}"""
+    accepted = {}
+    for item in (header or "").split(","):
+        coding, _, params = item.strip().partition(";")
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        q = 1.0
+        for param in params.split(";"):
+            name, _, value = param.strip().partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        accepted[coding] = q
+    return accepted
+
+def choose_encoding(variants: dict, header: str) -> str:
+    """The smallest variant the client accepts; identity unless refused"""
+    accepted = accepted_encodings(header)
+    wildcard = accepted.get("*")
+    best = None
+    for encoding, (_, size) in variants.items():
+        if encoding == "identity":
+            q = accepted.get("identity", 0.0 if wildcard == 0 else 1.0)
+        else:
+            q = accepted.get(encoding, wildcard or 0.0)
+        if q > 0 and (best is None or size < variants[best][1]):
+            best = encoding
+    return best or "identity"
+
+class AssetManifest:
+    """Logical path -> fingerprinted asset, built from a source directory"""
+    def __init__(self, source: str = STATIC_DIR, build_dir: str = STATIC_BUILD_DIR):
+        self.source = source
+        self.build_dir = build_dir
+        self.urls = {}      # "css/style.css" -> "css/style.1a2b3c4d5e6f.css"
+        self.assets = {}    # "css/style.1a2b3c4d5e6f.css" -> Asset
+        self.served = {}
+        self.bytes_saved = 0
+        self._lock = threading.Lock()
+
+    def build(self) -> "AssetManifest":
+        start = time.perf_counter()
+        urls, assets = {}, {}
+        compressors = _compressors()
+        for directory, _, names in os.walk(self.source):
+            for name in names:
+                full_path = os.path.join(directory, name)
+                path = os.path.relpath(full_path, self.source).replace(os.sep, "/")
+                with open(full_path, "rb") as f:
+                    data = f.read()
+                url_path = fingerprinted_name(path, hashlib.sha256(data).hexdigest())
+                target = os.path.join(self.build_dir, url_path)
+                _write_once(target, data)
+                variants = {"identity": (target, len(data))}
+                if len(data) >= STATIC_COMPRESS_MIN_BYTES and os.path.splitext(name)[1].lower() not in INCOMPRESSIBLE:
+                    for encoding, suffix, compress in compressors:
+                        encoded_path = target + suffix
+                        if not os.path.exists(encoded_path):
+                            _write_once(encoded_path, compress(data))
+                        size = os.path.getsize(encoded_path)
+                        if size < len(data):
+                            variants[encoding] = (encoded_path, size)
+                media_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+                urls[path] = url_path
+                assets[url_path] = Asset(url_path, media_type, variants)
+        self.urls, self.assets = urls, assets
+        print(f"Static assets: {len(assets)} fingerprinted in {time.perf_counter() - start:.2f}s "
+              f"({', '.join(encoding for encoding, _, _ in compressors)})")
+        return self
+
+    def url(self, path: str) -> str:
+        """URL of a static file, fingerprinted when it is in the manifest"""
+        path = path.lstrip("/")
+        return "/static/" + self.urls.get(path, path)
+
+    def record(self, encoding: str, saved: int):
+        with self._lock:
+            self.served[encoding] = self.served.get(encoding, 0) + 1
+            self.bytes_saved += saved
+
+    def stats(self) -> dict:
+        return {"assets": len(self.assets), "served": dict(self.served), "bytes_saved": self.bytes_saved}
+
+class AssetFiles(StaticFiles):
+    """StaticFiles that serves fingerprinted names from the manifest"""
+    def __init__(self, manifest: AssetManifest):
+        super().__init__(directory=manifest.source)
+        self.manifest = manifest
+
+    async def get_response(self, path: str, scope):
+        asset = self.manifest.assets.get(path.replace(os.sep, "/"))
+        if asset is None:
+            response = await super().get_response(path, scope)
+            if "cache-control" not in response.headers:
+                response.headers["Cache-Control"] = FALLBACK_CACHE_CONTROL
+            return response
+        if scope["method"] not in ("GET", "HEAD"):
+            raise HTTPException(status_code=405)
+        request_headers = Headers(scope=scope)
+        encoding = choose_encoding(asset.variants, request_headers.get("accept-encoding"))
+        file_path, size = asset.variants[encoding]
+        try:
+            stat_result = os.stat(file_path)
+        except FileNotFoundError:
+            # The build directory was cleaned under us (it defaults to the temp dir)
+            self.manifest.build()
+            stat_result = os.stat(file_path)
+        headers = {"Cache-Control": IMMUTABLE_CACHE_CONTROL, "Vary": "Accept-Encoding"}
+        if encoding != "identity":
+            headers["Content-Encoding"] = encoding
+        response = FileResponse(file_path, media_type=asset.media_type, headers=headers, stat_result=stat_result)
+        if self.is_not_modified(response.headers, request_headers):
+            return NotModifiedResponse(response.headers)
+        self.manifest.record(encoding, asset.variants["identity"][1] - size)
+        return response
+
+asset_manifest = AssetManifest()
+metrics.register("static_assets", asset_manifest.stats)
+
+def main():
+    """Build ahead of a deploy: python -m app.assets"""
+    manifest = AssetManifest().build()
+    for path, url_path in sorted(manifest.urls.items()):
+        variants = manifest.assets[url_path].variants
+        print(f"  {path} -> {url_path} ({', '.join(f'{encoding} {size:,}' for encoding, (_, size) in variants.items())})")
+
+if __name__ == "__main__":
+    main()
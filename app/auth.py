@@ -6,7 +6,11 @@ from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from sqlalchemy.orm import Session
 from app.database import get_db
 from app.models import User
+from app.cache import TTLCache
+from app import metrics
+import hashlib
 import os
+import time
 import warnings
 
 # Suppress bcrypt version warning
@@ -17,6 +21,12 @@ ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 MAX_PASSWORD_LENGTH = 72  # bcrypt limit
 
+# Verified token payloads, keyed by a digest of the token and expiring at its exp claim
+JWT_CACHE_ENABLED = os.getenv("JWT_CACHE_ENABLED", "true").lower() == "true"
+JWT_CACHE_SIZE = int(os.getenv("JWT_CACHE_SIZE", "4096"))
+token_cache = TTLCache(maxsize=JWT_CACHE_SIZE, ttl=ACCESS_TOKEN_EXPIRE_MINUTES * 60)
+metrics.register("jwt_cache", token_cache.stats)
+
 # Create password context with error handling
 try:
     pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
@@ -71,7 +81,23 @@ def create_access_token(data: dict):
     return encoded_jwt
 
 def decode_token(token: str):
-    """Decode a JWT token"""
+    """Decode a JWT token, reusing the verified payload of a token seen before"""
+    if not JWT_CACHE_ENABLED or not token:
+        return _decode_token_uncached(token)
+
+    key = hashlib.sha256(token.encode()).digest()
+    payload = token_cache.get(key)
+    if payload is not None:
+        return dict(payload)
+
+    payload = _decode_token_uncached(token)
+    if payload is not None:
+        exp = payload.get("exp")
+        ttl = exp - time.time() if isinstance(exp, (int, float)) else None
+        token_cache.set(key, dict(payload), ttl=ttl)
+    return payload
+
+def _decode_token_uncached(token: str):
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         return payload
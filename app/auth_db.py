@@ -2,13 +2,34 @@
 Database functions for authentication using raw SQL to avoid SQLAlchemy quoting issues
 """
 from sqlalchemy.orm import Session
-from sqlalchemy import text
-from app.auth import get_password_hash, verify_password
+from sqlalchemy import text, column, Text, String, Float, DateTime, Integer
+from fastapi import Request
+from starlette.concurrency import run_in_threadpool
+from app.auth import get_password_hash, verify_password, decode_token
+from app.cache import TTLCache
+from app.database import SessionLocal, AsyncSessionLocal, DB_ASYNC
+from app import metrics
 from datetime import datetime
+from functools import partial
+from typing import NamedTuple
+import base64
+import os
 import uuid
 
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "1024"))
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "30"))
+
+# Users resolved from the auth cookie, keyed by lowercased email.
+# Every hit is one SELECT on "User" saved.
+user_cache = TTLCache(maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL)
+metrics.register("user_cache", user_cache.stats)
+
+ORDERS_PAGE_SIZE = int(os.getenv("ORDERS_PAGE_SIZE", "20"))
+
 class User:
     """Simple User class to hold user data"""
+    __slots__ = ("id", "name", "email", "password", "emailVerified", "image", "createdAt", "updatedAt")
+
     def __init__(self, id, name, email, password, emailVerified=None, image=None, createdAt=None, updatedAt=None):
         self.id = id
         self.name = name
@@ -19,26 +40,192 @@ class User:
         self.createdAt = createdAt
         self.updatedAt = updatedAt
 
+class UserAuth(NamedTuple):
+    """Projection used to check credentials"""
+    id: str
+    email: str
+    password: str
+
+class UserDisplay(NamedTuple):
+    """Projection used to render pages; carries no password hash"""
+    id: str
+    name: str
+    email: str
+
+class OrderRow(NamedTuple):
+    """One row of a user's order history"""
+    id: str
+    userId: str
+    business_name: str
+    business_address: str
+    status: str
+    price: float
+    createdAt: datetime
+    updatedAt: datetime
+
+class SummaryRow(NamedTuple):
+    """A user's "UserSummary" counters"""
+    order_count: int = 0
+    pending_count: int = 0
+    running_count: int = 0
+    done_count: int = 0
+    failed_count: int = 0
+    payment_count: int = 0
+    total_spent: float = 0.0
+
+class DashboardSnapshot(NamedTuple):
+    """Everything the dashboard renders, loaded in one round trip"""
+    user: UserDisplay
+    orders: list
+    next_cursor: str
+    summary: SummaryRow
+
+# OrderRow._make without the classmethod dispatch on every row
+make_order_row = partial(tuple.__new__, OrderRow)
+
+_USER_COLUMNS = 'id, name, email, password, "emailVerified", image, "createdAt", "updatedAt"'
+SELECT_USER_AUTH_BY_EMAIL = 'SELECT id, email, password FROM "User" WHERE email = :email'
+SELECT_USER_DISPLAY_BY_EMAIL = 'SELECT id, name, email FROM "User" WHERE email = :email'
+SELECT_USER_BY_EMAIL = f'SELECT {_USER_COLUMNS} FROM "User" WHERE email = :email'
+SELECT_USER_BY_ID = f'SELECT {_USER_COLUMNS} FROM "User" WHERE id = :id'
+SELECT_USER_EXISTS = 'SELECT id FROM "User" WHERE email = :email'
+INSERT_USER = 'INSERT INTO "User" (id, name, email, password, "createdAt", "updatedAt") VALUES (:id, :name, :email, :password, :createdAt, :updatedAt)'
+_ORDER_COLUMNS = 'id, "userId", business_name, business_address, status, price, "createdAt", "updatedAt"'
+SELECT_USER_ORDERS = f'SELECT {_ORDER_COLUMNS} FROM "Order" WHERE "userId" = :userId ORDER BY "createdAt" DESC'
+# Keyset pages over the ("userId", "createdAt" DESC, id DESC) index created by init_db.py
+SELECT_USER_ORDERS_PAGE = f'SELECT {_ORDER_COLUMNS} FROM "Order" WHERE "userId" = :userId ORDER BY "createdAt" DESC, id DESC LIMIT :limit'
+SELECT_USER_ORDERS_PAGE_AFTER = f'SELECT {_ORDER_COLUMNS} FROM "Order" WHERE "userId" = :userId AND ("createdAt", id) < (:createdAt, :id) ORDER BY "createdAt" DESC, id DESC LIMIT :limit'
+
+# Statuses with their own counter in "UserSummary"
+SUMMARY_STATUS_COLUMNS = {
+    "pending": "pending_count",
+    "running": "running_count",
+    "done": "done_count",
+    "failed": "failed_count",
+}
+_SUMMARY_COLUMNS = ["order_count", *SUMMARY_STATUS_COLUMNS.values(), "payment_count", "total_spent"]
+UPSERT_USER_SUMMARY = (
+    f'INSERT INTO "UserSummary" ("userId", {", ".join(_SUMMARY_COLUMNS)}, "updatedAt") '
+    f'VALUES (:userId, {", ".join(":" + name for name in _SUMMARY_COLUMNS)}, :updatedAt) '
+    'ON CONFLICT ("userId") DO UPDATE SET '
+    + ", ".join(f'{name} = "UserSummary".{name} + excluded.{name}' for name in _SUMMARY_COLUMNS)
+    + ', "updatedAt" = excluded."updatedAt"'
+)
+
+# One round trip for the dashboard: user, summary counters and the first page of orders
+SELECT_DASHBOARD_SNAPSHOT = f"""
+WITH u AS (SELECT id, name, email FROM "User" WHERE email = :email)
+SELECT u.id, u.name, u.email,
+       {", ".join(f"s.{name}" for name in _SUMMARY_COLUMNS)},
+       o.id, o."userId", o.business_name, o.business_address, o.status, o.price, o."createdAt", o."updatedAt"
+FROM u
+LEFT JOIN "UserSummary" s ON s."userId" = u.id
+LEFT JOIN (
+    SELECT {_ORDER_COLUMNS} FROM "Order"
+    WHERE "userId" = (SELECT id FROM u)
+    ORDER BY "createdAt" DESC, id DESC
+    LIMIT :limit
+) o ON 1 = 1
+ORDER BY o."createdAt" DESC, o.id DESC
+"""
+
+_ORDER_TYPED_COLUMNS = [
+    ("id", Text),
+    ("userId", Text),
+    ("business_name", String),
+    ("business_address", String),
+    ("status", String),
+    ("price", Float),
+    ("createdAt", DateTime),
+    ("updatedAt", DateTime)
+]
+
+def order_query(sql: str):
+    """Typed text() for _ORDER_COLUMNS so timestamps come back as datetimes on every driver"""
+    return text(sql).columns(*(column(name, type_) for name, type_ in _ORDER_TYPED_COLUMNS))
+
+def dashboard_snapshot_query():
+    """Typed text() for SELECT_DASHBOARD_SNAPSHOT, matched to its columns by position"""
+    columns = [
+        column("user_id", Text),
+        column("user_name", Text),
+        column("user_email", Text),
+        *(column(name, Float if name == "total_spent" else Integer) for name in _SUMMARY_COLUMNS),
+        *(column(f"order_{name}", type_) for name, type_ in _ORDER_TYPED_COLUMNS)
+    ]
+    return text(SELECT_DASHBOARD_SNAPSHOT).columns(*columns)
+
+def snapshot_from_rows(rows, limit: int) -> DashboardSnapshot:
+    """Fold the joined snapshot rows into a DashboardSnapshot (None if no such user)"""
+    if not rows:
+        return None
+    first = rows[0]
+    user = UserDisplay(first[0], first[1], first[2])
+    summary_end = 3 + len(_SUMMARY_COLUMNS)
+    counters = first[3:summary_end]
+    summary = SummaryRow(*counters) if counters[0] is not None else SummaryRow()
+    order_rows = [row[summary_end:] for row in rows if row[summary_end] is not None]
+    orders, next_cursor = order_page_from_rows(order_rows, limit)
+    return DashboardSnapshot(user, orders, next_cursor, summary)
+
+def summary_delta_params(user_id: str, **deltas) -> dict:
+    params = {name: 0 for name in _SUMMARY_COLUMNS}
+    params.update(deltas)
+    params["userId"] = user_id
+    params["updatedAt"] = datetime.utcnow()
+    return params
+
+def encode_order_cursor(order: OrderRow) -> str:
+    """Opaque cursor pointing just past the given order"""
+    raw = f"{order.createdAt.isoformat()}|{order.id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+def decode_order_cursor(cursor: str):
+    """Return (createdAt, id) from a cursor, or None if it is malformed"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, order_id = base64.urlsafe_b64decode(padded.encode()).decode().split("|", 1)
+        return datetime.fromisoformat(created_at), order_id
+    except Exception:
+        return None
+
+def order_page_params(user_id: str, limit: int, after: str = None):
+    """Pick the page query and its parameters for get_user_orders_page"""
+    position = decode_order_cursor(after) if after else None
+    params = {"userId": user_id, "limit": limit + 1}
+    if position is None:
+        return SELECT_USER_ORDERS_PAGE, params
+    params["createdAt"], params["id"] = position
+    return SELECT_USER_ORDERS_PAGE_AFTER, params
+
+def order_page_from_rows(rows, limit: int):
+    """Split limit + 1 fetched rows into (orders, next_cursor)"""
+    orders = list(map(make_order_row, rows[:limit]))
+    next_cursor = encode_order_cursor(orders[-1]) if len(rows) > limit else None
+    return orders, next_cursor
+
+def user_from_row(row) -> User:
+    """Build a User from a row selected with _USER_COLUMNS"""
+    return User(*row) if row else None
+
+def user_auth_from_row(row) -> UserAuth:
+    return UserAuth._make(row) if row else None
+
+def user_display_from_row(row) -> UserDisplay:
+    return UserDisplay._make(row) if row else None
+
+def order_from_row(row) -> OrderRow:
+    """Build an OrderRow from a row selected with _ORDER_COLUMNS"""
+    return make_order_row(row)
+
 def get_user_by_email(db: Session, email: str) -> User:
     """Get user by email using raw SQL"""
     try:
         result = db.execute(
-            text('SELECT id, name, email, password, "emailVerified", image, "createdAt", "updatedAt" FROM "User" WHERE email = :email'),
+            text(SELECT_USER_BY_EMAIL),
             {"email": email.lower()}
         )
-        row = result.fetchone()
-        if row:
-            return User(
-                id=row[0],
-                name=row[1],
-                email=row[2],
-                password=row[3],
-                emailVerified=row[4],
-                image=row[5],
-                createdAt=row[6],
-                updatedAt=row[7]
-            )
-        return None
+        return user_from_row(result.fetchone())
     except Exception as e:
         print(f"Error getting user by email: {str(e)}")
         # Reset transaction on error
@@ -48,26 +235,48 @@ def get_user_by_email(db: Session, email: str) -> User:
             pass
         return None
 
+def get_user_for_auth(db: Session, email: str) -> UserAuth:
+    """Get the id, email and password hash needed to check a login"""
+    try:
+        result = db.execute(
+            text(SELECT_USER_AUTH_BY_EMAIL),
+            {"email": email.lower()}
+        )
+        return user_auth_from_row(result.fetchone())
+    except Exception as e:
+        print(f"Error getting user for auth: {str(e)}")
+        # Reset transaction on error
+        try:
+            db.rollback()
+        except:
+            pass
+        return None
+
+def get_user_display_by_email(db: Session, email: str) -> UserDisplay:
+    """Get the id, name and email needed to render pages"""
+    try:
+        result = db.execute(
+            text(SELECT_USER_DISPLAY_BY_EMAIL),
+            {"email": email.lower()}
+        )
+        return user_display_from_row(result.fetchone())
+    except Exception as e:
+        print(f"Error getting user for display: {str(e)}")
+        # Reset transaction on error
+        try:
+            db.rollback()
+        except:
+            pass
+        return None
+
 def get_user_by_id(db: Session, user_id: str) -> User:
     """Get user by ID using raw SQL"""
     try:
         result = db.execute(
-            text('SELECT id, name, email, password, "emailVerified", image, "createdAt", "updatedAt" FROM "User" WHERE id = :id'),
+            text(SELECT_USER_BY_ID),
             {"id": user_id}
         )
-        row = result.fetchone()
-        if row:
-            return User(
-                id=row[0],
-                name=row[1],
-                email=row[2],
-                password=row[3],
-                emailVerified=row[4],
-                image=row[5],
-                createdAt=row[6],
-                updatedAt=row[7]
-            )
-        return None
+        return user_from_row(result.fetchone())
     except Exception as e:
         print(f"Error getting user by ID: {str(e)}")
         # Reset transaction on error
@@ -77,15 +286,16 @@ def get_user_by_id(db: Session, user_id: str) -> User:
             pass
         return None
 
-def create_user(db: Session, name: str, email: str, password: str) -> User:
-    """Create a new user using raw SQL"""
+def create_user(db: Session, name: str, email: str, password: str, hashed_password: str = None) -> User:
+    """Create a new user using raw SQL (pass hashed_password if it was hashed off the event loop)"""
     try:
         user_id = str(uuid.uuid4())
-        hashed_password = get_password_hash(password)
+        if hashed_password is None:
+            hashed_password = get_password_hash(password)
         now = datetime.utcnow()
         
         db.execute(
-            text('INSERT INTO "User" (id, name, email, password, "createdAt", "updatedAt") VALUES (:id, :name, :email, :password, :createdAt, :updatedAt)'),
+            text(INSERT_USER),
             {
                 "id": user_id,
                 "name": name,
@@ -96,6 +306,7 @@ def create_user(db: Session, name: str, email: str, password: str) -> User:
             }
         )
         db.commit()
+        invalidate_user(email)
         
         return User(
             id=user_id,
@@ -117,7 +328,7 @@ def user_exists(db: Session, email: str) -> bool:
     """Check if user exists using raw SQL"""
     try:
         result = db.execute(
-            text('SELECT id FROM "User" WHERE email = :email'),
+            text(SELECT_USER_EXISTS),
             {"email": email.lower()}
         )
         return result.fetchone() is not None
@@ -134,23 +345,10 @@ def get_user_orders(db: Session, user_id: str):
     """Get user's orders using raw SQL"""
     try:
         result = db.execute(
-            text('SELECT id, "userId", business_name, business_address, status, price, "createdAt", "updatedAt" FROM "Order" WHERE "userId" = :userId ORDER BY "createdAt" DESC'),
+            order_query(SELECT_USER_ORDERS),
             {"userId": user_id}
         )
-        rows = result.fetchall()
-        orders = []
-        for row in rows:
-            orders.append({
-                'id': row[0],
-                'userId': row[1],
-                'business_name': row[2],
-                'business_address': row[3],
-                'status': row[4],
-                'price': row[5],
-                'createdAt': row[6],
-                'updatedAt': row[7]
-            })
-        return orders
+        return list(map(make_order_row, result.fetchall()))
     except Exception as e:
         print(f"Error getting user orders: {str(e)}")
         # Reset transaction on error
@@ -159,3 +357,118 @@ def get_user_orders(db: Session, user_id: str):
         except:
             pass
         return []
+
+def get_user_orders_page(db: Session, user_id: str, limit: int = ORDERS_PAGE_SIZE, after: str = None):
+    """Get one keyset page of a user's orders, newest first; returns (orders, next_cursor)"""
+    try:
+        sql, params = order_page_params(user_id, limit, after)
+        result = db.execute(order_query(sql), params)
+        return order_page_from_rows(result.fetchall(), limit)
+    except Exception as e:
+        print(f"Error getting user orders page: {str(e)}")
+        # Reset transaction on error
+        try:
+            db.rollback()
+        except:
+            pass
+        return [], None
+
+def get_dashboard_snapshot(db: Session, email: str, limit: int = ORDERS_PAGE_SIZE) -> DashboardSnapshot:
+    """Get the user, first page of orders and summary counters in a single query"""
+    try:
+        result = db.execute(
+            dashboard_snapshot_query(),
+            {"email": email.lower(), "limit": limit + 1}
+        )
+        return snapshot_from_rows(result.fetchall(), limit)
+    except Exception as e:
+        print(f"Error getting dashboard snapshot: {str(e)}")
+        # Reset transaction on error
+        try:
+            db.rollback()
+        except:
+            pass
+        return None
+
+def update_user_summary(db: Session, user_id: str, **deltas):
+    """Add deltas to a user's "UserSummary" row in the caller's transaction (no commit)"""
+    db.execute(text(UPSERT_USER_SUMMARY), summary_delta_params(user_id, **deltas))
+
+def record_order_created(db: Session, user_id: str, status: str = "pending"):
+    """Count a newly inserted order; call in the same transaction as the INSERT"""
+    deltas = {"order_count": 1}
+    if status in SUMMARY_STATUS_COLUMNS:
+        deltas[SUMMARY_STATUS_COLUMNS[status]] = 1
+    update_user_summary(db, user_id, **deltas)
+
+def record_order_status_change(db: Session, user_id: str, old_status: str, new_status: str):
+    """Move an order between status counters; call in the same transaction as the UPDATE"""
+    if old_status == new_status:
+        return
+    deltas = {}
+    if old_status in SUMMARY_STATUS_COLUMNS:
+        deltas[SUMMARY_STATUS_COLUMNS[old_status]] = -1
+    if new_status in SUMMARY_STATUS_COLUMNS:
+        deltas[SUMMARY_STATUS_COLUMNS[new_status]] = 1
+    if deltas:
+        update_user_summary(db, user_id, **deltas)
+
+def record_payment(db: Session, user_id: str, amount: float):
+    """Count a succeeded payment; call in the same transaction as the INSERT"""
+    update_user_summary(db, user_id, payment_count=1, total_spent=amount)
+
+def invalidate_user(email: str):
+    """Drop a cached user; call after any write to their "User" row"""
+    if email:
+        user_cache.invalidate(email.lower())
+
+_UNRESOLVED = object()
+
+def _load_user_sync(email: str) -> UserDisplay:
+    db = SessionLocal()
+    try:
+        return get_user_display_by_email(db, email)
+    finally:
+        db.close()
+
+async def _load_user(email: str) -> UserDisplay:
+    if DB_ASYNC:
+        from app.auth_db_async import get_user_display_by_email as get_user_display_by_email_async
+        async with AsyncSessionLocal() as db:
+            return await get_user_display_by_email_async(db, email)
+    return await run_in_threadpool(_load_user_sync, email)
+
+def get_token_email(request: Request) -> str:
+    """Lowercased email from a valid auth cookie, or None"""
+    token = request.cookies.get("access_token")
+    payload = decode_token(token) if token else None
+    email = payload.get("sub") if payload else None
+    return email.lower() if email else None
+
+def remember_user(request: Request, user: UserDisplay):
+    """Record a user loaded by other means (e.g. the dashboard snapshot) as the request's user"""
+    request.state.current_user = user
+    if user is not None:
+        user_cache.set(user.email.lower(), user)
+
+async def get_current_user(request: Request) -> UserDisplay:
+    """Resolve the user from the auth cookie once per request, backed by user_cache"""
+    cached = getattr(request.state, "current_user", _UNRESOLVED)
+    if cached is not _UNRESOLVED:
+        return cached
+
+    user = None
+    try:
+        email = get_token_email(request)
+        if email:
+            user = user_cache.get(email)
+            if user is None:
+                user = await _load_user(email)
+                if user is not None:
+                    user_cache.set(email, user)
+    except Exception as e:
+        print(f"Error resolving current user: {str(e)}")
+        user = None
+
+    request.state.current_user = user
+    return user
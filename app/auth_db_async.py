@@ -0,0 +1,178 @@
+"""
+Awaitable counterparts of the app.auth_db query functions
+
+With DB_ASYNC enabled the routes get an AsyncSession and these run the same raw SQL
+on the asyncio engine. With a sync Session they fall back to the app.auth_db
+functions in the threadpool, so callers never block the event loop either way.
+"""
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import text
+from starlette.concurrency import run_in_threadpool
+from app import auth_db
+from app.auth_db import (
+    User,
+    UserAuth,
+    UserDisplay,
+    DashboardSnapshot,
+    make_order_row,
+    SELECT_USER_BY_EMAIL,
+    SELECT_USER_AUTH_BY_EMAIL,
+    SELECT_USER_DISPLAY_BY_EMAIL,
+    SELECT_USER_BY_ID,
+    SELECT_USER_EXISTS,
+    INSERT_USER,
+    SELECT_USER_ORDERS,
+    ORDERS_PAGE_SIZE,
+    order_query,
+    order_page_params,
+    order_page_from_rows,
+    dashboard_snapshot_query,
+    snapshot_from_rows,
+    user_from_row,
+    user_auth_from_row,
+    user_display_from_row,
+    invalidate_user
+)
+from app.hashing import password_hasher
+from datetime import datetime
+import uuid
+
+async def _rollback(db: AsyncSession):
+    try:
+        await db.rollback()
+    except:
+        pass
+
+async def get_user_by_email(db, email: str) -> User:
+    """Get user by email using raw SQL"""
+    if not isinstance(db, AsyncSession):
+        return await run_in_threadpool(auth_db.get_user_by_email, db, email)
+    try:
+        result = await db.execute(text(SELECT_USER_BY_EMAIL), {"email": email.lower()})
+        return user_from_row(result.fetchone())
+    except Exception as e:
+        print(f"Error getting user by email: {str(e)}")
+        await _rollback(db)
+        return None
+
+async def get_user_for_auth(db, email: str) -> UserAuth:
+    """Get the id, email and password hash needed to check a login"""
+    if not isinstance(db, AsyncSession):
+        return await run_in_threadpool(auth_db.get_user_for_auth, db, email)
+    try:
+        result = await db.execute(text(SELECT_USER_AUTH_BY_EMAIL), {"email": email.lower()})
+        return user_auth_from_row(result.fetchone())
+    except Exception as e:
+        print(f"Error getting user for auth: {str(e)}")
+        await _rollback(db)
+        return None
+
+async def get_user_display_by_email(db, email: str) -> UserDisplay:
+    """Get the id, name and email needed to render pages"""
+    if not isinstance(db, AsyncSession):
+        return await run_in_threadpool(auth_db.get_user_display_by_email, db, email)
+    try:
+        result = await db.execute(text(SELECT_USER_DISPLAY_BY_EMAIL), {"email": email.lower()})
+        return user_display_from_row(result.fetchone())
+    except Exception as e:
+        print(f"Error getting user for display: {str(e)}")
+        await _rollback(db)
+        return None
+
+async def get_user_by_id(db, user_id: str) -> User:
+    """Get user by ID using raw SQL"""
+    if not isinstance(db, AsyncSession):
+        return await run_in_threadpool(auth_db.get_user_by_id, db, user_id)
+    try:
+        result = await db.execute(text(SELECT_USER_BY_ID), {"id": user_id})
+        return user_from_row(result.fetchone())
+    except Exception as e:
+        print(f"Error getting user by ID: {str(e)}")
+        await _rollback(db)
+        return None
+
+async def create_user(db, name: str, email: str, password: str, hashed_password: str = None) -> User:
+    """Create a new user using raw SQL, hashing the password on the worker pool"""
+    if hashed_password is None:
+        hashed_password = await password_hasher.hash(password)
+    if not isinstance(db, AsyncSession):
+        return await run_in_threadpool(auth_db.create_user, db, name, email, password, hashed_password)
+    try:
+        user_id = str(uuid.uuid4())
+        now = datetime.utcnow()
+
+        await db.execute(
+            text(INSERT_USER),
+            {
+                "id": user_id,
+                "name": name,
+                "email": email.lower(),
+                "password": hashed_password,
+                "createdAt": now,
+                "updatedAt": now
+            }
+        )
+        await db.commit()
+        invalidate_user(email)
+
+        return User(
+            id=user_id,
+            name=name,
+            email=email.lower(),
+            password=hashed_password,
+            createdAt=now,
+            updatedAt=now
+        )
+    except Exception as e:
+        print(f"Error creating user: {str(e)}")
+        await _rollback(db)
+        raise
+
+async def user_exists(db, email: str) -> bool:
+    """Check if user exists using raw SQL"""
+    if not isinstance(db, AsyncSession):
+        return await run_in_threadpool(auth_db.user_exists, db, email)
+    try:
+        result = await db.execute(text(SELECT_USER_EXISTS), {"email": email.lower()})
+        return result.fetchone() is not None
+    except Exception as e:
+        print(f"Error checking if user exists: {str(e)}")
+        await _rollback(db)
+        return False
+
+async def get_user_orders(db, user_id: str):
+    """Get user's orders using raw SQL"""
+    if not isinstance(db, AsyncSession):
+        return await run_in_threadpool(auth_db.get_user_orders, db, user_id)
+    try:
+        result = await db.execute(order_query(SELECT_USER_ORDERS), {"userId": user_id})
+        return list(map(make_order_row, result.fetchall()))
+    except Exception as e:
+        print(f"Error getting user orders: {str(e)}")
+        await _rollback(db)
+        return []
+
+async def get_user_orders_page(db, user_id: str, limit: int = ORDERS_PAGE_SIZE, after: str = None):
+    """Get one keyset page of a user's orders, newest first; returns (orders, next_cursor)"""
+    if not isinstance(db, AsyncSession):
+        return await run_in_threadpool(auth_db.get_user_orders_page, db, user_id, limit, after)
+    try:
+        sql, params = order_page_params(user_id, limit, after)
+        result = await db.execute(order_query(sql), params)
+        return order_page_from_rows(result.fetchall(), limit)
+    except Exception as e:
+        print(f"Error getting user orders page: {str(e)}")
+        await _rollback(db)
+        return [], None
+
+async def get_dashboard_snapshot(db, email: str, limit: int = ORDERS_PAGE_SIZE) -> DashboardSnapshot:
+    """Get the user, first page of orders and summary counters in a single query"""
+    if not isinstance(db, AsyncSession):
+        return await run_in_threadpool(auth_db.get_dashboard_snapshot, db, email, limit)
+    try:
+        result = await db.execute(dashboard_snapshot_query(), {"email": email.lower(), "limit": limit + 1})
+        return snapshot_from_rows(result.fetchall(), limit)
+    except Exception as e:
+        print(f"Error getting dashboard snapshot: {str(e)}")
+        await _rollback(db)
+        return None
@@ -0,0 +1,68 @@
+"""
+Business identity: normalized names and addresses, and content keys built from them
+
+Users type the same business in many ways ("Joe's Pizza, 12 Main Street" vs
+"JOES PIZZA  12 main st."). normalize_name and normalize_address fold those onto
+one form so analysis results can be shared between orders for the same business.
+"""
+import hashlib
+import re
+import unicodedata
+
+# Bump when the analysis output changes so old cached results stop matching
+ANALYSIS_VERSION = "1"
+
+STREET_SUFFIXES = {
+    "street": "st", "str": "st", "avenue": "ave", "av": "ave", "avn": "ave", "road": "rd",
+    "boulevard": "blvd", "boul": "blvd", "drive": "dr", "drv": "dr", "lane": "ln",
+    "court": "ct", "place": "pl", "plaza": "plz", "square": "sq", "terrace": "ter",
+    "parkway": "pkwy", "pky": "pkwy", "highway": "hwy", "expressway": "expy", "freeway": "fwy",
+    "circle": "cir", "crescent": "cres", "way": "way", "alley": "aly", "center": "ctr",
+    "centre": "ctr", "suite": "ste", "apartment": "apt", "building": "bldg", "floor": "fl",
+    "unit": "unit", "room": "rm", "mount": "mt", "fort": "ft", "saint": "st",
+    "north": "n", "south": "s", "east": "e", "west": "w",
+    "northeast": "ne", "northwest": "nw", "southeast": "se", "southwest": "sw",
+}
+# Articles and company forms that do not distinguish one business from another
+NAME_STOPWORDS = {"the", "llc", "inc", "ltd", "co", "corp", "company"}
+
+_APOSTROPHES = re.compile(r"['’`]")
+_NON_WORD = re.compile(r"[^a-z0-9]+")
+
+def _fold(value: str) -> str:
+    """Lowercase ASCII with accents stripped, apostrophes dropped and other punctuation as spaces"""
+    value = unicodedata.normalize("NFKD", value or "")
+    value = value.encode("ascii", "ignore").decode("ascii").lower()
+    value = _APOSTROPHES.sub("", value.replace("&", " and "))
+    return _NON_WORD.sub(" ", value).strip()
+
+def normalize_name(name: str) -> str:
+    words = [word for word in _fold(name).split() if word not in NAME_STOPWORDS]
+    # A name made only of stopwords ("The Company") keeps them
+    return " ".join(words) or _fold(name)
+
+def normalize_address(address: str) -> str:
+    return " ".join(STREET_SUFFIXES.get(word, word) for word in _fold(address).split())
+
+def business_key(name: str, address: str) -> str:
+    """Stable identifier of a business"""
+    identity = f"{normalize_name(name)}\n{normalize_address(address)}"
+    return hashlib.sha256(identity.encode()).hexdigest()
+
+def result_key(name: str, address: str, reviews_digest: int) -> str:
+    """Content hash of everything an analysis depends on: the business, its review set
+    and the analysis version"""
+    content = f"{business_key(name, address)}\n{reviews_digest}\n{ANALYSIS_VERSION}"
+    return hashlib.sha256(content.encode()).hexdigest()
+
+# Review-set digest: order-independent sum of per-review hashes, kept below 2**62 so
+# the running total can be updated with plain BIGINT arithmetic in SQL
+DIGEST_MODULUS = 1 << 62
+
+def review_digest(rows) -> int:
+    """Digest contribution of a batch of (rating, body, published_at) reviews"""
+    total = 0
+    for rating, body, published_at in rows:
+        content = f"{rating}\x1f{published_at.isoformat() if published_at else ''}\x1f{body}"
+        total += int.from_bytes(hashlib.blake2b(content.encode(), digest_size=8).digest(), "little")
+    return total % DIGEST_MODULUS
@@ -1,8 +1,11 @@
 from sqlalchemy import create_engine, event
-from sqlalchemy.orm import sessionmaker
-from sqlalchemy.pool import NullPool
+from sqlalchemy.orm import sessionmaker, Session
+from sqlalchemy.pool import NullPool, QueuePool, AsyncAdaptedQueuePool
+from app import metrics
 import os
 import sys
+import threading
+import time
 
 # Get database URL from environment variable
 DATABASE_URL = os.getenv("DATABASE_URL")
@@ -41,25 +44,119 @@ if "sslmode" not in DATABASE_URL and (("render.com" in DATABASE_URL) or ("intern
 
 print(f"Database connection configured", file=sys.stderr)
 
+IS_SQLITE = DATABASE_URL.startswith("sqlite")
+
+# Opt-in asyncio engine (asyncpg, or aiosqlite for a local SQLite stand-in)
+DB_ASYNC = os.getenv("DB_ASYNC", "false").lower() == "true"
+
+if IS_SQLITE:
+    # Local stand-in: sessions are used from the threadpool
+    connect_args = {"check_same_thread": False}
+else:
+    connect_args = {
+        "connect_timeout": 10,
+        "application_name": "ai_review_analyzer"
+    }
+
+# Connection pool sizing. Pre-ping is off by default: instead of an extra round
+# trip on every checkout, a connection that fails with a disconnect error is
+# invalidated (together with the rest of the pool) and the next checkout reconnects.
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "3600"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "false").lower() == "true"
+
+class PoolStats:
+    """Counters for one engine's connection pool"""
+    def __init__(self):
+        self.checkout_wait = metrics.LatencyHistogram()
+        self.connects = 0
+        self.invalidations = 0
+        self.disconnect_errors = 0
+        self.pool = None
+        self._lock = threading.Lock()
+
+    def incr(self, name: str):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def snapshot(self) -> dict:
+        pool = self.pool
+        live = {}
+        if pool is not None and isinstance(pool, QueuePool):
+            live = {
+                "size": pool.size(),
+                "checked_out": pool.checkedout(),
+                "checked_in": pool.checkedin(),
+                "overflow_in_use": max(0, pool.overflow()),
+            }
+        return {
+            **live,
+            "connects": self.connects,
+            "invalidations": self.invalidations,
+            "disconnect_errors": self.disconnect_errors,
+            "checkout_wait": self.checkout_wait.snapshot(),
+        }
+
+def _instrumented(pool_class, stats: PoolStats):
+    """Subclass a queue pool so the time spent waiting for a connection is recorded"""
+    class InstrumentedPool(pool_class):
+        def _do_get(self):
+            start = time.perf_counter()
+            try:
+                return super()._do_get()
+            finally:
+                stats.checkout_wait.observe(time.perf_counter() - start)
+
+        def recreate(self):
+            # Pool invalidation rebuilds the pool; keep the stats pointing at the live one
+            new_pool = super().recreate()
+            stats.pool = new_pool
+            return new_pool
+
+    return InstrumentedPool
+
+def instrument_engine(sync_engine, stats: PoolStats):
+    """Attach pool and error listeners for the given (sync) engine"""
+    stats.pool = sync_engine.pool
+
+    @event.listens_for(sync_engine, "handle_error")
+    def receive_handle_error(context):
+        if context.is_disconnect:
+            stats.incr("disconnect_errors")
+
+    @event.listens_for(sync_engine.pool, "invalidate")
+    def receive_invalidate(dbapi_conn, connection_record, exception):
+        stats.incr("invalidations")
+
+    @event.listens_for(sync_engine.pool, "soft_invalidate")
+    def receive_soft_invalidate(dbapi_conn, connection_record, exception):
+        stats.incr("invalidations")
+
+pool_stats = PoolStats()
+
 # Create engine with proper configuration for Render
 try:
     engine = create_engine(
         DATABASE_URL,
-        pool_pre_ping=True,  # Test connections before using them
-        pool_recycle=3600,   # Recycle connections every hour
-        connect_args={
-            "connect_timeout": 10,
-            "application_name": "ai_review_analyzer"
-        },
+        poolclass=_instrumented(QueuePool, pool_stats),
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_pre_ping=DB_POOL_PRE_PING,
+        pool_recycle=DB_POOL_RECYCLE,   # Seconds before a connection is replaced (DB_POOL_RECYCLE)
+        connect_args=connect_args,
         echo=False  # Set to True for SQL debugging
     )
     
-    # Configure the dialect to not quote identifiers
+    # Count new DBAPI connections, so pool churn shows up in db_pool stats
     @event.listens_for(engine, "connect")
     def receive_connect(dbapi_conn, connection_record):
-        # This ensures we use the exact table names without quoting
-        pass
+        pool_stats.incr("connects")
     
+    instrument_engine(engine, pool_stats)
+    metrics.register("db_pool", pool_stats.snapshot)
     print("Database engine created successfully", file=sys.stderr)
 except Exception as e:
     print(f"ERROR creating database engine: {str(e)}", file=sys.stderr)
@@ -67,9 +164,131 @@ except Exception as e:
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+def get_async_database_url(url: str) -> tuple[str, dict]:
+    """Translate the sync DATABASE_URL into an asyncio driver URL and connect args"""
+    if url.startswith("sqlite"):
+        return url.replace("sqlite://", "sqlite+aiosqlite://", 1), {}
+
+    async_url = url.replace("postgresql://", "postgresql+asyncpg://", 1)
+    async_connect_args = {
+        "timeout": 10,
+        "server_settings": {"application_name": "ai_review_analyzer"}
+    }
+    # asyncpg takes ssl as a connect argument rather than libpq's sslmode
+    if "sslmode=" in async_url:
+        base, _, query = async_url.partition("?")
+        params = [p for p in query.split("&") if p and not p.startswith("sslmode=")]
+        async_url = base + ("?" + "&".join(params) if params else "")
+        async_connect_args["ssl"] = "require"
+    return async_url, async_connect_args
+
+async_engine = None
+AsyncSessionLocal = None
+
+if DB_ASYNC:
+    from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+
+    try:
+        ASYNC_DATABASE_URL, async_connect_args = get_async_database_url(DATABASE_URL)
+        async_pool_stats = PoolStats()
+        async_engine = create_async_engine(
+            ASYNC_DATABASE_URL,
+            poolclass=_instrumented(AsyncAdaptedQueuePool, async_pool_stats),
+            pool_size=DB_POOL_SIZE,
+            max_overflow=DB_MAX_OVERFLOW,
+            pool_timeout=DB_POOL_TIMEOUT,
+            pool_pre_ping=DB_POOL_PRE_PING,
+            pool_recycle=DB_POOL_RECYCLE,
+            connect_args=async_connect_args,
+            echo=False
+        )
+
+        @event.listens_for(async_engine.sync_engine, "connect")
+        def receive_async_connect(dbapi_conn, connection_record):
+            async_pool_stats.incr("connects")
+
+        instrument_engine(async_engine.sync_engine, async_pool_stats)
+        metrics.register("async_db_pool", async_pool_stats.snapshot)
+        AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+        print("Async database engine created successfully", file=sys.stderr)
+    except Exception as e:
+        print(f"ERROR creating async database engine: {str(e)}", file=sys.stderr)
+        raise
+
+class SessionStats:
+    """How many request-scoped sessions actually needed a database connection"""
+    def __init__(self):
+        self.requests = 0
+        self.connected = 0
+        self._lock = threading.Lock()
+
+    def record(self, connected: bool):
+        with self._lock:
+            self.requests += 1
+            if connected:
+                self.connected += 1
+
+    def snapshot(self) -> dict:
+        return {
+            "requests": self.requests,
+            "connected": self.connected,
+            "without_connection": self.requests - self.connected,
+        }
+
+session_stats = SessionStats()
+metrics.register("db_sessions", session_stats.snapshot)
+
+@event.listens_for(Session, "after_begin")
+def receive_after_begin(session, transaction, connection):
+    # Fires once a session has checked out a connection
+    session.info["connected"] = True
+
+class LazySession:
+    """Session proxy that creates the real Session on first use (e.g. the first execute)"""
+    def __init__(self, factory=None):
+        self._factory = factory or SessionLocal
+        self._session = None
+
+    @property
+    def session(self) -> Session:
+        if self._session is None:
+            self._session = self._factory()
+        return self._session
+
+    @property
+    def connected(self) -> bool:
+        return self._session is not None and self._session.info.get("connected", False)
+
+    def __getattr__(self, name):
+        return getattr(self.session, name)
+
+    def commit(self):
+        if self._session is not None:
+            self._session.commit()
+
+    def rollback(self):
+        if self._session is not None:
+            self._session.rollback()
+
+    def close(self):
+        if self._session is not None:
+            self._session.close()
+
 def get_db():
-    db = SessionLocal()
+    db = LazySession()
     try:
         yield db
     finally:
+        session_stats.record(db.connected)
         db.close()
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        try:
+            yield db
+        finally:
+            session_stats.record(db.sync_session.info.get("connected", False))
+
+# Session dependency for routes that use app.auth_db_async: an AsyncSession
+# when DB_ASYNC is on, otherwise a sync Session whose queries run in the threadpool
+get_session = get_async_db if DB_ASYNC else get_db
@@ -0,0 +1,318 @@
+"""
+Near-duplicate review detection with MinHash and LSH banding
+
+Each review is reduced to the set of its word shingles (DEDUP_SHINGLE_SIZE words in
+a row), and the set to a MinHash signature of DEDUP_NUM_PERM values; the fraction of
+equal signature values estimates the Jaccard similarity of two reviews. Signatures
+are split into bands and each band is hashed into a bucket, so only reviews sharing
+a bucket are compared: the whole pass is linear in the number of reviews instead of
+quadratic. A review whose estimated similarity to an earlier one reaches
+DEDUP_THRESHOLD is flagged as a duplicate.
+
+At ingest the index lives in the database (StoredDedupIndex): each distinct review's
+signature and the band buckets it opened are stored per order, so a later dump is
+checked against the order's history without re-reading or holding it in memory.
+"""
+from itertools import repeat
+from sqlalchemy import text
+from app.models import ReviewSignature, ReviewBand
+import json
+import os
+import re
+import zlib
+import numpy as np
+
+DEDUP_ENABLED = os.getenv("DEDUP_ENABLED", "true").lower() == "true"
+DEDUP_THRESHOLD = float(os.getenv("DEDUP_THRESHOLD", "0.7"))
+DEDUP_NUM_PERM = int(os.getenv("DEDUP_NUM_PERM", "64"))
+DEDUP_SHINGLE_SIZE = int(os.getenv("DEDUP_SHINGLE_SIZE", "3"))
+
+SEPARATOR = "\x1e"
+TOKEN_RE = re.compile(r"[a-z0-9][a-z0-9']*|\x1e")
+
+# Multiply-shift hashing of 32-bit shingle hashes: ((a * x + b) mod 2**64) >> 32
+_SHIFT = np.uint64(32)
+_MAX_HASH = np.uint32(0xFFFFFFFF)
+_MIX = (np.uint64(0x9E3779B97F4A7C15), np.uint64(0xC2B2AE3D27D4EB4F), np.uint64(0x165667B19E3779F9))
+# Rows of the (shingles x permutations) matrix reduced at a time
+_BLOCK_ROWS = 16384
+
+def choose_bands(num_perm: int, threshold: float):
+    """(bands, rows) with bands * rows == num_perm whose LSH threshold (1/b)^(1/r)
+    is closest to, but not above, threshold, so candidates err towards recall"""
+    best = None
+    for rows in range(1, num_perm + 1):
+        if num_perm % rows:
+            continue
+        bands = num_perm // rows
+        estimate = (1 / bands) ** (1 / rows)
+        if estimate <= threshold and (best is None or estimate > best[0]):
+            best = (estimate, bands, rows)
+    return (best[1], best[2]) if best else (num_perm, 1)
+
+class MinHasher:
+    """Computes MinHash signatures for batches of texts"""
+    def __init__(self, num_perm: int = DEDUP_NUM_PERM, shingle_size: int = DEDUP_SHINGLE_SIZE, seed: int = 1):
+        rng = np.random.default_rng(seed)
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        self.a = rng.integers(0, 2 ** 64 - 1, size=num_perm, dtype=np.uint64, endpoint=True) | np.uint64(1)
+        self.b = rng.integers(0, 2 ** 64 - 1, size=num_perm, dtype=np.uint64, endpoint=True)
+        self._token_hashes = {SEPARATOR: 0}
+
+    def _hash_tokens(self, tokens) -> np.ndarray:
+        cache = self._token_hashes
+        try:
+            return np.fromiter(map(cache.__getitem__, tokens), dtype=np.uint64, count=len(tokens))
+        except KeyError:
+            for token in set(tokens).difference(cache):
+                # crc32 rather than hash() so signatures are stable across processes; never 0
+                cache[token] = zlib.crc32(token.encode()) or 1
+            return np.fromiter(map(cache.__getitem__, tokens), dtype=np.uint64, count=len(tokens))
+
+    def shingles(self, texts):
+        """Flat 32-bit shingle hashes sorted by review, and per-review offsets"""
+        count = len(texts)
+        joined = SEPARATOR.join(texts)
+        if joined.count(SEPARATOR) != max(0, count - 1):
+            joined = SEPARATOR.join(t.replace(SEPARATOR, " ") for t in texts)
+        hashes = self._hash_tokens(TOKEN_RE.findall(joined.lower()))
+        is_separator = hashes == 0
+        review = np.cumsum(is_separator)[~is_separator]
+        hashes = hashes[~is_separator]
+        lengths = np.bincount(review, minlength=count) if count else np.zeros(0, dtype=np.int64)
+
+        size = self.shingle_size
+        parts, owners = [], []
+        if len(hashes) >= size:
+            span = len(hashes) - size + 1
+            valid = review[:span] == review[size - 1:]
+            mixed = np.zeros(span, dtype=np.uint64)
+            for position in range(size):
+                mixed ^= hashes[position:position + span] * _MIX[position % len(_MIX)]
+                mixed = (mixed << np.uint64(13)) | (mixed >> np.uint64(51))
+            parts.append((mixed[valid] >> np.uint64(32)) ^ (mixed[valid] & np.uint64(0xFFFFFFFF)))
+            owners.append(review[:span][valid])
+        # Reviews shorter than one shingle fall back to their individual words
+        short = lengths[review] < size
+        parts.append(hashes[short])
+        owners.append(review[short])
+
+        shingles = np.concatenate(parts)
+        owners = np.concatenate(owners)
+        order = np.argsort(owners, kind="stable")
+        offsets = np.zeros(count + 1, dtype=np.int64)
+        np.cumsum(np.bincount(owners, minlength=count), out=offsets[1:])
+        return shingles[order], offsets
+
+    def signatures(self, texts) -> np.ndarray:
+        """(len(texts), num_perm) uint32 signatures; rows of all-ones for texts without words"""
+        texts = list(texts)
+        shingles, offsets = self.shingles(texts)
+        count = len(texts)
+        result = np.full((count, self.num_perm), _MAX_HASH, dtype=np.uint32)
+        nonempty = np.flatnonzero(np.diff(offsets) > 0)
+        start = 0
+        while start < len(nonempty):
+            # Take whole reviews until the block holds about _BLOCK_ROWS shingles
+            first = offsets[nonempty[start]]
+            end = max(start + 1, int(np.searchsorted(offsets[nonempty + 1], first + _BLOCK_ROWS, side="right")))
+            reviews = nonempty[start:end]
+            block = shingles[first:offsets[reviews[-1] + 1]]
+            # (permutations x shingles) so the per-review minimum runs over contiguous memory
+            permuted = np.empty((self.num_perm, len(block)), dtype=np.uint64)
+            np.multiply(self.a[:, None], block[None, :], out=permuted)
+            permuted += self.b[:, None]
+            permuted >>= _SHIFT
+            result[reviews] = np.minimum.reduceat(permuted.astype(np.uint32), offsets[reviews] - first, axis=1).T
+            start = end
+        return result
+
+class BandTable:
+    """Band hash -> representative for one LSH band, kept as sorted NumPy runs that
+    are merged like a binary counter: O(log n) runs, about 12 bytes per entry"""
+    def __init__(self):
+        self.runs = []
+
+    def lookup(self, keys: np.ndarray) -> np.ndarray:
+        """Representative for each key, -1 where the key is absent"""
+        found = np.full(len(keys), -1, dtype=np.int64)
+        for run_keys, run_values in self.runs:
+            positions = np.minimum(np.searchsorted(run_keys, keys), len(run_keys) - 1)
+            hit = (run_keys[positions] == keys) & (found < 0)
+            found[hit] = run_values[positions[hit]]
+        return found
+
+    def add(self, keys: np.ndarray, values: np.ndarray):
+        if len(keys) == 0:
+            return
+        order = np.argsort(keys, kind="stable")
+        self.runs.append((keys[order], values[order]))
+        while len(self.runs) > 1 and len(self.runs[-2][0]) <= 2 * len(self.runs[-1][0]):
+            newer_keys, newer_values = self.runs.pop()
+            older_keys, older_values = self.runs.pop()
+            merged_keys = np.concatenate([older_keys, newer_keys])
+            merged_values = np.concatenate([older_values, newer_values])
+            order = np.argsort(merged_keys, kind="stable")
+            self.runs.append((merged_keys[order], merged_values[order]))
+
+class DedupIndex:
+    """LSH index over the signatures of the distinct reviews seen so far, held in memory"""
+    def __init__(self, threshold: float = DEDUP_THRESHOLD, num_perm: int = DEDUP_NUM_PERM,
+                 shingle_size: int = DEDUP_SHINGLE_SIZE):
+        self.threshold = threshold
+        self.hasher = MinHasher(num_perm, shingle_size)
+        self.bands, self.rows = choose_bands(num_perm, threshold)
+        self.tables = [BandTable() for _ in range(self.bands)]
+        self.representatives = np.zeros((1024, num_perm), dtype=np.uint32)
+        self.size = 0
+        self.seen = 0
+        self.duplicates = 0
+        self.comparisons = 0
+
+    def _band_keys(self, signatures: np.ndarray) -> np.ndarray:
+        bands = signatures[:, :self.bands * self.rows].reshape(len(signatures), self.bands, self.rows).astype(np.uint64)
+        keys = np.zeros((len(signatures), self.bands), dtype=np.uint64)
+        for row in range(self.rows):
+            keys = keys * np.uint64(1000003) ^ bands[:, :, row]
+        return keys
+
+    def _lookup(self, keys: np.ndarray) -> list:
+        """Representative already in each (row, band) bucket of keys, -1 where empty"""
+        return np.stack([table.lookup(keys[:, band]) for band, table in enumerate(self.tables)], axis=1).tolist()
+
+    def _signature(self, representative: int) -> np.ndarray:
+        return self.representatives[representative]
+
+    def _remember(self, signature: np.ndarray) -> int:
+        if self.size == len(self.representatives):
+            grown = np.zeros((self.size * 2, self.hasher.num_perm), dtype=np.uint32)
+            grown[:self.size] = self.representatives
+            self.representatives = grown
+        self.representatives[self.size] = signature
+        self.size += 1
+        return self.size - 1
+
+    def _index(self, buckets: list):
+        """Add the batch's new buckets, a {key: representative} dict per band"""
+        for table, bucket in zip(self.tables, buckets):
+            if bucket:
+                table.add(np.fromiter(bucket.keys(), dtype=np.uint64, count=len(bucket)),
+                          np.fromiter(bucket.values(), dtype=np.int64, count=len(bucket)))
+
+    def add_batch(self, texts) -> np.ndarray:
+        """Index a batch of texts in order; returns a boolean array, True for near-duplicates
+        of an earlier text (in this batch or a previous one)"""
+        signatures = self.hasher.signatures(texts)
+        keys = self._band_keys(signatures)
+        # Candidates from earlier batches, looked up for the whole batch at once
+        earlier = self._lookup(keys)
+        empty = (signatures == _MAX_HASH).all(axis=1)
+        flags = np.zeros(len(signatures), dtype=bool)
+        # Buckets first filled by this batch's distinct reviews, indexed at the end
+        current = [{} for _ in range(self.bands)]
+        needed = self.threshold * self.hasher.num_perm
+        for i, row_keys in enumerate(keys.tolist()):
+            if empty[i]:
+                continue
+            candidates = {candidate for candidate in earlier[i] if candidate >= 0}
+            candidates.update(bucket[key] for bucket, key in zip(current, row_keys) if key in bucket)
+            signature = signatures[i]
+            for candidate in candidates:
+                self.comparisons += 1
+                if np.count_nonzero(self._signature(candidate) == signature) >= needed:
+                    flags[i] = True
+                    break
+            if not flags[i]:
+                representative = self._remember(signature)
+                for bucket, key, found in zip(current, row_keys, earlier[i]):
+                    if found < 0:
+                        bucket.setdefault(key, representative)
+        self._index(current)
+        self.seen += len(flags)
+        self.duplicates += int(flags.sum())
+        return flags
+
+SELECT_NEXT_SEQ = 'SELECT COALESCE(MAX(seq) + 1, 0) FROM "ReviewSignature" WHERE order_id = :order_id'
+
+SELECT_BUCKETS = """
+SELECT b.key, b.band, b.seq, s.signature
+FROM "ReviewBand" b JOIN "ReviewSignature" s ON s.order_id = b.order_id AND s.seq = b.seq
+WHERE b.order_id = :order_id AND b.key {match}
+"""
+
+BAND_COLUMNS = ("order_id", "key", "band", "seq")
+# qmark placeholders: only used on SQLite, through the driver's executemany
+INSERT_BANDS = 'INSERT INTO "ReviewBand" (order_id, key, band, seq) VALUES (?, ?, ?, ?)'
+
+class StoredDedupIndex(DedupIndex):
+    """DedupIndex over an order's "ReviewSignature" and "ReviewBand" rows, so ingest
+    memory is bounded by the chunk rather than the order's history. Each batch's
+    candidates are fetched with one indexed lookup; its new signatures and buckets
+    are written in the caller's transaction."""
+    def __init__(self, db, order_id: str, **kwargs):
+        super().__init__(**kwargs)
+        self.db = db
+        self.order_id = order_id
+        self.postgres = db.get_bind().dialect.name == "postgresql"
+        self.next_seq = db.execute(text(SELECT_NEXT_SEQ), {"order_id": order_id}).scalar()
+        self._signatures = {}
+        self._new_signatures = []
+
+    def _lookup(self, keys: np.ndarray) -> list:
+        # Band keys are unsigned 64-bit; BIGINT columns hold them reinterpreted as signed
+        signed = keys.view(np.int64)
+        wanted = np.unique(signed).tolist()
+        if self.postgres:
+            query, params = text(SELECT_BUCKETS.format(match="= ANY(:keys)")), {"keys": wanted}
+        else:
+            # One JSON array parameter instead of one bound parameter per key
+            query = text(SELECT_BUCKETS.format(match="IN (SELECT value FROM json_each(:keys))"))
+            params = {"keys": json.dumps(wanted)}
+        found = {}
+        self._signatures = {}
+        for key, band, seq, signature in self.db.execute(query, {"order_id": self.order_id, **params}):
+            found[(band, key)] = seq
+            if seq not in self._signatures:
+                self._signatures[seq] = np.frombuffer(bytes(signature), dtype=np.uint32)
+        if not found:
+            return np.full(keys.shape, -1, dtype=np.int64).tolist()
+        return [[found.get((band, key), -1) for band, key in enumerate(row)] for row in signed.tolist()]
+
+    def _signature(self, representative: int) -> np.ndarray:
+        return self._signatures[representative]
+
+    def _remember(self, signature: np.ndarray) -> int:
+        seq = self.next_seq
+        self.next_seq += 1
+        self._signatures[seq] = signature
+        self._new_signatures.append({"order_id": self.order_id, "seq": seq, "signature": signature.tobytes()})
+        return seq
+
+    def _index(self, buckets: list):
+        if self._new_signatures:
+            self.db.execute(ReviewSignature.__table__.insert(), self._new_signatures)
+            self._new_signatures = []
+        rows = []
+        for band, bucket in enumerate(buckets):
+            if bucket:
+                signed = np.fromiter(bucket.keys(), dtype=np.uint64, count=len(bucket)).view(np.int64).tolist()
+                rows.extend(zip(repeat(self.order_id), signed, repeat(band), bucket.values()))
+        if rows:
+            if self.postgres:
+                self.db.execute(ReviewBand.__table__.insert(), [dict(zip(BAND_COLUMNS, row)) for row in rows])
+            else:
+                # Plain tuples straight to the driver; a chunk opens tens of thousands of buckets
+                self.db.connection().exec_driver_sql(INSERT_BANDS, rows)
+        self._signatures = {}
+
+def seed_index(db, index: StoredDedupIndex, batch_size: int = 5000):
+    """Index the order's existing distinct reviews, for orders ingested before their
+    signatures were stored; streams them, so memory stays bounded by batch_size"""
+    result = db.execute(
+        text('SELECT body FROM "Review" WHERE order_id = :order_id AND NOT is_duplicate ORDER BY id'),
+        {"order_id": index.order_id},
+        execution_options={"stream_results": True, "yield_per": batch_size}
+    )
+    for rows in result.partitions(batch_size):
+        index.add_batch([row[0] for row in rows])
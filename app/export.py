@@ -0,0 +1,195 @@
+"""
+Streaming exports of an order's analysis for Pro and Enterprise customers
+
+Per-review scores and the per-week aggregate table are written as CSV or NDJSON
+a chunk at a time from a server-side cursor, so memory use does not depend on the
+size of the order. Reviews are re-scored chunk by chunk with app.analysis.Analyzer.
+
+Downloads can be resumed with a row range, "Range: rows=N-", which skips the first
+N data rows (and, for CSV, the header), and gzip-compressed on the fly.
+"""
+from typing import NamedTuple
+from sqlalchemy import text, column, BigInteger, Text, Integer, DateTime, Boolean, LargeBinary
+from app.analysis import Analyzer, polarity
+from app.database import SessionLocal
+from app.sketches import KLLSketch
+from app.stripe_config import PRICING_PLANS
+import csv
+import io
+import json
+import os
+import re
+import zlib
+
+EXPORT_CHUNK_ROWS = int(os.getenv("EXPORT_CHUNK_ROWS", "5000"))
+EXPORT_GZIP_LEVEL = int(os.getenv("EXPORT_GZIP_LEVEL", "6"))
+# Plans whose customers may export
+EXPORT_PLANS = ("pro", "enterprise")
+
+FORMATS = {"csv": "text/csv; charset=utf-8", "ndjson": "application/x-ndjson"}
+POLARITY_NAMES = ("negative", "neutral", "positive")
+
+SELECT_EXPORT_ORDER = 'SELECT "userId", business_name, review_count FROM "Order" WHERE id = :id'
+
+SELECT_MAX_PAYMENT = """
+SELECT MAX(amount) FROM "Payment" WHERE "userId" = :user_id AND status = 'succeeded'
+"""
+
+SELECT_EXPORT_REVIEWS = """
+SELECT id, external_id, author, rating, published_at, is_duplicate, body
+FROM "Review" WHERE order_id = :order_id ORDER BY id LIMIT :limit OFFSET :skip
+"""
+
+SELECT_AGGREGATE_COUNT = 'SELECT COUNT(*) FROM "ReportAggregate" WHERE order_id = :order_id'
+
+SELECT_EXPORT_AGGREGATES = """
+SELECT bucket, review_count, sentiment_sum, negative_count, neutral_count, positive_count,
+       rating_1, rating_2, rating_3, rating_4, rating_5, sentiment_sketch
+FROM "ReportAggregate" WHERE order_id = :order_id ORDER BY bucket LIMIT :limit OFFSET :skip
+"""
+
+REVIEW_FIELDS = ("review_id", "external_id", "author", "rating", "published_at", "is_duplicate", "sentiment", "polarity")
+AGGREGATE_FIELDS = ("bucket", "reviews", "average_sentiment", "median_sentiment", "negative", "neutral", "positive",
+                    "rating_1", "rating_2", "rating_3", "rating_4", "rating_5")
+
+_RANGE = re.compile(r"^\s*rows\s*=\s*(\d+)\s*-\s*$")
+
+class ExportError(Exception):
+    """An export that cannot be served; status is the HTTP status to answer with"""
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+class ExportPlan(NamedTuple):
+    """What a validated export request will stream"""
+    order_id: str
+    table: str
+    format: str
+    total: int      # data rows in the full export
+    skip: int       # data rows already received (Range: rows=N-)
+    partial: bool   # answer 206 with Content-Range
+    filename: str
+
+def user_plan(db, user_id: str) -> str:
+    """Plan key of the most expensive plan the user has paid for, or None"""
+    paid = db.execute(text(SELECT_MAX_PAYMENT), {"user_id": user_id}).scalar()
+    if paid is None:
+        return None
+    plan = None
+    for key, info in sorted(PRICING_PLANS.items(), key=lambda item: item[1]["price"]):
+        # Amounts are stored in dollars; allow for rounding of the charged cents
+        if paid + 0.005 >= info["price"]:
+            plan = key
+    return plan
+
+def parse_row_range(header: str):
+    """First data row to send for "Range: rows=N-"; None when there is no usable range"""
+    if not header:
+        return None
+    match = _RANGE.match(header)
+    return int(match.group(1)) if match else None
+
+def plan_export(user_id: str, order_id: str, table: str, fmt: str, range_header: str = None) -> ExportPlan:
+    """Check ownership, plan and range before any byte is streamed"""
+    if table not in ("reviews", "aggregates"):
+        raise ExportError(404, "Unknown export")
+    if fmt not in FORMATS:
+        raise ExportError(400, f"Format must be one of: {', '.join(FORMATS)}")
+    db = SessionLocal()
+    try:
+        order = db.execute(text(SELECT_EXPORT_ORDER), {"id": order_id}).fetchone()
+        if order is None or order.userId != user_id:
+            raise ExportError(404, "Order not found")
+        if user_plan(db, user_id) not in EXPORT_PLANS:
+            raise ExportError(403, "Exports are available on the Pro and Enterprise plans")
+        if table == "reviews":
+            total = order.review_count
+        else:
+            total = db.execute(text(SELECT_AGGREGATE_COUNT), {"order_id": order_id}).scalar()
+    finally:
+        db.close()
+    skip = parse_row_range(range_header)
+    # An empty export has no row range to resume from, not even rows=0-
+    if skip is not None and skip >= total:
+        raise ExportError(416, f"Export has {total} rows")
+    return ExportPlan(order_id, table, fmt, total, skip or 0, skip is not None, f"order-{order_id}-{table}.{fmt}")
+
+def _review_rows(db, plan: ExportPlan, chunk_rows: int):
+    """Lists of export records, scored a chunk at a time"""
+    query = text(SELECT_EXPORT_REVIEWS).columns(
+        column("id", BigInteger), column("external_id", Text), column("author", Text), column("rating", Integer),
+        column("published_at", DateTime), column("is_duplicate", Boolean), column("body", Text)
+    )
+    result = db.execute(
+        query,
+        {"order_id": plan.order_id, "limit": plan.total - plan.skip, "skip": plan.skip},
+        execution_options={"stream_results": True, "yield_per": chunk_rows}
+    )
+    analyzer = Analyzer()
+    for rows in result.partitions(chunk_rows):
+        scores = analyzer.score(analyzer.tokenize([row.body for row in rows]))
+        labels = polarity(scores) + 1
+        yield [
+            (row.id, row.external_id, row.author, row.rating,
+             row.published_at.isoformat() if row.published_at else None, bool(row.is_duplicate),
+             round(float(score), 6), POLARITY_NAMES[label])
+            for row, score, label in zip(rows, scores.tolist(), labels.tolist())
+        ]
+        # A fresh vocabulary per chunk keeps memory flat across huge orders
+        analyzer = Analyzer()
+
+def _aggregate_rows(db, plan: ExportPlan, chunk_rows: int):
+    query = text(SELECT_EXPORT_AGGREGATES).columns(bucket=DateTime, sentiment_sketch=LargeBinary)
+    result = db.execute(
+        query,
+        {"order_id": plan.order_id, "limit": plan.total - plan.skip, "skip": plan.skip},
+        execution_options={"stream_results": True, "yield_per": chunk_rows}
+    )
+    for rows in result.partitions(chunk_rows):
+        yield [
+            (row.bucket.isoformat(), row.review_count,
+             round(row.sentiment_sum / row.review_count, 6) if row.review_count else None,
+             KLLSketch.from_bytes(bytes(row.sentiment_sketch)).quantile(0.5),
+             row.negative_count, row.neutral_count, row.positive_count,
+             row.rating_1, row.rating_2, row.rating_3, row.rating_4, row.rating_5)
+            for row in rows
+        ]
+
+def _encode(chunks, fields, fmt: str, header: bool):
+    for records in chunks:
+        if fmt == "csv":
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            if header:
+                writer.writerow(fields)
+                header = False
+            writer.writerows(records)
+            data = buffer.getvalue()
+        else:
+            data = "".join(json.dumps(dict(zip(fields, record))) + "\n" for record in records)
+        yield data.encode()
+    if header:
+        # An empty export still gets its CSV header
+        yield (",".join(fields) + "\r\n").encode()
+
+def gzip_stream(chunks, level: int = EXPORT_GZIP_LEVEL):
+    """gzip-compress an iterable of byte chunks as it is consumed"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+def stream_export(plan: ExportPlan, gzip: bool = False, chunk_rows: int = EXPORT_CHUNK_ROWS):
+    """Byte chunks of the export; runs its own session for the life of the stream"""
+    db = SessionLocal()
+    try:
+        if plan.table == "reviews":
+            chunks, fields = _review_rows(db, plan, chunk_rows), REVIEW_FIELDS
+        else:
+            chunks, fields = _aggregate_rows(db, plan, chunk_rows), AGGREGATE_FIELDS
+        encoded = _encode(chunks, fields, plan.format, header=plan.format == "csv" and plan.skip == 0)
+        yield from (gzip_stream(encoded) if gzip else encoded)
+    finally:
+        db.close()
@@ -0,0 +1,184 @@
+"""
+Local stand-in for the parts of the Stripe API the app uses, for offline load tests
+
+    python -m app.fake_stripe --port 12111 --webhook-url http://127.0.0.1:8000/webhook/stripe
+    STRIPE_API_BASE=http://127.0.0.1:12111 uvicorn app.main:app
+
+Payment intents and customers live in memory. POST /v1/payment_intents/{id}/confirm
+stands in for Stripe.js confirming the card: the intent succeeds, or fails for the
+payment method pm_card_chargeDeclined, and with a webhook URL a signed
+payment_intent.* event is posted to the app as Stripe would. Idempotency-Key replays
+the first response. FAKE_STRIPE_LATENCY_MS and FAKE_STRIPE_ERROR_RATE add delay and
+random 500s, to exercise the client's timeouts, retries and circuit breaker.
+
+create_app() builds an instance for in-process use with httpx.ASGITransport.
+"""
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+from app.stripe_client import sign_payload
+from app.stripe_config import STRIPE_WEBHOOK_SECRET
+import argparse
+import asyncio
+import json
+import os
+import random
+import time
+import uuid
+import httpx
+
+FAKE_STRIPE_LATENCY_MS = float(os.getenv("FAKE_STRIPE_LATENCY_MS", "0"))
+FAKE_STRIPE_ERROR_RATE = float(os.getenv("FAKE_STRIPE_ERROR_RATE", "0"))
+FAKE_STRIPE_WEBHOOK_URL = os.getenv("FAKE_STRIPE_WEBHOOK_URL", "")
+
+DECLINED_PAYMENT_METHOD = "pm_card_chargeDeclined"
+
+def _parse_form(form) -> dict:
+    """Undo Stripe's form encoding: metadata[email]=x -> {"metadata": {"email": "x"}}"""
+    params = {}
+    for name, value in form.multi_items():
+        keys = name.replace("]", "").split("[")
+        target = params
+        for key in keys[:-1]:
+            target = target.setdefault(key, {})
+        target[keys[-1]] = value
+    return params
+
+def _error(status: int, message: str, code: str = None, error_type: str = "invalid_request_error") -> JSONResponse:
+    return JSONResponse({"error": {"type": error_type, "code": code, "message": message}}, status_code=status)
+
+def create_app(latency_ms: float = FAKE_STRIPE_LATENCY_MS, error_rate: float = FAKE_STRIPE_ERROR_RATE,
+               webhook_url: str = FAKE_STRIPE_WEBHOOK_URL, webhook_transport: httpx.AsyncBaseTransport = None,
+               webhook_secret: str = STRIPE_WEBHOOK_SECRET, seed: int = None) -> FastAPI:
+    fake = FastAPI(title="Fake Stripe")
+    intents = {}
+    customers = {}
+    replies = {}
+    rng = random.Random(seed)
+    fake.state.intents = intents
+    fake.state.webhooks_sent = 0
+    # Keeps webhook deliveries in flight from being garbage collected
+    deliveries = set()
+
+    async def send_webhook(event_type: str, intent: dict):
+        payload = json.dumps({
+            "id": f"evt_{uuid.uuid4().hex[:24]}",
+            "object": "event",
+            "type": event_type,
+            "created": int(time.time()),
+            "data": {"object": intent},
+        }).encode()
+        headers = {"Stripe-Signature": sign_payload(payload, webhook_secret), "Content-Type": "application/json"}
+        async with httpx.AsyncClient(transport=webhook_transport) as client:
+            for attempt in range(3):
+                try:
+                    response = await client.post(webhook_url, content=payload, headers=headers)
+                    if response.status_code < 500:
+                        fake.state.webhooks_sent += 1
+                        return
+                except httpx.TransportError:
+                    pass
+                await asyncio.sleep(0.1 * (attempt + 1))
+
+    @fake.middleware("http")
+    async def chaos(request: Request, call_next):
+        if latency_ms:
+            await asyncio.sleep(latency_ms / 1000)
+        if error_rate and rng.random() < error_rate:
+            return _error(500, "Injected failure", error_type="api_error")
+        key = request.headers.get("idempotency-key")
+        if request.method == "POST" and key:
+            reply = replies.get((request.url.path, key))
+            if reply is not None:
+                return JSONResponse(reply[1], status_code=reply[0], headers={"Idempotent-Replayed": "true"})
+        response = await call_next(request)
+        if request.method == "POST" and key:
+            body = b"".join([chunk async for chunk in response.body_iterator])
+            replies[(request.url.path, key)] = (response.status_code, json.loads(body))
+            return JSONResponse(json.loads(body), status_code=response.status_code)
+        return response
+
+    @fake.post("/v1/payment_intents")
+    async def create_payment_intent(request: Request):
+        params = _parse_form(await request.form())
+        try:
+            amount = int(params.get("amount", 0))
+        except ValueError:
+            amount = 0
+        if amount < 50:
+            return _error(400, "Amount must be at least 50 cents", "amount_too_small")
+        intent_id = f"pi_{uuid.uuid4().hex[:24]}"
+        intent = {
+            "id": intent_id,
+            "object": "payment_intent",
+            "amount": amount,
+            "amount_received": 0,
+            "currency": params.get("currency", "usd"),
+            "description": params.get("description"),
+            "receipt_email": params.get("receipt_email"),
+            "metadata": params.get("metadata", {}),
+            "client_secret": f"{intent_id}_secret_{uuid.uuid4().hex[:24]}",
+            "status": "requires_payment_method",
+            "latest_charge": None,
+            "created": int(time.time()),
+            "livemode": False,
+        }
+        intents[intent_id] = intent
+        return intent
+
+    @fake.get("/v1/payment_intents/{intent_id}")
+    async def retrieve_payment_intent(intent_id: str):
+        intent = intents.get(intent_id)
+        if intent is None:
+            return _error(404, f"No such payment_intent: '{intent_id}'", "resource_missing")
+        return intent
+
+    @fake.post("/v1/payment_intents/{intent_id}/confirm")
+    async def confirm_payment_intent(intent_id: str, request: Request):
+        intent = intents.get(intent_id)
+        if intent is None:
+            return _error(404, f"No such payment_intent: '{intent_id}'", "resource_missing")
+        params = _parse_form(await request.form())
+        if params.get("payment_method") == DECLINED_PAYMENT_METHOD:
+            intent["status"] = "requires_payment_method"
+            event_type = "payment_intent.payment_failed"
+        else:
+            intent.update(status="succeeded", amount_received=intent["amount"], latest_charge=f"ch_{uuid.uuid4().hex[:24]}")
+            event_type = "payment_intent.succeeded"
+        if webhook_url:
+            task = asyncio.create_task(send_webhook(event_type, dict(intent)))
+            deliveries.add(task)
+            task.add_done_callback(deliveries.discard)
+        return intent
+
+    @fake.post("/v1/customers")
+    async def create_customer(request: Request):
+        params = _parse_form(await request.form())
+        customer = {"id": f"cus_{uuid.uuid4().hex[:14]}", "object": "customer",
+                    "email": params.get("email"), "name": params.get("name"), "created": int(time.time())}
+        customers[customer["id"]] = customer
+        return customer
+
+    @fake.get("/v1/customers/{customer_id}")
+    async def retrieve_customer(customer_id: str):
+        customer = customers.get(customer_id)
+        if customer is None:
+            return _error(404, f"No such customer: '{customer_id}'", "resource_missing")
+        return customer
+
+    return fake
+
+app = create_app()
+
+def main(argv=None):
+    import uvicorn
+    parser = argparse.ArgumentParser(description="Run a local fake of the Stripe API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=12111)
+    parser.add_argument("--latency-ms", type=float, default=FAKE_STRIPE_LATENCY_MS)
+    parser.add_argument("--error-rate", type=float, default=FAKE_STRIPE_ERROR_RATE)
+    parser.add_argument("--webhook-url", default=FAKE_STRIPE_WEBHOOK_URL, help="Where to post signed events")
+    args = parser.parse_args(argv)
+    uvicorn.run(create_app(args.latency_ms, args.error_rate, args.webhook_url), host=args.host, port=args.port)
+
+if __name__ == "__main__":
+    main()
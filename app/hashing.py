@@ -0,0 +1,89 @@
+"""
+Bounded worker pool for bcrypt so password hashing never runs on the event loop
+"""
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import os
+import threading
+import time
+from app.auth import get_password_hash, verify_password
+from app import metrics
+
+HASH_WORKERS = int(os.getenv("HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+HASH_QUEUE_LIMIT = int(os.getenv("HASH_QUEUE_LIMIT", "32"))
+
+class HashingBusy(Exception):
+    """Raised when the hashing queue is full and the request should be shed"""
+
+class PasswordHasher:
+    """Runs bcrypt in a thread pool (bcrypt releases the GIL) with a bounded queue"""
+    def __init__(self, workers: int = HASH_WORKERS, queue_limit: int = HASH_QUEUE_LIMIT):
+        self.workers = max(1, workers)
+        self.queue_limit = max(0, queue_limit)
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="bcrypt")
+        self._lock = threading.Lock()
+        self._pending = 0
+        self.completed = 0
+        self.rejected = 0
+        self.latency = metrics.LatencyHistogram()
+        self.queue_wait = metrics.LatencyHistogram()
+
+    def _release(self, future):
+        with self._lock:
+            self._pending -= 1
+            self.completed += 1
+
+    async def _submit(self, fn, *args):
+        with self._lock:
+            if self._pending >= self.workers + self.queue_limit:
+                self.rejected += 1
+                raise HashingBusy("Password hashing queue is full")
+            self._pending += 1
+
+        submitted = time.perf_counter()
+
+        def run():
+            started = time.perf_counter()
+            self.queue_wait.observe(started - submitted)
+            try:
+                return fn(*args)
+            finally:
+                self.latency.observe(time.perf_counter() - started)
+
+        try:
+            future = self._executor.submit(run)
+        except Exception:
+            with self._lock:
+                self._pending -= 1
+            raise
+        # Release the slot when the work actually finishes, even if the caller was cancelled
+        future.add_done_callback(self._release)
+        return await asyncio.wrap_future(future)
+
+    async def hash(self, password: str) -> str:
+        """Hash a password on the worker pool"""
+        return await self._submit(get_password_hash, password)
+
+    async def verify(self, plain_password: str, hashed_password: str) -> bool:
+        """Verify a password on the worker pool"""
+        return await self._submit(verify_password, plain_password, hashed_password)
+
+    def stats(self) -> dict:
+        with self._lock:
+            pending = self._pending
+        return {
+            "workers": self.workers,
+            "queue_limit": self.queue_limit,
+            "in_flight": min(pending, self.workers),
+            "queue_depth": max(0, pending - self.workers),
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "hash_latency": self.latency.snapshot(),
+            "queue_wait": self.queue_wait.snapshot(),
+        }
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
+
+password_hasher = PasswordHasher()
+metrics.register("password_hashing", password_hasher.stats)
@@ -0,0 +1,272 @@
+"""
+Streaming review ingestion for an Order
+
+Review dumps (CSV or JSONL, optionally gzipped) are read, normalized and validated
+one record at a time and written in fixed-size chunks, so memory use is the same
+for 500 reviews or 5 million. Near-duplicates are checked against the order's stored
+MinHash buckets (app/dedup.py) one chunk at a time. On Postgres each chunk is loaded
+with COPY; other databases get a multi-row INSERT.
+
+    python -m app.ingest ORDER_ID reviews.csv.gz [--format csv|jsonl] [--chunk-size N] [--no-dedup]
+"""
+from datetime import datetime, timezone
+from itertools import islice
+from typing import NamedTuple
+from sqlalchemy import text
+from app.database import SessionLocal
+from app.auth_db import record_order_status_change
+from app.models import Review
+from app.dedup import StoredDedupIndex, DEDUP_ENABLED, seed_index
+from app.business import review_digest, DIGEST_MODULUS
+import argparse
+import csv
+import gzip
+import io
+import json
+import os
+import re
+import sys
+import time
+
+INGEST_CHUNK_SIZE = int(os.getenv("INGEST_CHUNK_SIZE", "5000"))
+MAX_REVIEW_LENGTH = 20000
+
+# Accepted source field names for each Review column, in order of preference
+FIELD_ALIASES = {
+    "external_id": ("review_id", "id", "external_id"),
+    "author": ("author", "author_name", "user", "user_name", "name", "reviewer"),
+    "rating": ("rating", "stars", "score", "star_rating"),
+    "body": ("text", "review", "body", "content", "comment", "review_text"),
+    "published_at": ("published_at", "date", "time", "created_at", "timestamp"),
+}
+
+REVIEW_COLUMNS = ("order_id", "external_id", "author", "rating", "body", "published_at", "createdAt", "is_duplicate")
+
+_WHITESPACE = re.compile(r"\s+")
+
+# The digest starts over for an order without reviews; one whose reviews predate the
+# digest keeps NULL (and is never served from the result cache)
+UPDATE_ORDER_REVIEWS = """
+UPDATE "Order" SET review_count = review_count + :loaded, reviews_version = reviews_version + 1,
+    reviews_digest = CASE WHEN review_count = 0 THEN :digest ELSE (reviews_digest + :digest) % :modulus END,
+    "updatedAt" = :now
+WHERE id = :id
+"""
+
+REQUEUE_ORDER = """
+UPDATE "Order" SET status = 'pending', attempts = 0, next_attempt_at = NULL, last_error = NULL
+WHERE id = :id AND status = :status
+"""
+
+class IngestReport(NamedTuple):
+    """Outcome of one ingest run"""
+    order_id: str
+    loaded: int
+    rejected: int
+    seconds: float
+    duplicates: int = 0
+
+    @property
+    def rows_per_second(self) -> float:
+        return self.loaded / self.seconds if self.seconds else 0.0
+
+def open_dump(path: str):
+    """Open a dump as text, transparently un-gzipping *.gz files"""
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", encoding="utf-8", newline="")
+    return open(path, "r", encoding="utf-8", newline="")
+
+def detect_format(path: str) -> str:
+    name = path[:-3] if path.endswith(".gz") else path
+    return "jsonl" if name.endswith((".jsonl", ".ndjson", ".json")) else "csv"
+
+def read_csv(stream):
+    """Yield one dict per CSV row"""
+    yield from csv.DictReader(stream)
+
+def read_jsonl(stream):
+    """Yield one dict per JSON line, skipping blank and malformed lines"""
+    for line in stream:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            continue
+        if isinstance(record, dict):
+            yield record
+
+def _first(record: dict, names):
+    for name in names:
+        value = record.get(name)
+        if value not in (None, ""):
+            return value
+    return None
+
+def _clean_text(value) -> str:
+    if value is None:
+        return None
+    cleaned = _WHITESPACE.sub(" ", str(value)).strip()
+    return cleaned or None
+
+def parse_rating(value):
+    """Ratings as integers 1-5; anything else becomes None"""
+    if value is None:
+        return None
+    try:
+        rating = round(float(value))
+    except (TypeError, ValueError):
+        return None
+    return rating if 1 <= rating <= 5 else None
+
+def parse_timestamp(value):
+    """ISO-8601 strings or epoch seconds, as naive UTC datetimes"""
+    if value is None:
+        return None
+    try:
+        if isinstance(value, (int, float)) or str(value).isdigit():
+            return datetime.fromtimestamp(float(value), tz=timezone.utc).replace(tzinfo=None)
+        parsed = datetime.fromisoformat(str(value).strip().replace("Z", "+00:00"))
+    except (TypeError, ValueError, OverflowError, OSError):
+        return None
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+def normalize(records, order_id: str, rejects: list):
+    """Map raw records onto Review columns (all but is_duplicate), dropping ones without review text.
+    rejects is a one-element list used as a counter so the caller can read it afterwards."""
+    now = datetime.utcnow()
+    for record in records:
+        body = _clean_text(_first(record, FIELD_ALIASES["body"]))
+        if body is None:
+            rejects[0] += 1
+            continue
+        external_id = _first(record, FIELD_ALIASES["external_id"])
+        yield (
+            order_id,
+            str(external_id) if external_id is not None else None,
+            _clean_text(_first(record, FIELD_ALIASES["author"])),
+            parse_rating(_first(record, FIELD_ALIASES["rating"])),
+            body[:MAX_REVIEW_LENGTH],
+            parse_timestamp(_first(record, FIELD_ALIASES["published_at"])),
+            now,
+        )
+
+def chunked(rows, size: int):
+    """Yield lists of up to size rows"""
+    iterator = iter(rows)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+def _copy_chunk(db, chunk):
+    """Load a chunk with Postgres COPY"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    # In CSV COPY an unquoted empty field is NULL; normalize() never emits empty strings
+    for row in chunk:
+        writer.writerow(["" if value is None else value for value in row])
+    buffer.seek(0)
+    columns = ", ".join(f'"{name}"' for name in REVIEW_COLUMNS)
+    cursor = db.connection().connection.cursor()
+    try:
+        cursor.copy_expert(f'COPY "Review" ({columns}) FROM STDIN WITH (FORMAT csv)', buffer)
+    finally:
+        cursor.close()
+
+def _insert_chunk(db, chunk):
+    """Load a chunk with a multi-row INSERT"""
+    db.execute(Review.__table__.insert(), [dict(zip(REVIEW_COLUMNS, row)) for row in chunk])
+
+def requeue_order(db, order_id: str):
+    """Send a finished order back to the job queue so its report picks up new reviews"""
+    order = db.execute(text('SELECT "userId", status FROM "Order" WHERE id = :id'), {"id": order_id}).fetchone()
+    if order is None or order.status not in ("done", "failed"):
+        return
+    result = db.execute(
+        text(REQUEUE_ORDER),
+        {"id": order_id, "status": order.status}
+    )
+    if result.rowcount == 1:
+        record_order_status_change(db, order.userId, order.status, "pending")
+
+def flag_duplicates(index: StoredDedupIndex, chunk):
+    """Append is_duplicate to each normalized row"""
+    if index is None:
+        return [row + (False,) for row in chunk]
+    flags = index.add_batch([row[4] for row in chunk]).tolist()
+    return [row + (flag,) for row, flag in zip(chunk, flags)]
+
+def load_reviews(db, order_id: str, records, chunk_size: int = INGEST_CHUNK_SIZE, progress=None,
+                 dedup: bool = DEDUP_ENABLED) -> IngestReport:
+    """Normalize, flag near-duplicates and bulk-load review records for an order in one transaction"""
+    start = time.perf_counter()
+    rejects = [0]
+    loaded = 0
+    duplicates = 0
+    digest = 0
+    write_chunk = _copy_chunk if db.get_bind().dialect.name == "postgresql" else _insert_chunk
+    try:
+        index = None
+        if dedup:
+            index = StoredDedupIndex(db, order_id)
+            if index.next_seq == 0:
+                existing = db.execute(text('SELECT review_count FROM "Order" WHERE id = :id'), {"id": order_id}).scalar()
+                if existing:
+                    # Reviews loaded before signatures were stored, or without dedup
+                    seed_index(db, index)
+        for chunk in chunked(normalize(records, order_id, rejects), chunk_size):
+            chunk = flag_duplicates(index, chunk)
+            write_chunk(db, chunk)
+            loaded += len(chunk)
+            digest = (digest + review_digest(row[3:6] for row in chunk)) % DIGEST_MODULUS
+            duplicates += sum(row[-1] for row in chunk)
+            if progress:
+                progress(loaded, time.perf_counter() - start)
+        db.execute(
+            text(UPDATE_ORDER_REVIEWS),
+            {"loaded": loaded, "digest": digest, "modulus": DIGEST_MODULUS, "now": datetime.utcnow(), "id": order_id}
+        )
+        if loaded:
+            requeue_order(db, order_id)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return IngestReport(order_id, loaded, rejects[0], time.perf_counter() - start, duplicates)
+
+def ingest_file(db, order_id: str, path: str, fmt: str = None, chunk_size: int = INGEST_CHUNK_SIZE, progress=None,
+                dedup: bool = DEDUP_ENABLED) -> IngestReport:
+    """Stream a review dump file into the Review table"""
+    fmt = fmt or detect_format(path)
+    reader = read_jsonl if fmt == "jsonl" else read_csv
+    with open_dump(path) as stream:
+        return load_reviews(db, order_id, reader(stream), chunk_size=chunk_size, progress=progress, dedup=dedup)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load a review dump for an order")
+    parser.add_argument("order_id")
+    parser.add_argument("path")
+    parser.add_argument("--format", choices=("csv", "jsonl"))
+    parser.add_argument("--chunk-size", type=int, default=INGEST_CHUNK_SIZE)
+    parser.add_argument("--no-dedup", action="store_true", help="Skip near-duplicate detection")
+    args = parser.parse_args(argv)
+
+    def progress(loaded, elapsed):
+        print(f"  {loaded:,} rows ({loaded / elapsed:,.0f} rows/s)", file=sys.stderr)
+
+    db = SessionLocal()
+    try:
+        report = ingest_file(db, args.order_id, args.path, args.format, args.chunk_size, progress,
+                             dedup=DEDUP_ENABLED and not args.no_dedup)
+    finally:
+        db.close()
+    print(f"Loaded {report.loaded:,} reviews for order {report.order_id} "
+          f"({report.rejected:,} rejected, {report.duplicates:,} near-duplicates) in {report.seconds:.1f}s, {report.rows_per_second:,.0f} rows/s")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,367 @@
+"""
+Background analysis jobs over the "Order" table
+
+Workers claim pending orders with SELECT ... FOR UPDATE SKIP LOCKED, so any number of
+worker processes can drain the queue in parallel without processing an order twice.
+A claimed order moves pending -> running and holds a lease that the worker's heartbeat
+keeps extending; if the worker dies the lease expires and another worker reclaims it.
+Failures are retried with exponential backoff until JOB_MAX_ATTEMPTS, then marked failed.
+
+    python -m app.jobs --concurrency 4 --handler package.module:function
+
+The handler is called as handler(db, job) with its own Session and a Job tuple.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import NamedTuple
+from sqlalchemy import text, column, bindparam, Text, String, Integer, DateTime
+from app.database import SessionLocal, engine
+from app.auth_db import record_order_status_change
+from app import metrics
+import argparse
+import importlib
+import json
+import os
+import random
+import signal
+import socket
+import sys
+import threading
+import time
+import traceback
+import uuid
+
+JOB_CONCURRENCY = int(os.getenv("JOB_CONCURRENCY", "4"))
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "120"))
+JOB_HEARTBEAT_SECONDS = float(os.getenv("JOB_HEARTBEAT_SECONDS", "30"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "5"))
+JOB_RETRY_BASE_SECONDS = float(os.getenv("JOB_RETRY_BASE_SECONDS", "10"))
+JOB_RETRY_MAX_SECONDS = float(os.getenv("JOB_RETRY_MAX_SECONDS", "900"))
+JOB_POLL_SECONDS = float(os.getenv("JOB_POLL_SECONDS", "2"))
+JOB_HANDLER = os.getenv("JOB_HANDLER", "app.analysis:process_order")
+
+class Job(NamedTuple):
+    """A claimed order"""
+    id: str
+    userId: str
+    business_name: str
+    business_address: str
+    attempts: int
+    createdAt: datetime
+    previous_status: str
+
+# Row locks are a Postgres feature; the SQLite stand-in has a single writer anyway
+_LOCK_CLAUSE = "FOR UPDATE SKIP LOCKED" if engine.dialect.name == "postgresql" else ""
+
+_CLAIMABLE = """(
+    (status = 'pending' AND (next_attempt_at IS NULL OR next_attempt_at <= :now))
+    OR (status = 'running' AND lease_expires_at < :now)
+)"""
+
+SELECT_CLAIMABLE = f"""
+SELECT id, status FROM "Order"
+WHERE {_CLAIMABLE}
+ORDER BY "createdAt"
+LIMIT :limit
+{_LOCK_CLAUSE}
+"""
+
+# The claimable condition is re-checked so the claim stays exclusive even without row locks
+CLAIM_JOBS = f"""
+UPDATE "Order"
+SET status = 'running',
+    worker_id = :worker_id,
+    attempts = COALESCE(attempts, 0) + 1,
+    lease_expires_at = :lease_expires_at,
+    heartbeat_at = :now,
+    last_error = NULL,
+    "updatedAt" = :now
+WHERE id IN :ids AND {_CLAIMABLE}
+RETURNING id, "userId", business_name, business_address, attempts, "createdAt"
+"""
+
+HEARTBEAT_JOBS = """
+UPDATE "Order" SET heartbeat_at = :now, lease_expires_at = :lease_expires_at
+WHERE id IN :ids AND worker_id = :worker_id AND status = 'running'
+"""
+
+# Every transition out of running is fenced on worker_id, so a worker whose lease
+# expired (and whose order was reclaimed) cannot overwrite the new owner's result
+COMPLETE_JOB = """
+UPDATE "Order" SET status = 'done', worker_id = NULL, lease_expires_at = NULL, "updatedAt" = :now
+WHERE id = :id AND worker_id = :worker_id AND status = 'running'
+"""
+
+RETRY_JOB = """
+UPDATE "Order" SET status = 'pending', worker_id = NULL, lease_expires_at = NULL,
+    next_attempt_at = :next_attempt_at, last_error = :error, "updatedAt" = :now
+WHERE id = :id AND worker_id = :worker_id AND status = 'running'
+"""
+
+FAIL_JOB = """
+UPDATE "Order" SET status = 'failed', worker_id = NULL, lease_expires_at = NULL,
+    last_error = :error, "updatedAt" = :now
+WHERE id = :id AND worker_id = :worker_id AND status = 'running'
+"""
+
+class JobStats:
+    """Throughput and latency counters for the workers in this process"""
+    def __init__(self):
+        self.started = time.monotonic()
+        self.claimed = 0
+        self.completed = 0
+        self.retried = 0
+        self.failed = 0
+        self.lost = 0
+        self.claim_query = metrics.LatencyHistogram()
+        self.pickup_delay = metrics.LatencyHistogram(
+            buckets=(0.1, 0.5, 1, 2, 5, 10, 30, 60, 300, 900, 3600)
+        )
+        self.run_time = metrics.LatencyHistogram(
+            buckets=(0.01, 0.1, 0.5, 1, 2, 5, 10, 30, 60, 300, 900)
+        )
+        self._lock = threading.Lock()
+
+    def incr(self, name: str, amount: int = 1):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + amount)
+
+    def snapshot(self) -> dict:
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+        return {
+            "claimed": self.claimed,
+            "completed": self.completed,
+            "retried": self.retried,
+            "failed": self.failed,
+            "lost": self.lost,
+            "completed_per_second": self.completed / elapsed,
+            "claim_query": self.claim_query.snapshot(),
+            "pickup_delay": self.pickup_delay.snapshot(),
+            "run_time": self.run_time.snapshot(),
+        }
+
+job_stats = JobStats()
+metrics.register("jobs", job_stats.snapshot)
+
+def retry_delay(attempts: int) -> float:
+    """Exponential backoff with jitter for the given number of attempts so far"""
+    delay = min(JOB_RETRY_MAX_SECONDS, JOB_RETRY_BASE_SECONDS * (2 ** max(0, attempts - 1)))
+    return delay * random.uniform(0.5, 1.0)
+
+def claim_jobs(db, worker_id: str, limit: int) -> list:
+    """Claim up to limit runnable orders for this worker and commit"""
+    now = datetime.utcnow()
+    query = text(CLAIM_JOBS).bindparams(bindparam("ids", expanding=True)).columns(
+        column("id", Text),
+        column("userId", Text),
+        column("business_name", String),
+        column("business_address", String),
+        column("attempts", Integer),
+        column("createdAt", DateTime)
+    )
+    try:
+        with job_stats.claim_query.time():
+            # Lock the candidate rows (skipping ones other workers hold), then take them
+            candidates = db.execute(text(SELECT_CLAIMABLE), {"now": now, "limit": limit}).fetchall()
+            if not candidates:
+                db.rollback()
+                return []
+            previous_status = dict(candidates)
+            result = db.execute(query, {
+                "now": now,
+                "ids": list(previous_status),
+                "worker_id": worker_id,
+                "lease_expires_at": now + timedelta(seconds=JOB_LEASE_SECONDS)
+            })
+            jobs = [Job(*row, previous_status[row[0]]) for row in result.fetchall()]
+        for job in jobs:
+            record_order_status_change(db, job.userId, job.previous_status, "running")
+        db.commit()
+    except Exception as e:
+        print(f"Error claiming jobs: {str(e)}", file=sys.stderr)
+        db.rollback()
+        return []
+
+    job_stats.incr("claimed", len(jobs))
+    for job in jobs:
+        if job.attempts == 1 and job.createdAt is not None:
+            job_stats.pickup_delay.observe(max(0.0, (now - job.createdAt).total_seconds()))
+    return jobs
+
+def heartbeat(db, worker_id: str, job_ids: list):
+    """Extend the leases of orders this worker is still running"""
+    if not job_ids:
+        return
+    now = datetime.utcnow()
+    try:
+        db.execute(
+            text(HEARTBEAT_JOBS).bindparams(bindparam("ids", expanding=True)),
+            {
+                "now": now,
+                "lease_expires_at": now + timedelta(seconds=JOB_LEASE_SECONDS),
+                "ids": list(job_ids),
+                "worker_id": worker_id
+            }
+        )
+        db.commit()
+    except Exception as e:
+        print(f"Error sending job heartbeat: {str(e)}", file=sys.stderr)
+        db.rollback()
+
+def complete_job(db, job: Job, worker_id: str) -> bool:
+    """Mark a job done; False if this worker no longer owned it"""
+    result = db.execute(text(COMPLETE_JOB), {"id": job.id, "worker_id": worker_id, "now": datetime.utcnow()})
+    if result.rowcount != 1:
+        db.rollback()
+        return False
+    record_order_status_change(db, job.userId, "running", "done")
+    db.commit()
+    return True
+
+def fail_job(db, job: Job, worker_id: str, error: str) -> str:
+    """Schedule a retry, or mark the job failed once it is out of attempts.
+    Returns the new status, or None if this worker no longer owned it."""
+    now = datetime.utcnow()
+    error = error[-4000:]
+    if job.attempts < JOB_MAX_ATTEMPTS:
+        status = "pending"
+        result = db.execute(text(RETRY_JOB), {
+            "id": job.id,
+            "worker_id": worker_id,
+            "now": now,
+            "error": error,
+            "next_attempt_at": now + timedelta(seconds=retry_delay(job.attempts))
+        })
+    else:
+        status = "failed"
+        result = db.execute(text(FAIL_JOB), {"id": job.id, "worker_id": worker_id, "now": now, "error": error})
+    if result.rowcount != 1:
+        db.rollback()
+        return None
+    record_order_status_change(db, job.userId, "running", status)
+    db.commit()
+    return status
+
+class Worker:
+    """Claims orders and runs the handler on a bounded thread pool"""
+    def __init__(self, handler, concurrency: int = JOB_CONCURRENCY, worker_id: str = None, session_factory=SessionLocal):
+        self.handler = handler
+        self.concurrency = max(1, concurrency)
+        self.worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self.session_factory = session_factory
+        self.stop_event = threading.Event()
+        self._wake = threading.Event()
+        self._in_flight = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="job")
+
+    def in_flight(self) -> list:
+        with self._lock:
+            return list(self._in_flight)
+
+    def _execute(self, job: Job):
+        db = self.session_factory()
+        start = time.perf_counter()
+        try:
+            if job.attempts > JOB_MAX_ATTEMPTS:
+                # Reclaimed after its last lease expired: don't run it again
+                raise RuntimeError(f"Lease expired on final attempt ({job.attempts - 1})")
+            self.handler(db, job)
+            if complete_job(db, job, self.worker_id):
+                job_stats.incr("completed")
+            else:
+                job_stats.incr("lost")
+        except Exception as e:
+            db.rollback()
+            print(f"Job {job.id} attempt {job.attempts} failed: {str(e)}", file=sys.stderr)
+            try:
+                status = fail_job(db, job, self.worker_id, traceback.format_exc())
+                if status == "pending":
+                    job_stats.incr("retried")
+                elif status == "failed":
+                    job_stats.incr("failed")
+                else:
+                    job_stats.incr("lost")
+            except Exception as fail_error:
+                print(f"Error recording failure of job {job.id}: {str(fail_error)}", file=sys.stderr)
+                db.rollback()
+        finally:
+            job_stats.run_time.observe(time.perf_counter() - start)
+            db.close()
+            with self._lock:
+                self._in_flight.pop(job.id, None)
+            self._wake.set()
+
+    def _heartbeat_loop(self):
+        while not self.stop_event.wait(JOB_HEARTBEAT_SECONDS):
+            job_ids = self.in_flight()
+            if job_ids:
+                db = self.session_factory()
+                try:
+                    heartbeat(db, self.worker_id, job_ids)
+                finally:
+                    db.close()
+
+    def run_once(self) -> int:
+        """Claim as many jobs as there are free slots and start them; returns the number claimed"""
+        free = self.concurrency - len(self.in_flight())
+        if free <= 0:
+            return 0
+        db = self.session_factory()
+        try:
+            jobs = claim_jobs(db, self.worker_id, free)
+        finally:
+            db.close()
+        for job in jobs:
+            with self._lock:
+                self._in_flight[job.id] = job
+            self._executor.submit(self._execute, job)
+        return len(jobs)
+
+    def run(self, drain: bool = False):
+        """Process jobs until stop() is called (or, with drain, until the queue is empty)"""
+        heartbeat_thread = threading.Thread(target=self._heartbeat_loop, name="job-heartbeat", daemon=True)
+        heartbeat_thread.start()
+        try:
+            while not self.stop_event.is_set():
+                self._wake.clear()
+                claimed = self.run_once()
+                if drain and claimed == 0 and not self.in_flight():
+                    break
+                if claimed == 0 or len(self.in_flight()) >= self.concurrency:
+                    self._wake.wait(JOB_POLL_SECONDS)
+        finally:
+            self.stop_event.set()
+            self._executor.shutdown(wait=True)
+
+    def stop(self):
+        self.stop_event.set()
+        self._wake.set()
+
+def load_handler(path: str):
+    """Import a handler given as "package.module:function" """
+    module_name, _, attr = path.partition(":")
+    if not module_name or not attr:
+        raise ValueError(f"Handler must look like package.module:function, got {path!r}")
+    return getattr(importlib.import_module(module_name), attr)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run background analysis workers")
+    parser.add_argument("--concurrency", type=int, default=JOB_CONCURRENCY)
+    parser.add_argument("--handler", default=JOB_HANDLER, help="package.module:function (or JOB_HANDLER)")
+    parser.add_argument("--drain", action="store_true", help="Exit once the queue is empty")
+    args = parser.parse_args(argv)
+
+    if not args.handler:
+        parser.error("No handler configured; pass --handler or set JOB_HANDLER")
+
+    worker = Worker(load_handler(args.handler), concurrency=args.concurrency)
+    signal.signal(signal.SIGTERM, lambda signum, frame: worker.stop())
+    signal.signal(signal.SIGINT, lambda signum, frame: worker.stop())
+
+    print(f"Worker {worker.worker_id} started with concurrency {worker.concurrency}", file=sys.stderr)
+    worker.run(drain=args.drain)
+    print(json.dumps(job_stats.snapshot(), default=str), file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
@@ -1,89 +1,102 @@
 from datetime import datetime
+import os
+import time
 import uuid
 from fastapi import FastAPI, Request, Depends, Form, HTTPException
-from fastapi.responses import HTMLResponse, RedirectResponse
-from fastapi.staticfiles import StaticFiles
+from fastapi.responses import HTMLResponse, RedirectResponse, StreamingResponse, JSONResponse
 from fastapi.templating import Jinja2Templates
-from sqlalchemy.orm import Session
-from sqlalchemy import text
-from app.database import get_db
+from starlette.concurrency import run_in_threadpool
+from app.database import get_session
 from app.auth import (
     get_password_hash, 
-    verify_password, 
     create_access_token,
     get_current_user_from_cookie,
     require_auth,
-    validate_password,
-    decode_token
+    validate_password
 )
-from app.auth_db import (
-    get_user_by_email,
-    get_user_by_id,
+from app.auth_db import get_current_user, get_token_email, remember_user
+from app.auth_db_async import (
+    get_user_for_auth,
     create_user,
     user_exists,
-    get_user_orders
+    get_user_orders_page,
+    get_dashboard_snapshot
 )
-from app.stripe_config import STRIPE_PUBLISHABLE_KEY
+from app.stripe_config import STRIPE_PUBLISHABLE_KEY, PRICING_PLANS, stripe_api
+from app.stripe_client import StripeError, StripeUnavailable
+from app.hashing import password_hasher, HashingBusy
+from app.ratelimit import auth_admission, client_ip, RequestShed
+from app.pages import PageCache
+from app.assets import AssetFiles, asset_manifest, STATIC_FINGERPRINT_ENABLED
+from app.payments import confirm_payment as confirm_checkout_payment, PaymentError
+from app.webhooks import receive_event, webhook_processor, webhook_stats, WebhookError, WEBHOOK_PROCESSOR_ENABLED
+from app.export import plan_export, stream_export, ExportError, FORMATS as EXPORT_FORMATS
+from app import metrics
+
+INTERNAL_STATS_ENABLED = os.getenv("INTERNAL_STATS_ENABLED", "false").lower() == "true"
 
 app = FastAPI(title="AI Review Analyzer")
 
-# Mount static files
-app.mount("/static", StaticFiles(directory="app/static"), name="static")
+@app.on_event("startup")
+def start_webhook_processor():
+    if WEBHOOK_PROCESSOR_ENABLED:
+        webhook_processor.start()
+
+@app.on_event("shutdown")
+async def stop_background_clients():
+    webhook_processor.stop()
+    await stripe_api.aclose()
+
+# Fingerprint and precompress static files, then mount them
+if STATIC_FINGERPRINT_ENABLED:
+    asset_manifest.build()
+app.mount("/static", AssetFiles(asset_manifest), name="static")
 
 # Setup templates
 templates = Jinja2Templates(directory="app/templates")
+templates.env.globals["static_url"] = asset_manifest.url
+
+# Pre-rendered marketing pages with ETag revalidation
+page_cache = PageCache(templates)
+metrics.register("page_cache", page_cache.stats)
 
 @app.get("/", response_class=HTMLResponse)
-async def home(request: Request):
-    user = None
-    try:
-        token = request.cookies.get("access_token")
-        if token:
-            payload = decode_token(token)
-            if payload:
-                email = payload.get("sub")
-                if email:
-                    db = next(get_db())
-                    try:
-                        user = get_user_by_email(db, email)
-                    finally:
-                        db.close()
-    except:
-        pass
-    
-    return templates.TemplateResponse("index.html", {"request": request, "user": user})
+async def home(request: Request, user = Depends(get_current_user)):
+    return page_cache.response(request, "index.html", user)
 
 @app.get("/pricing", response_class=HTMLResponse)
-async def pricing(request: Request):
-    user = None
-    try:
-        token = request.cookies.get("access_token")
-        if token:
-            payload = decode_token(token)
-            if payload:
-                email = payload.get("sub")
-                if email:
-                    db = next(get_db())
-                    try:
-                        user = get_user_by_email(db, email)
-                    finally:
-                        db.close()
-    except:
-        pass
-    
-    return templates.TemplateResponse("pricing.html", {"request": request, "user": user})
+async def pricing(request: Request, user = Depends(get_current_user)):
+    return page_cache.response(request, "pricing.html", user)
 
 @app.get("/login", response_class=HTMLResponse)
 async def login_page(request: Request):
-    return templates.TemplateResponse("login.html", {"request": request, "user": None})
+    return page_cache.response(request, "login.html")
+
+def shed_response(request: Request, template: str, shed: RequestShed):
+    """429 for an auth attempt turned away by admission control, before any hashing"""
+    seconds = shed.retry_after
+    return templates.TemplateResponse(
+        template,
+        {"request": request, "error": f"Too many attempts. Please try again in {seconds} second{'s' if seconds != 1 else ''}.", "user": None},
+        status_code=429,
+        headers={"Retry-After": str(seconds)}
+    )
 
 @app.post("/login")
 async def login(
     request: Request,
     email: str = Form(...),
     password: str = Form(...),
-    db: Session = Depends(get_db)
+    db = Depends(get_session)
 ):
+    try:
+        slot = auth_admission.admit(client_ip(request), email)
+    except RequestShed as e:
+        return shed_response(request, "login.html", e)
+    with slot:
+        return await _login(request, email, password, db)
+
+async def _login(request: Request, email: str, password: str, db):
     try:
         # Validate inputs
         if not email or not email.strip():
@@ -100,9 +113,9 @@ async def login(
         
         # Find user by email
         email_lower = email.strip().lower()
-        user = get_user_by_email(db, email_lower)
+        user = await get_user_for_auth(db, email_lower)
         
-        if not user or not verify_password(password, user.password):
+        if not user or not await password_hasher.verify(password, user.password):
             return templates.TemplateResponse(
                 "login.html",
                 {"request": request, "error": "Invalid email or password", "user": None}
@@ -114,6 +127,12 @@ async def login(
         response.set_cookie(key="access_token", value=token, httponly=True, secure=True, samesite="lax")
         return response
         
+    except HashingBusy:
+        return templates.TemplateResponse(
+            "login.html",
+            {"request": request, "error": "We're experiencing high load. Please try again in a moment.", "user": None},
+            status_code=503
+        )
     except Exception as e:
         print(f"Login error: {str(e)}")
         return templates.TemplateResponse(
@@ -123,7 +142,7 @@ async def login(
 
 @app.get("/signup", response_class=HTMLResponse)
 async def signup_page(request: Request):
-    return templates.TemplateResponse("signup.html", {"request": request, "user": None})
+    return page_cache.response(request, "signup.html")
 
 @app.post("/signup")
 async def signup(
@@ -131,8 +150,16 @@ async def signup(
     name: str = Form(...),
     email: str = Form(...),
     password: str = Form(...),
-    db: Session = Depends(get_db)
+    db = Depends(get_session)
 ):
+    try:
+        slot = auth_admission.admit(client_ip(request), email)
+    except RequestShed as e:
+        return shed_response(request, "signup.html", e)
+    with slot:
+        return await _signup(request, name, email, password, db)
+
+async def _signup(request: Request, name: str, email: str, password: str, db):
     try:
         # Validate inputs
         if not name or not name.strip():
@@ -164,7 +191,7 @@ async def signup(
         
         # Check if user already exists
         email_lower = email.strip().lower()
-        if user_exists(db, email_lower):
+        if await user_exists(db, email_lower):
             return templates.TemplateResponse(
                 "signup.html",
                 {"request": request, "error": "An account with this email already exists", "user": None}
@@ -172,13 +199,19 @@ async def signup(
         
         # Create new user
         try:
-            new_user = create_user(db, name.strip(), email_lower, password)
+            new_user = await create_user(db, name.strip(), email_lower, password)
             
             # Auto login
             token = create_access_token({"sub": new_user.email})
             response = RedirectResponse(url="/dashboard", status_code=303)
             response.set_cookie(key="access_token", value=token, httponly=True, secure=True, samesite="lax")
             return response
+        except HashingBusy:
+            return templates.TemplateResponse(
+                "signup.html",
+                {"request": request, "error": "We're experiencing high load. Please try again in a moment.", "user": None},
+                status_code=503
+            )
         except Exception as e:
             print(f"Error creating user: {str(e)}")
             return templates.TemplateResponse(
@@ -193,42 +226,103 @@ async def signup(
             {"request": request, "error": "An error occurred during signup. Please try again.", "user": None}
         )
 
+@app.get("/privacy", response_class=HTMLResponse)
+async def privacy(request: Request, user = Depends(get_current_user)):
+    return page_cache.response(request, "privacy.html", user)
+
+@app.get("/terms", response_class=HTMLResponse)
+async def terms(request: Request, user = Depends(get_current_user)):
+    return page_cache.response(request, "terms.html", user)
+
 @app.get("/dashboard", response_class=HTMLResponse)
 async def dashboard(
     request: Request,
-    db: Session = Depends(get_db)
+    after: str = None,
+    db = Depends(get_session)
 ):
     try:
-        # Get token from cookie
-        token = request.cookies.get("access_token")
-        if not token:
-            return RedirectResponse(url="/login", status_code=303)
-        
-        # Decode token
-        payload = decode_token(token)
-        if not payload:
-            return RedirectResponse(url="/login", status_code=303)
-        
-        email = payload.get("sub")
+        email = get_token_email(request)
         if not email:
             return RedirectResponse(url="/login", status_code=303)
         
-        # Get user from database
-        user = get_user_by_email(db, email)
-        if not user:
-            return RedirectResponse(url="/login", status_code=303)
-        
-        # Get user's orders
-        orders = get_user_orders(db, user.id)
+        summary = None
+        if after:
+            # Later page (no-JS "Load more"): user from the cache, then one page
+            user = await get_current_user(request)
+            if not user:
+                return RedirectResponse(url="/login", status_code=303)
+            orders, next_cursor = await get_user_orders_page(db, user.id, after=after)
+        else:
+            # User, first page of orders and counters in one round trip
+            snapshot = await get_dashboard_snapshot(db, email)
+            if not snapshot:
+                return RedirectResponse(url="/login", status_code=303)
+            remember_user(request, snapshot.user)
+            user, orders, next_cursor, summary = snapshot
         
         return templates.TemplateResponse(
             "dashboard.html",
-            {"request": request, "user": user, "orders": orders}
+            {"request": request, "user": user, "orders": orders, "next_cursor": next_cursor, "summary": summary}
         )
     except Exception as e:
         print(f"Dashboard error: {str(e)}")
         return RedirectResponse(url="/login", status_code=303)
 
+@app.get("/dashboard/orders", response_class=HTMLResponse)
+async def dashboard_orders(
+    request: Request,
+    after: str = None,
+    user = Depends(get_current_user),
+    db = Depends(get_session)
+):
+    """Next page of order history as list items, for the dashboard's "Load more" button"""
+    if not user:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    
+    orders, next_cursor = await get_user_orders_page(db, user.id, after=after)
+    response = templates.TemplateResponse(
+        "_order_items.html",
+        {"request": request, "orders": orders}
+    )
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return response
+
+@app.get("/dashboard/orders/{order_id}/export/{table}")
+async def export_order(
+    request: Request,
+    order_id: str,
+    table: str,
+    format: str = "csv",
+    gzip: bool = False,
+    user = Depends(get_current_user)
+):
+    """Stream an order's per-review scores ("reviews") or weekly aggregates ("aggregates")
+    as CSV or NDJSON; Pro and Enterprise plans only. "Range: rows=N-" resumes after N rows."""
+    if not user:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    
+    try:
+        plan = await run_in_threadpool(plan_export, user.id, order_id, table, format, request.headers.get("range"))
+    except ExportError as e:
+        raise HTTPException(status_code=e.status, detail=str(e))
+    
+    headers = {
+        "Accept-Ranges": "rows",
+        "Content-Disposition": f'attachment; filename="{plan.filename}"',
+        "Cache-Control": "no-store"
+    }
+    if gzip:
+        headers["Content-Encoding"] = "gzip"
+    if plan.partial:
+        headers["Content-Range"] = f"rows {plan.skip}-{plan.total - 1}/{plan.total}"
+    return StreamingResponse(
+        stream_export(plan, gzip=gzip),
+        status_code=206 if plan.partial else 200,
+        media_type=EXPORT_FORMATS[plan.format],
+        headers=headers
+    )
+
 @app.get("/logout")
 async def logout(request: Request):
     response = RedirectResponse(url="/", status_code=303)
@@ -237,19 +331,7 @@ async def logout(request: Request):
 
 # Stripe payment routes
 @app.get("/checkout", response_class=HTMLResponse)
-async def checkout(request: Request, plan: str = "basic", db: Session = Depends(get_db)):
-    user = None
-    try:
-        token = request.cookies.get("access_token")
-        if token:
-            payload = decode_token(token)
-            if payload:
-                email = payload.get("sub")
-                if email:
-                    user = get_user_by_email(db, email)
-    except:
-        pass
-    
+async def checkout(request: Request, plan: str = "basic", user = Depends(get_current_user)):
     # Pricing plans
     plans = {
         "basic": {
@@ -283,139 +365,70 @@ async def checkout(request: Request, plan: str = "basic", db: Session = Depends(
     )
 
 @app.post("/api/create-payment-intent")
-async def create_payment_intent(request: Request, db: Session = Depends(get_db)):
+async def create_payment_intent(request: Request, user = Depends(get_current_user)):
+    data = await request.json()
+    plan = PRICING_PLANS.get(data.get("plan"))
     try:
-        from app.stripe_config import stripe_api
-        
-        data = await request.json()
-        amount = int(float(data.get("amount", 0)) * 100)  # Convert to cents
-        
-        intent = stripe_api.create_payment_intent(
+        amount = round(float(plan["price"] if plan else data.get("amount", 0)) * 100)  # Convert to cents
+    except (TypeError, ValueError):
+        return JSONResponse({"error": "Invalid amount"}, status_code=400)
+    try:
+        intent = await stripe_api.create_payment_intent(
             amount=amount,
             currency="usd",
-            description=data.get("description", "AI Review Analyzer")
+            description=data.get("description") or (plan["name"] if plan else "AI Review Analyzer"),
+            # Lets the webhook processor attribute the payment if the page never confirms it
+            metadata={"user_id": user.id, "email": user.email} if user else None,
+            receipt_email=user.email if user else None
         )
-        
-        return {"client_secret": intent.client_secret}
-    except Exception as e:
+    except StripeError as e:
         print(f"Error creating payment intent: {str(e)}")
-        return {"error": str(e)}, 400
+        return JSONResponse({"error": str(e)}, status_code=503 if isinstance(e, StripeUnavailable) else 400)
+    return {"clientSecret": intent.client_secret, "client_secret": intent.client_secret, "paymentIntentId": intent.id}
 
 @app.post("/api/confirm-payment")
-async def confirm_payment(request: Request, db: Session = Depends(get_db)):
+async def confirm_payment(request: Request, user = Depends(get_current_user)):
+    if not user:
+        return JSONResponse({"error": "Not authenticated"}, status_code=401)
+    data = await request.json()
+    payment_intent_id = data.get("paymentIntentId") or data.get("payment_intent_id")
+    if not payment_intent_id:
+        return JSONResponse({"error": "Missing payment intent"}, status_code=400)
     try:
-        from app.stripe_config import stripe_api
-        
-        data = await request.json()
-        payment_intent_id = data.get("payment_intent_id")
-        
-        # Verify payment with Stripe
-        intent = stripe_api.retrieve_payment_intent(payment_intent_id)
-        
-        if intent.status != "succeeded":
-            return {"error": "Payment not completed"}, 400
-        
-        # Get current user
-        token = request.cookies.get("access_token")
-        if not token:
-            return {"error": "Not authenticated"}, 401
-        
-        payload = decode_token(token)
-        if not payload:
-            return {"error": "Invalid token"}, 401
-        
-        email = payload.get("sub")
-        user = get_user_by_email(db, email)
-        if not user:
-            return {"error": "User not found"}, 404
-        
-        # Create payment record
-        try:
-            db.execute(
-                text('INSERT INTO "Payment" ("userId", stripe_payment_intent_id, stripe_charge_id, amount, currency, status, "createdAt", "updatedAt") VALUES (:userId, :stripe_payment_intent_id, :stripe_charge_id, :amount, :currency, :status, :createdAt, :updatedAt)'),
-                {
-                    "userId": user.id,
-                    "stripe_payment_intent_id": payment_intent_id,
-                    "stripe_charge_id": intent.charges.data[0].id if intent.charges.data else None,
-                    "amount": intent.amount / 100,
-                    "currency": intent.currency,
-                    "status": "succeeded",
-                    "createdAt": datetime.utcnow(),
-                    "updatedAt": datetime.utcnow()
-                }
-            )
-            db.commit()
-        except Exception as e:
-            print(f"Error creating payment record: {str(e)}")
-            db.rollback()
-        
-        return {"success": True}
-    except Exception as e:
+        # Repeat confirmations are answered locally, without calling Stripe again
+        await confirm_checkout_payment(user.id, payment_intent_id)
+    except PaymentError as e:
         print(f"Error confirming payment: {str(e)}")
-        return {"error": str(e)}, 400
+        return JSONResponse({"error": str(e)}, status_code=e.status)
+    return {"success": True}
 
 @app.post("/webhook/stripe")
-async def stripe_webhook(request: Request, db: Session = Depends(get_db)):
+async def stripe_webhook(request: Request):
+    # Store and acknowledge; app/webhooks.py applies the event in the background
+    start = time.perf_counter()
+    payload = await request.body()
     try:
-        from app.stripe_config import stripe_api
-        
-        payload = await request.body()
-        sig_header = request.headers.get("stripe-signature")
-        
-        event = stripe_api.verify_webhook(payload, sig_header)
-        
-        if event["type"] == "payment_intent.succeeded":
-            payment_intent = event["data"]["object"]
-            print(f"Payment succeeded: {payment_intent['id']}")
-        elif event["type"] == "payment_intent.payment_failed":
-            payment_intent = event["data"]["object"]
-            print(f"Payment failed: {payment_intent['id']}")
-        
-        return {"status": "success"}
-    except Exception as e:
-        print(f"Webhook error: {str(e)}")
-        return {"error": str(e)}, 400
+        stored = await run_in_threadpool(receive_event, payload, request.headers.get("stripe-signature"))
+    except WebhookError as e:
+        print(f"Webhook rejected: {str(e)}")
+        raise HTTPException(status_code=400, detail=str(e))
+    webhook_stats.ack.observe(time.perf_counter() - start)
+    return {"received": True, "duplicate": not stored}
 
 @app.get("/payment-success", response_class=HTMLResponse)
-async def payment_success(request: Request):
-    user = None
-    try:
-        token = request.cookies.get("access_token")
-        if token:
-            payload = decode_token(token)
-            if payload:
-                email = payload.get("sub")
-                if email:
-                    db = next(get_db())
-                    try:
-                        user = get_user_by_email(db, email)
-                    finally:
-                        db.close()
-    except:
-        pass
-    
+async def payment_success(request: Request, user = Depends(get_current_user)):
     return templates.TemplateResponse("payment-success.html", {"request": request, "user": user})
 
 @app.get("/payment-failed", response_class=HTMLResponse)
-async def payment_failed(request: Request):
-    user = None
-    try:
-        token = request.cookies.get("access_token")
-        if token:
-            payload = decode_token(token)
-            if payload:
-                email = payload.get("sub")
-                if email:
-                    db = next(get_db())
-                    try:
-                        user = get_user_by_email(db, email)
-                    finally:
-                        db.close()
-    except:
-        pass
-    
+async def payment_failed(request: Request, user = Depends(get_current_user)):
     return templates.TemplateResponse("payment-failed.html", {"request": request, "user": user})
 
+@app.get("/internal/stats")
+async def internal_stats():
+    if not INTERNAL_STATS_ENABLED:
+        raise HTTPException(status_code=404, detail="Not Found")
+    return metrics.snapshot()
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
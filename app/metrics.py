@@ -0,0 +1,92 @@
+"""
+Lightweight in-process metrics shared by the app's subsystems
+"""
+from contextlib import contextmanager
+import bisect
+import threading
+import time
+
+DEFAULT_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+    0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0
+)
+
+class LatencyHistogram:
+    """Fixed-bucket histogram of durations in seconds"""
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._counts = [0] * (len(self.buckets) + 1)
+        self._count = 0
+        self._sum = 0.0
+        self._max = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float):
+        index = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            self._counts[index] += 1
+            self._count += 1
+            self._sum += seconds
+            if seconds > self._max:
+                self._max = seconds
+
+    @contextmanager
+    def time(self):
+        """Time the enclosed block"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+    def percentile(self, q: float) -> float:
+        """Upper bound of the bucket holding the q-th quantile (0 < q <= 1)"""
+        with self._lock:
+            counts = list(self._counts)
+            total = self._count
+            largest = self._max
+        if total == 0:
+            return 0.0
+        rank = q * total
+        seen = 0
+        for index, count in enumerate(counts):
+            seen += count
+            if seen >= rank:
+                if index < len(self.buckets):
+                    return min(self.buckets[index], largest)
+                return largest
+        return largest
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            counts = list(self._counts)
+            total = self._count
+            total_sum = self._sum
+            largest = self._max
+        labels = [f"le_{bound:g}" for bound in self.buckets] + ["le_inf"]
+        return {
+            "count": total,
+            "avg": total_sum / total if total else 0.0,
+            "max": largest,
+            "p50": self.percentile(0.50),
+            "p95": self.percentile(0.95),
+            "p99": self.percentile(0.99),
+            "buckets": dict(zip(labels, counts)),
+        }
+
+# Registry of named stats providers, each returning a JSON-serializable dict
+_providers = {}
+
+def register(name: str, provider):
+    """Register a callable that returns the current stats for a subsystem"""
+    _providers[name] = provider
+
+def snapshot() -> dict:
+    """Collect stats from every registered provider"""
+    stats = {}
+    for name, provider in list(_providers.items()):
+        try:
+            stats[name] = provider()
+        except Exception as e:
+            stats[name] = {"error": str(e)}
+    return stats
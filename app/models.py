@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Float, Boolean, Text
+from sqlalchemy import Column, Integer, BigInteger, SmallInteger, String, DateTime, ForeignKey, Float, Boolean, Text, LargeBinary
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 from datetime import datetime
@@ -34,6 +34,18 @@ class Order(Base):
     status = Column(String, default="pending")
     price = Column(Float, default=29.99)
     payment_id = Column(Integer, ForeignKey("Payment.id"), nullable=True)
+    # Background job state (see app/jobs.py)
+    attempts = Column(Integer, default=0, nullable=False)
+    worker_id = Column(String, nullable=True)
+    lease_expires_at = Column(DateTime, nullable=True)
+    heartbeat_at = Column(DateTime, nullable=True)
+    next_attempt_at = Column(DateTime, nullable=True)
+    last_error = Column(Text, nullable=True)
+    # Review set loaded by app/ingest.py; the version is bumped on every ingest
+    review_count = Column(Integer, default=0, nullable=False)
+    reviews_version = Column(Integer, default=0, nullable=False)
+    # Order-independent digest of the review set (app/business.py); NULL for reviews loaded before it existed
+    reviews_digest = Column(BigInteger, nullable=True)
     createdAt = Column(DateTime, default=datetime.utcnow, nullable=False)
     updatedAt = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
     
@@ -58,6 +70,122 @@ class Payment(Base):
     user = relationship("User", back_populates="payments", foreign_keys=[userId])
     order = relationship("Order", back_populates="payment")
 
+class Review(Base):
+    """A customer review of the business on an Order, loaded by app/ingest.py"""
+    __tablename__ = "Review"
+    __table_args__ = {'extend_existing': True}
+    
+    id = Column(BigInteger().with_variant(Integer, "sqlite"), primary_key=True, autoincrement=True)
+    order_id = Column(Text, ForeignKey("Order.id"), nullable=False, index=True)
+    external_id = Column(String, nullable=True)
+    author = Column(String, nullable=True)
+    rating = Column(Integer, nullable=True)
+    body = Column(Text, nullable=False)
+    published_at = Column(DateTime, nullable=True)
+    createdAt = Column(DateTime, default=datetime.utcnow, nullable=False)
+    # Near-duplicate of an earlier review of the same order (app/dedup.py); excluded from analysis
+    is_duplicate = Column(Boolean, default=False, nullable=False)
+
+class ReviewSignature(Base):
+    """MinHash signature of each distinct review of an Order, numbered in ingest order (app/dedup.py)"""
+    __tablename__ = "ReviewSignature"
+    __table_args__ = {'extend_existing': True}
+    
+    order_id = Column(Text, ForeignKey("Order.id"), primary_key=True)
+    seq = Column(Integer, primary_key=True)
+    signature = Column(LargeBinary, nullable=False)
+
+class ReviewBand(Base):
+    """LSH band bucket -> the first distinct review of the Order that landed in it (app/dedup.py)"""
+    __tablename__ = "ReviewBand"
+    __table_args__ = {'extend_existing': True}
+    
+    # Leading order_id, key: a chunk's candidates are looked up by key
+    order_id = Column(Text, ForeignKey("Order.id"), primary_key=True)
+    key = Column(BigInteger, primary_key=True)
+    band = Column(SmallInteger, primary_key=True)
+    seq = Column(Integer, nullable=False)
+
+class AnalysisReport(Base):
+    """Latest analysis of an Order's reviews, written by app/analysis.py"""
+    __tablename__ = "AnalysisReport"
+    __table_args__ = {'extend_existing': True}
+    
+    order_id = Column(Text, ForeignKey("Order.id"), primary_key=True)
+    reviews_version = Column(Integer, nullable=False)
+    review_count = Column(Integer, nullable=False)
+    report = Column(Text, nullable=False)
+    # Highest Review.id folded into state; later reviews are scored incrementally
+    last_review_id = Column(BigInteger, default=0, nullable=False)
+    state = Column(LargeBinary, nullable=True)
+    createdAt = Column(DateTime, default=datetime.utcnow, nullable=False)
+    updatedAt = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
+
+class ReportAggregate(Base):
+    """Running per-time-bucket aggregates of an Order's reviews (see app/aggregates.py)"""
+    __tablename__ = "ReportAggregate"
+    __table_args__ = {'extend_existing': True}
+    
+    order_id = Column(Text, ForeignKey("Order.id"), primary_key=True)
+    bucket = Column(DateTime, primary_key=True)
+    review_count = Column(Integer, default=0, nullable=False)
+    sentiment_sum = Column(Float, default=0, nullable=False)
+    negative_count = Column(Integer, default=0, nullable=False)
+    neutral_count = Column(Integer, default=0, nullable=False)
+    positive_count = Column(Integer, default=0, nullable=False)
+    rating_1 = Column(Integer, default=0, nullable=False)
+    rating_2 = Column(Integer, default=0, nullable=False)
+    rating_3 = Column(Integer, default=0, nullable=False)
+    rating_4 = Column(Integer, default=0, nullable=False)
+    rating_5 = Column(Integer, default=0, nullable=False)
+    sentiment_sketch = Column(LargeBinary, nullable=False)
+    updatedAt = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
+
+class AnalysisCache(Base):
+    """Finished reports shared between orders with the same business and reviews (see app/result_cache.py)"""
+    __tablename__ = "AnalysisCache"
+    __table_args__ = {'extend_existing': True}
+    
+    key = Column(Text, primary_key=True)
+    business_key = Column(Text, nullable=False, index=True)
+    order_id = Column(Text, nullable=True)
+    review_count = Column(Integer, nullable=False)
+    report = Column(Text, nullable=False)
+    hits = Column(Integer, default=0, nullable=False)
+    createdAt = Column(DateTime, default=datetime.utcnow, nullable=False)
+    expires_at = Column(DateTime, nullable=False, index=True)
+    last_hit_at = Column(DateTime, default=datetime.utcnow, nullable=False, index=True)
+
+class WebhookEvent(Base):
+    """Inbox of raw Stripe webhook events, applied in the background (see app/webhooks.py)"""
+    __tablename__ = "WebhookEvent"
+    __table_args__ = {'extend_existing': True}
+    
+    # Stripe's event id, so redelivered events are stored once
+    id = Column(Text, primary_key=True)
+    type = Column(String, nullable=False)
+    payload = Column(Text, nullable=False)
+    status = Column(String, default="pending", nullable=False)
+    attempts = Column(Integer, default=0, nullable=False)
+    last_error = Column(Text, nullable=True)
+    received_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    processed_at = Column(DateTime, nullable=True)
+
+class UserSummary(Base):
+    """Per-user counters kept current on order and payment writes (see app/auth_db.py)"""
+    __tablename__ = "UserSummary"
+    __table_args__ = {'extend_existing': True}
+    
+    userId = Column(Text, ForeignKey("User.id"), primary_key=True)
+    order_count = Column(Integer, default=0, nullable=False)
+    pending_count = Column(Integer, default=0, nullable=False)
+    running_count = Column(Integer, default=0, nullable=False)
+    done_count = Column(Integer, default=0, nullable=False)
+    failed_count = Column(Integer, default=0, nullable=False)
+    payment_count = Column(Integer, default=0, nullable=False)
+    total_spent = Column(Float, default=0, nullable=False)
+    updatedAt = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
+
 class Account(Base):
     __tablename__ = "Account"
     __table_args__ = {'extend_existing': True}
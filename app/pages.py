@@ -0,0 +1,93 @@
+"""
+Render cache for the marketing pages
+
+Home, pricing, login, signup, privacy and terms render the same HTML for every
+visitor in the same state (anonymous or signed in), so each (template, context key)
+pair is rendered once and kept as encoded bytes with a strong ETag; a matching
+If-None-Match gets a 304 with no body. Entries are keyed by a generation stamp of
+the template directory too, so editing any template (or base.html) makes the next
+request re-render.
+"""
+from typing import NamedTuple
+from fastapi import Request
+from fastapi.responses import Response
+from app.cache import TTLCache
+import hashlib
+import os
+import threading
+import time
+
+PAGE_CACHE_ENABLED = os.getenv("PAGE_CACHE_ENABLED", "true").lower() == "true"
+PAGE_CACHE_SIZE = int(os.getenv("PAGE_CACHE_SIZE", "512"))
+PAGE_CACHE_TTL = float(os.getenv("PAGE_CACHE_TTL", "3600"))
+# How often the template files are stat()ed for changes
+PAGE_CACHE_CHECK_SECONDS = float(os.getenv("PAGE_CACHE_CHECK_SECONDS", "2"))
+
+HTML_MEDIA_TYPE = "text/html; charset=utf-8"
+# Pages differ by auth cookie, so browsers may keep them but must revalidate
+PAGE_HEADERS = {"Cache-Control": "private, no-cache", "Vary": "Cookie"}
+
+class RenderedPage(NamedTuple):
+    body: bytes
+    etag: str
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """Whether If-None-Match names etag (or is *)"""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    tags = [tag.strip() for tag in header.split(",")]
+    # Weak comparison, as RFC 9110 prescribes for If-None-Match
+    return "*" in tags or etag in tags or f"W/{etag}" in tags
+
+class PageCache:
+    """Rendered pages keyed by (template, context key, template generation)"""
+    def __init__(self, templates, maxsize: int = PAGE_CACHE_SIZE, ttl: float = PAGE_CACHE_TTL,
+                 check_seconds: float = PAGE_CACHE_CHECK_SECONDS):
+        self.templates = templates
+        self.pages = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.check_seconds = check_seconds
+        self.not_modified = 0
+        self._generation = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def generation(self):
+        """Stamp of the template files that changes whenever one of them does"""
+        now = time.monotonic()
+        if self._generation is None or now - self._checked_at >= self.check_seconds:
+            stamp = []
+            for directory in self.templates.env.loader.searchpath:
+                for entry in os.scandir(directory):
+                    if entry.is_file():
+                        status = entry.stat()
+                        stamp.append((entry.name, status.st_mtime_ns, status.st_size))
+            self._generation = hash(tuple(sorted(stamp)))
+            self._checked_at = now
+        return self._generation
+
+    def render(self, name: str, context_key, context: dict) -> RenderedPage:
+        key = (name, context_key, self.generation())
+        page = self.pages.get(key)
+        if page is None:
+            body = self.templates.get_template(name).render(context).encode()
+            page = RenderedPage(body, '"' + hashlib.sha256(body).hexdigest()[:32] + '"')
+            self.pages.set(key, page)
+        return page
+
+    def response(self, request: Request, name: str, user=None, status_code: int = 200) -> Response:
+        """The page for this template and user, or a 304 if the client already has it"""
+        context = {"request": request, "user": user}
+        if not PAGE_CACHE_ENABLED:
+            return self.templates.TemplateResponse(name, context, status_code=status_code)
+        # The marketing templates only show whether someone is signed in
+        page = self.render(name, "member" if user else "anonymous", context)
+        headers = {**PAGE_HEADERS, "ETag": page.etag}
+        if etag_matches(request, page.etag):
+            with self._lock:
+                self.not_modified += 1
+            return Response(status_code=304, headers=headers)
+        return Response(page.body, status_code=status_code, media_type=HTML_MEDIA_TYPE, headers=headers)
+
+    def stats(self) -> dict:
+        return {**self.pages.stats(), "not_modified": self.not_modified}
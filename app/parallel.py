@@ -0,0 +1,229 @@
+"""
+Multi-core analysis of one order's reviews
+
+Batches of reviews are tokenized and scored in a pool of worker processes, so a
+large order is not limited to the one core the GIL allows. Nothing bulky is pickled:
+the parent writes each batch's text and ratings into a shared memory block, and the
+worker writes token ids, offsets and review scores back into a second one; only the
+PartialReport and the batch's new words travel through the pool's pipe.
+
+Each worker tokenizes with a fresh vocabulary, so its ids above the fixed lexicon
+are local to the batch; the parent maps them onto its own vocabulary before merging.
+"""
+from collections import deque
+from multiprocessing import get_context
+from multiprocessing.shared_memory import SharedMemory
+from concurrent.futures import ProcessPoolExecutor, wait
+from typing import NamedTuple
+from app.analysis import (
+    Analyzer, PartialReport, TokenizedBatch, ANALYSIS_WORKERS, ANALYSIS_BATCH_SIZE, KEY_BASE,
+    join_texts, merge_phrases, partial_report, score_reviews, _as_array, _as_timestamps
+)
+import os
+import threading
+import numpy as np
+
+# Batches queued per worker, so workers never wait for the parent to read the next one
+ANALYSIS_QUEUE_DEPTH = int(os.getenv("ANALYSIS_QUEUE_DEPTH", "2"))
+
+class SharedArrays:
+    """Several NumPy arrays laid out in one shared memory block"""
+    def __init__(self, shm: SharedMemory, layout):
+        self.shm = shm
+        self.layout = layout
+        self.arrays = {}
+        offset = 0
+        for name, dtype, count in layout:
+            dtype = np.dtype(dtype)
+            offset += -offset % 8
+            self.arrays[name] = np.ndarray(count, dtype=dtype, buffer=shm.buf, offset=offset)
+            offset += dtype.itemsize * count
+
+    @staticmethod
+    def size(layout) -> int:
+        offset = 0
+        for _, dtype, count in layout:
+            offset += -offset % 8 + np.dtype(dtype).itemsize * count
+        return max(offset, 1)
+
+    @classmethod
+    def create(cls, layout) -> "SharedArrays":
+        return cls(SharedMemory(create=True, size=cls.size(layout)), layout)
+
+    @classmethod
+    def attach(cls, spec) -> "SharedArrays":
+        name, layout = spec
+        return cls(SharedMemory(name=name), layout)
+
+    def spec(self):
+        """What another process needs to attach"""
+        return self.shm.name, self.layout
+
+    def __getitem__(self, name: str) -> np.ndarray:
+        return self.arrays[name]
+
+    def close(self):
+        # Views must go before the buffer can be released
+        self.arrays.clear()
+        self.shm.close()
+
+    def unlink(self):
+        self.close()
+        self.shm.unlink()
+
+class ShardResult(NamedTuple):
+    """What a worker sends back besides the shared arrays"""
+    token_count: int
+    new_words: list         # words behind ids >= fixed_size, in id order
+    partial: PartialReport  # phrase keys in the worker's ids
+    ids: np.ndarray         # only when the ids did not fit the shared block
+
+def _score_shard(input_spec, output_spec, count: int) -> ShardResult:
+    """Worker side: tokenize and score one batch"""
+    inputs = SharedArrays.attach(input_spec)
+    outputs = SharedArrays.attach(output_spec)
+    try:
+        joined = bytes(inputs["text"]).decode()
+        ratings = inputs["ratings"].copy()
+        analyzer = Analyzer()
+        ids, offsets = analyzer.tokenize_joined(joined, count)
+        scores = score_reviews(ids, offsets, analyzer.tables)
+        partial = partial_report(ids, offsets, ratings, analyzer.tables, scores=scores)
+        outputs["scores"][:] = scores
+        outputs["offsets"][:] = offsets
+        overflow = None
+        if len(ids) <= len(outputs["ids"]):
+            outputs["ids"][:len(ids)] = ids
+        else:
+            overflow = ids
+        vocabulary = analyzer.vocabulary
+        return ShardResult(len(ids), vocabulary.words[vocabulary.fixed_size:], partial, overflow)
+    finally:
+        inputs.close()
+        outputs.close()
+
+def _row_columns(rows):
+    review_ids, bodies, ratings, published = zip(*(row[:4] for row in rows))
+    return bodies, ratings, published, review_ids
+
+_pool = None
+_pool_workers = 0
+_pool_lock = threading.Lock()
+
+def get_pool(workers: int = ANALYSIS_WORKERS) -> ProcessPoolExecutor:
+    """The process-wide worker pool, (re)created with the given size on first use.
+    Spawned rather than forked, since the job engine's threads may hold locks."""
+    global _pool, _pool_workers
+    with _pool_lock:
+        if _pool is None or _pool_workers != workers:
+            if _pool is not None:
+                _pool.shutdown()
+            _pool = ProcessPoolExecutor(max_workers=workers, mp_context=get_context("spawn"))
+            _pool_workers = workers
+        return _pool
+
+def shutdown_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown()
+            _pool = None
+
+class ParallelAnalyzer:
+    """Scores batches of reviews in worker processes, with results in the vocabulary of analyzer"""
+    def __init__(self, analyzer: Analyzer = None, workers: int = ANALYSIS_WORKERS):
+        self.analyzer = analyzer or Analyzer()
+        self.workers = max(1, workers)
+
+    def _submit(self, pool, texts, ratings, timestamps, review_ids):
+        count = len(texts)
+        data = join_texts(texts).encode()
+        inputs = SharedArrays.create([("text", np.uint8, len(data)), ("ratings", np.int8, count)])
+        inputs["text"][:] = np.frombuffer(data, dtype=np.uint8)
+        inputs["ratings"][:] = ratings
+        # Tokens are runs of ASCII letters separated by at least one other character,
+        # so a text has at most about half as many tokens as characters
+        capacity = (len(data) + count) // 2 + 1
+        outputs = SharedArrays.create([("scores", np.float64, count), ("offsets", np.int64, count + 1),
+                                       ("ids", np.int32, capacity)])
+        future = pool.submit(_score_shard, inputs.spec(), outputs.spec(), count)
+        return future, inputs, outputs, ratings, timestamps, review_ids
+
+    def _collect(self, submitted):
+        future, inputs, outputs, ratings, timestamps, review_ids = submitted
+        try:
+            result = future.result()
+            vocabulary = self.analyzer.vocabulary
+            # Worker id -> id in our vocabulary; the fixed part is the same everywhere
+            remap = np.empty(vocabulary.fixed_size + len(result.new_words), dtype=np.int64)
+            remap[:vocabulary.fixed_size] = np.arange(vocabulary.fixed_size)
+            remap[vocabulary.fixed_size:] = [vocabulary.add(word) for word in result.new_words]
+            local_ids = outputs["ids"][:result.token_count] if result.ids is None else result.ids
+            ids = remap[local_ids].astype(np.int32)
+            # No views of the shared blocks may outlive them
+            del local_ids
+            batch = TokenizedBatch(
+                ids=ids,
+                offsets=outputs["offsets"].copy(),
+                ratings=ratings,
+                timestamps=timestamps,
+                review_ids=review_ids,
+            )
+            scores = outputs["scores"].copy()
+        finally:
+            inputs.unlink()
+            outputs.unlink()
+        partial = result.partial
+        first, second = np.divmod(partial.phrase_keys, KEY_BASE)
+        partial.phrase_keys, partial.phrase_counts, partial.phrase_sentiment = merge_phrases(
+            remap[first] * KEY_BASE + remap[second], partial.phrase_counts, partial.phrase_sentiment
+        )
+        return batch, scores, partial
+
+    def score_batches(self, batches):
+        """For each (texts, ratings, timestamps, review_ids) batch, in order, yield
+        (TokenizedBatch, scores, PartialReport) like app.analysis.score_batches"""
+        pool = get_pool(self.workers)
+        pending = deque()
+        try:
+            for texts, ratings, timestamps, review_ids in batches:
+                count = len(texts)
+                pending.append(self._submit(
+                    pool, texts,
+                    _as_array(ratings, count, np.int8),
+                    _as_timestamps(timestamps, count),
+                    _as_array(review_ids, count, np.int64) if review_ids is not None else np.arange(count, dtype=np.int64)
+                ))
+                while len(pending) >= self.workers * ANALYSIS_QUEUE_DEPTH:
+                    yield self._collect(pending.popleft())
+            while pending:
+                yield self._collect(pending.popleft())
+        finally:
+            # Abandoned midway: free the blocks of batches still queued
+            for future, inputs, outputs, *_ in pending:
+                if not future.cancel():
+                    wait([future])
+                inputs.unlink()
+                outputs.unlink()
+
+    def score_rows(self, row_batches):
+        """score_batches over lists of (id, body, rating, published_at, ...) rows"""
+        return self.score_batches(_row_columns(rows) for rows in row_batches)
+
+    def analyze(self, reviews, batch_size: int = ANALYSIS_BATCH_SIZE) -> dict:
+        """Analyze an iterable of (text, rating) pairs and return the report"""
+        def batches():
+            texts, ratings = [], []
+            for body, rating in reviews:
+                texts.append(body)
+                ratings.append(rating)
+                if len(texts) >= batch_size:
+                    yield texts, ratings, None, None
+                    texts, ratings = [], []
+            if texts:
+                yield texts, ratings, None, None
+
+        partial = PartialReport()
+        for _, _, batch_partial in self.score_batches(batches()):
+            partial = partial.merge(batch_partial)
+        return partial.to_report(self.analyzer.vocabulary)
@@ -0,0 +1,156 @@
+"""
+Idempotent confirmation of checkout payments
+
+The checkout page calls /api/confirm-payment once Stripe.js reports success, and may
+call it again on a reload or retry. A confirmation is answered, cheapest first, from:
+
+1. a short-lived in-process record of intents this process already confirmed;
+2. the "Payment" table, when an earlier confirmation or the webhook processor
+   (app/webhooks.py) already recorded the intent as succeeded;
+3. Stripe, retrieving the intent, then recording it with INSERT ... ON CONFLICT.
+
+Only the first successful recording of an intent counts towards the user's totals,
+however many confirmations and webhook events race for it.
+"""
+from datetime import datetime
+from sqlalchemy import text, column, Text, String
+from starlette.concurrency import run_in_threadpool
+from app.auth_db import record_payment
+from app.cache import TTLCache
+from app.database import SessionLocal
+from app.stripe_config import stripe_api
+from app.stripe_client import StripeError, StripeUnavailable
+from app.webhooks import release_held_orders
+from app import metrics
+import os
+import threading
+
+CONFIRMED_INTENTS_SIZE = int(os.getenv("CONFIRMED_INTENTS_SIZE", "4096"))
+CONFIRMED_INTENTS_TTL = float(os.getenv("CONFIRMED_INTENTS_TTL", "600"))
+
+SELECT_PAYMENT_BY_INTENT = 'SELECT "userId", status FROM "Payment" WHERE stripe_payment_intent_id = :intent_id'
+
+# A pending, failed or canceled row (e.g. from a webhook that arrived first, or a retry
+# with another card) is moved to succeeded; RETURNING yields a row only when this
+# statement is what made the payment succeed
+UPSERT_SUCCEEDED_PAYMENT = """
+INSERT INTO "Payment" ("userId", stripe_payment_intent_id, stripe_charge_id, amount, currency, status, description, "createdAt", "updatedAt")
+VALUES (:userId, :intent_id, :charge_id, :amount, :currency, 'succeeded', :description, :now, :now)
+ON CONFLICT (stripe_payment_intent_id) DO UPDATE
+SET status = 'succeeded',
+    stripe_charge_id = COALESCE(excluded.stripe_charge_id, "Payment".stripe_charge_id),
+    "updatedAt" = excluded."updatedAt"
+WHERE "Payment".status NOT IN ('succeeded', 'refunded') AND "Payment"."userId" = excluded."userId"
+RETURNING id
+"""
+
+class PaymentError(Exception):
+    """A confirmation that cannot be accepted; status is the HTTP status to answer with"""
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+class ConfirmStats:
+    """Where confirmations were answered from"""
+    def __init__(self):
+        self.confirmations = 0
+        self.from_memory = 0
+        self.from_database = 0
+        self.stripe_calls = 0
+        self.recorded = 0
+        self._lock = threading.Lock()
+
+    def incr(self, name: str, amount: int = 1):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + amount)
+
+    def snapshot(self) -> dict:
+        return {
+            "confirmations": self.confirmations,
+            "stripe_calls": self.stripe_calls,
+            "stripe_calls_avoided": self.from_memory + self.from_database,
+            "from_memory": self.from_memory,
+            "from_database": self.from_database,
+            "recorded": self.recorded,
+            "confirmed_intents": confirmed_intents.stats(),
+        }
+
+# payment intent id -> id of the user it was confirmed for
+confirmed_intents = TTLCache(maxsize=CONFIRMED_INTENTS_SIZE, ttl=CONFIRMED_INTENTS_TTL)
+confirm_stats = ConfirmStats()
+metrics.register("payment_confirmations", confirm_stats.snapshot)
+
+def lookup_payment(intent_id: str):
+    """("userId", status) of the recorded payment for an intent, or None"""
+    db = SessionLocal()
+    try:
+        query = text(SELECT_PAYMENT_BY_INTENT).columns(column("userId", Text), column("status", String))
+        return db.execute(query, {"intent_id": intent_id}).fetchone()
+    finally:
+        db.close()
+
+def record_succeeded_payment(user_id: str, intent) -> bool:
+    """Upsert the payment as succeeded, releasing orders held while it had failed;
+    True if this call is the one that recorded it"""
+    amount = (intent.get("amount_received") or intent.amount) / 100
+    db = SessionLocal()
+    try:
+        now = datetime.utcnow()
+        payment_id = db.execute(text(UPSERT_SUCCEEDED_PAYMENT), {
+            "userId": user_id,
+            "intent_id": intent.id,
+            "charge_id": intent.get("latest_charge"),
+            "amount": amount,
+            "currency": intent.currency,
+            "description": intent.get("description"),
+            "now": now
+        }).scalar()
+        if payment_id is not None:
+            record_payment(db, user_id, amount)
+            # The webhook for this success will find the payment already succeeded
+            release_held_orders(db, payment_id, now)
+        db.commit()
+        return payment_id is not None
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+async def confirm_payment(user_id: str, intent_id: str) -> str:
+    """Confirm a checkout payment for a user; returns where the answer came from
+    ("memory", "database" or "stripe") or raises PaymentError"""
+    confirm_stats.incr("confirmations")
+    owner = confirmed_intents.get(intent_id)
+    if owner is not None:
+        if owner != user_id:
+            raise PaymentError(404, "Payment not found")
+        confirm_stats.incr("from_memory")
+        return "memory"
+
+    payment = await run_in_threadpool(lookup_payment, intent_id)
+    if payment is not None:
+        if payment.userId != user_id:
+            raise PaymentError(404, "Payment not found")
+        if payment.status == "succeeded":
+            confirmed_intents.set(intent_id, user_id)
+            confirm_stats.incr("from_database")
+            return "database"
+
+    confirm_stats.incr("stripe_calls")
+    try:
+        intent = await stripe_api.retrieve_payment_intent(intent_id)
+    except StripeUnavailable as e:
+        raise PaymentError(503, f"Payment provider unavailable: {str(e)}")
+    except StripeError as e:
+        raise PaymentError(404 if e.status == 404 else 400, str(e))
+    intended_user = (intent.get("metadata") or {}).get("user_id")
+    if intended_user and intended_user != user_id:
+        raise PaymentError(404, "Payment not found")
+    if intent.status != "succeeded":
+        raise PaymentError(400, "Payment not completed")
+
+    if await run_in_threadpool(record_succeeded_payment, user_id, intent):
+        confirm_stats.incr("recorded")
+    confirmed_intents.set(intent_id, user_id)
+    return "stripe"
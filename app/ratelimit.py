@@ -0,0 +1,171 @@
+"""
+Admission control for the bcrypt-heavy auth routes (/login and /signup)
+
+Every attempt spends a token from a bucket for the client IP and one for the email
+address, and then needs a free slot under a global cap on concurrent auth requests.
+Anything over a limit is shed straight away with a 429 and Retry-After, before any
+password is hashed, instead of waiting on the hashing pool.
+
+Buckets live in hash-sharded LRU maps, one lock per shard. A bucket that has been
+idle long enough to refill completely is the same as no bucket, so it is dropped;
+memory stays proportional to the keys seen in the last few minutes.
+"""
+from collections import OrderedDict
+import math
+import os
+import threading
+import time
+from app.hashing import HASH_WORKERS, HASH_QUEUE_LIMIT
+from app import metrics
+
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "true").lower() == "true"
+RATE_LIMIT_SHARDS = int(os.getenv("RATE_LIMIT_SHARDS", "16"))
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", "100000"))
+RATE_LIMIT_TRUST_FORWARDED = os.getenv("RATE_LIMIT_TRUST_FORWARDED", "false").lower() == "true"
+AUTH_IP_BURST = float(os.getenv("AUTH_IP_BURST", "20"))
+AUTH_IP_PER_MINUTE = float(os.getenv("AUTH_IP_PER_MINUTE", "30"))
+AUTH_EMAIL_BURST = float(os.getenv("AUTH_EMAIL_BURST", "5"))
+AUTH_EMAIL_PER_MINUTE = float(os.getenv("AUTH_EMAIL_PER_MINUTE", "5"))
+AUTH_CONCURRENCY_LIMIT = int(os.getenv("AUTH_CONCURRENCY_LIMIT", str(HASH_WORKERS + HASH_QUEUE_LIMIT // 2)))
+AUTH_RETRY_AFTER_SECONDS = int(os.getenv("AUTH_RETRY_AFTER_SECONDS", "1"))
+
+class RequestShed(Exception):
+    """Raised when a request is over a limit (reason: ip, email or concurrency)"""
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(f"Request shed ({reason}), retry after {retry_after}s")
+        self.reason = reason
+        self.retry_after = retry_after
+
+class TokenBucketLimiter:
+    """Per-key token buckets: burst tokens, refilled at rate tokens per second"""
+    def __init__(self, rate: float, burst: float, shards: int = RATE_LIMIT_SHARDS, max_keys: int = RATE_LIMIT_MAX_KEYS):
+        self.rate = max(rate, 1e-9)
+        self.burst = max(1.0, burst)
+        # After this long a bucket is full again, indistinguishable from a new one
+        self.idle_seconds = self.burst / self.rate
+        self._shards = [(threading.Lock(), OrderedDict()) for _ in range(max(1, shards))]
+        self._max_keys_per_shard = max(1, max_keys // len(self._shards))
+        self.evictions = 0
+
+    def acquire(self, key: str, now: float = None) -> float:
+        """Take a token for key; 0 if allowed, else the seconds until one is available"""
+        now = time.monotonic() if now is None else now
+        lock, buckets = self._shards[hash(key) % len(self._shards)]
+        with lock:
+            # Buckets are kept in last-used order, so idle ones are at the front
+            while buckets:
+                oldest = next(iter(buckets))
+                if now - buckets[oldest][1] < self.idle_seconds and len(buckets) < self._max_keys_per_shard:
+                    break
+                del buckets[oldest]
+                self.evictions += 1
+
+            bucket = buckets.get(key)
+            if bucket is None:
+                bucket = buckets[key] = [self.burst, now]
+            else:
+                bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+                bucket[1] = now
+                buckets.move_to_end(key)
+            if bucket[0] >= 1:
+                bucket[0] -= 1
+                return 0.0
+            return (1 - bucket[0]) / self.rate
+
+    def active_keys(self) -> int:
+        return sum(len(buckets) for _, buckets in self._shards)
+
+class ConcurrencyGate:
+    """Non-blocking cap on requests in flight; a full gate rejects instead of queuing"""
+    def __init__(self, limit: int):
+        self.limit = max(1, limit)
+        self.in_flight = 0
+        self._lock = threading.Lock()
+
+    def try_acquire(self) -> bool:
+        with self._lock:
+            if self.in_flight >= self.limit:
+                return False
+            self.in_flight += 1
+            return True
+
+    def release(self):
+        with self._lock:
+            self.in_flight -= 1
+
+class _Slot:
+    def __init__(self, gate: ConcurrencyGate = None):
+        self._gate = gate
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        if self._gate is not None:
+            self._gate.release()
+        return False
+
+class AuthAdmission:
+    """Per-IP and per-email rate limits plus a global concurrency cap for auth routes"""
+    def __init__(self, enabled: bool = RATE_LIMIT_ENABLED,
+                 ip_burst: float = AUTH_IP_BURST, ip_per_minute: float = AUTH_IP_PER_MINUTE,
+                 email_burst: float = AUTH_EMAIL_BURST, email_per_minute: float = AUTH_EMAIL_PER_MINUTE,
+                 concurrency: int = AUTH_CONCURRENCY_LIMIT):
+        self.enabled = enabled
+        self.by_ip = TokenBucketLimiter(ip_per_minute / 60, ip_burst)
+        self.by_email = TokenBucketLimiter(email_per_minute / 60, email_burst)
+        self.gate = ConcurrencyGate(concurrency)
+        self._lock = threading.Lock()
+        self.admitted = 0
+        self.shed = {"ip": 0, "email": 0, "concurrency": 0}
+
+    def _shed(self, reason: str, retry_after: float):
+        with self._lock:
+            self.shed[reason] += 1
+        raise RequestShed(reason, max(1, math.ceil(retry_after)))
+
+    def admit(self, client: str, email: str = None) -> _Slot:
+        """Admit an auth attempt or raise RequestShed; use the result as a context
+        manager around the work so the concurrency slot is released"""
+        if not self.enabled:
+            return _Slot()
+        if client:
+            wait = self.by_ip.acquire(client)
+            if wait:
+                self._shed("ip", wait)
+        email = (email or "").strip().lower()
+        if email:
+            wait = self.by_email.acquire(email)
+            if wait:
+                self._shed("email", wait)
+        if not self.gate.try_acquire():
+            self._shed("concurrency", AUTH_RETRY_AFTER_SECONDS)
+        with self._lock:
+            self.admitted += 1
+        return _Slot(self.gate)
+
+    def stats(self) -> dict:
+        with self._lock:
+            shed = dict(self.shed)
+        return {
+            "enabled": self.enabled,
+            "admitted": self.admitted,
+            "shed": shed,
+            "shed_total": sum(shed.values()),
+            "in_flight": self.gate.in_flight,
+            "concurrency_limit": self.gate.limit,
+            "active_ip_keys": self.by_ip.active_keys(),
+            "active_email_keys": self.by_email.active_keys(),
+            "evictions": self.by_ip.evictions + self.by_email.evictions,
+        }
+
+def client_ip(request) -> str:
+    """Address the request came from; the first X-Forwarded-For hop behind a trusted proxy"""
+    if RATE_LIMIT_TRUST_FORWARDED:
+        forwarded = request.headers.get("x-forwarded-for")
+        if forwarded:
+            return forwarded.split(",")[0].strip()
+    return request.client.host if request.client else ""
+
+auth_admission = AuthAdmission()
+metrics.register("auth_admission", auth_admission.stats)
@@ -0,0 +1,165 @@
+"""
+Content-addressed cache of finished analysis reports
+
+Reports are keyed by app.business.result_key: a hash of the normalized business
+identity, the digest of its review set and the analysis version. Two orders for the
+same business with the same reviews (typed differently or not) share one analysis.
+Entries live in the "AnalysisCache" table with a TTL and an LRU bound on the row
+count, with a small in-process TTLCache in front of it. Hits answered from memory
+are batched and written to the table's hit counters at most every
+ANALYSIS_CACHE_TOUCH_SECONDS, and always before the LRU bound is enforced; a batch
+whose transaction does not commit goes back to be written with the next one.
+"""
+from datetime import datetime, timedelta
+from sqlalchemy import text, event, DateTime
+from sqlalchemy.orm import Session
+from app.cache import TTLCache
+from app import metrics
+import os
+import threading
+import time
+
+ANALYSIS_CACHE_ENABLED = os.getenv("ANALYSIS_CACHE_ENABLED", "true").lower() == "true"
+ANALYSIS_CACHE_TTL = int(os.getenv("ANALYSIS_CACHE_TTL", str(7 * 86400)))
+ANALYSIS_CACHE_MAX_ENTRIES = int(os.getenv("ANALYSIS_CACHE_MAX_ENTRIES", "10000"))
+ANALYSIS_CACHE_MEMORY_SIZE = int(os.getenv("ANALYSIS_CACHE_MEMORY_SIZE", "256"))
+ANALYSIS_CACHE_MEMORY_TTL = float(os.getenv("ANALYSIS_CACHE_MEMORY_TTL", "300"))
+ANALYSIS_CACHE_TOUCH_SECONDS = float(os.getenv("ANALYSIS_CACHE_TOUCH_SECONDS", "60"))
+
+SELECT_ENTRY = 'SELECT report, expires_at FROM "AnalysisCache" WHERE key = :key AND expires_at > :now'
+
+TOUCH_ENTRY = 'UPDATE "AnalysisCache" SET hits = hits + :hits, last_hit_at = :now WHERE key = :key'
+
+UPSERT_ENTRY = """
+INSERT INTO "AnalysisCache" (key, business_key, order_id, review_count, report, hits, "createdAt", expires_at, last_hit_at)
+VALUES (:key, :business_key, :order_id, :review_count, :report, 0, :now, :expires_at, :now)
+ON CONFLICT (key) DO UPDATE SET
+    order_id = excluded.order_id,
+    review_count = excluded.review_count,
+    report = excluded.report,
+    expires_at = excluded.expires_at,
+    last_hit_at = excluded.last_hit_at
+"""
+
+# Session.info key: (cache, touches) batches written in a transaction that has not committed yet
+PENDING_TOUCHES = "analysis_cache_touches"
+
+DELETE_EXPIRED = 'DELETE FROM "AnalysisCache" WHERE expires_at <= :now'
+
+# Least recently used entries beyond the size bound
+DELETE_OLDEST = """
+DELETE FROM "AnalysisCache" WHERE key IN (
+    SELECT key FROM "AnalysisCache" ORDER BY last_hit_at ASC LIMIT :excess
+)
+"""
+
+class ResultCache:
+    """Report lookups and stores, with hit/miss counters for this process"""
+    def __init__(self, ttl: int = ANALYSIS_CACHE_TTL, max_entries: int = ANALYSIS_CACHE_MAX_ENTRIES,
+                 memory_size: int = ANALYSIS_CACHE_MEMORY_SIZE, memory_ttl: float = ANALYSIS_CACHE_MEMORY_TTL,
+                 touch_seconds: float = ANALYSIS_CACHE_TOUCH_SECONDS):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.memory = TTLCache(maxsize=memory_size, ttl=memory_ttl)
+        self.touch_seconds = touch_seconds
+        # key -> (hits, last hit) answered from memory and not yet written to the table
+        self._touches = {}
+        self._touched_at = time.monotonic()
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+    def _count(self, name: str, amount: int = 1):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + amount)
+
+    def _flush_touches(self, db, force: bool = False):
+        """Write batched memory hits to the table; the caller commits"""
+        with self._lock:
+            if not self._touches or (not force and time.monotonic() - self._touched_at < self.touch_seconds):
+                return
+            touches, self._touches = self._touches, {}
+            self._touched_at = time.monotonic()
+        db.info.setdefault(PENDING_TOUCHES, []).append((self, touches))
+        db.execute(text(TOUCH_ENTRY), [{"key": key, "hits": hits, "now": last_hit}
+                                       for key, (hits, last_hit) in touches.items()])
+
+    def _restore_touches(self, touches: dict):
+        """Put back touches whose UPDATE was rolled back"""
+        with self._lock:
+            for key, (hits, last_hit) in touches.items():
+                pending = self._touches.get(key)
+                if pending is not None:
+                    hits, last_hit = hits + pending[0], max(last_hit, pending[1])
+                self._touches[key] = (hits, last_hit)
+
+    def get(self, db, key: str):
+        """The cached report JSON for key, or None; the caller commits"""
+        report = self.memory.get(key)
+        if report is not None:
+            with self._lock:
+                hits, _ = self._touches.get(key, (0, None))
+                self._touches[key] = (hits + 1, datetime.utcnow())
+            self._flush_touches(db)
+        else:
+            now = datetime.utcnow()
+            row = db.execute(text(SELECT_ENTRY).columns(expires_at=DateTime), {"key": key, "now": now}).fetchone()
+            if row is None:
+                self._count("misses")
+                return None
+            report = row.report
+            db.execute(text(TOUCH_ENTRY), {"key": key, "hits": 1, "now": now})
+            # Never keep an entry in memory past its expiry in the table
+            self.memory.set(key, report, ttl=min(self.memory.ttl, (row.expires_at - now).total_seconds()))
+        self._count("hits")
+        return report
+
+    def put(self, db, key: str, business_key: str, order_id: str, review_count: int, report: str):
+        """Store a report and enforce the TTL and size bound; the caller commits"""
+        # Eviction is by last_hit_at, so it must see the hits answered from memory
+        self._flush_touches(db, force=True)
+        now = datetime.utcnow()
+        db.execute(text(UPSERT_ENTRY), {
+            "key": key,
+            "business_key": business_key,
+            "order_id": order_id,
+            "review_count": review_count,
+            "report": report,
+            "now": now,
+            "expires_at": now + timedelta(seconds=self.ttl)
+        })
+        self.memory.set(key, report, ttl=min(self.memory.ttl, self.ttl))
+        self._count("stores")
+        evicted = db.execute(text(DELETE_EXPIRED), {"now": now}).rowcount
+        excess = db.execute(text('SELECT COUNT(*) FROM "AnalysisCache"')).scalar() - self.max_entries
+        if excess > 0:
+            evicted += db.execute(text(DELETE_OLDEST), {"excess": excess}).rowcount
+        if evicted:
+            self._count("evictions", evicted)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "stores": self.stores,
+            "evictions": self.evictions,
+            "memory": self.memory.stats(),
+        }
+
+@event.listens_for(Session, "after_commit")
+def receive_after_commit(session):
+    session.info.pop(PENDING_TOUCHES, None)
+
+@event.listens_for(Session, "after_transaction_end")
+def receive_after_transaction_end(session, transaction):
+    # Rolled back, or closed without a commit
+    if transaction.parent is None:
+        for cache, touches in session.info.pop(PENDING_TOUCHES, ()):
+            cache._restore_touches(touches)
+
+result_cache = ResultCache()
+metrics.register("analysis_cache", result_cache.stats)
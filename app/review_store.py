@@ -0,0 +1,219 @@
+"""
+On-disk columnar store of pre-tokenized reviews
+
+A full analysis of a business writes its distinct reviews as flat .npy columns
+(token ids, per-review offsets, ratings, timestamps, review ids) plus the words
+behind the token ids. Later rebuilds of the report open the columns with
+np.load(mmap_mode="r") and score straight from the page cache, with no database
+read and no tokenizing.
+
+There is one entry per business (app.business.business_key), stamped with the
+review set it was built from (its content digest, so orders for the business with
+the same reviews share the entry, unless some reviews are undated and carry their
+ingest time instead); an entry with another stamp is a miss.
+Entries are evicted least recently used first once the store exceeds its size cap.
+"""
+from datetime import datetime
+from app import metrics
+import json
+import os
+import shutil
+import struct
+import tempfile
+import threading
+import uuid
+import numpy as np
+
+REVIEW_STORE_ENABLED = os.getenv("REVIEW_STORE_ENABLED", "true").lower() == "true"
+REVIEW_STORE_DIR = os.getenv("REVIEW_STORE_DIR", os.path.join(tempfile.gettempdir(), "review-store"))
+REVIEW_STORE_MAX_BYTES = int(os.getenv("REVIEW_STORE_MAX_BYTES", str(4 * 1024 ** 3)))
+
+COLUMNS = {"ids": np.int32, "offsets": np.int64, "ratings": np.int8, "timestamps": np.int64, "review_ids": np.int64}
+_META = "meta.json"
+_WORDS = "words.txt"
+# Fixed-size .npy header so the shape can be filled in after streaming the data
+_NPY_MAGIC = b"\x93NUMPY\x01\x00"
+_NPY_HEADER_SIZE = 128
+
+class ReviewColumns:
+    """A store entry, memory-mapped"""
+    def __init__(self, path: str, meta: dict, words: list):
+        self.path = path
+        self.meta = meta
+        self.words = words
+        for name in COLUMNS:
+            setattr(self, name, np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r"))
+
+    @property
+    def review_count(self) -> int:
+        return len(self.offsets) - 1
+
+    @property
+    def duplicate_count(self) -> int:
+        return self.meta["duplicate_count"]
+
+    @property
+    def last_review_id(self) -> int:
+        return self.meta["last_review_id"]
+
+    def batches(self, batch_size: int):
+        """(ids, offsets, ratings, timestamps, review_ids) per batch of reviews; ids and the
+        per-review columns are views of the mapped files, offsets are rebased to the batch"""
+        for start in range(0, self.review_count, batch_size):
+            end = min(start + batch_size, self.review_count)
+            offsets = np.asarray(self.offsets[start:end + 1])
+            yield (self.ids[offsets[0]:offsets[-1]], offsets - offsets[0], self.ratings[start:end],
+                   self.timestamps[start:end], self.review_ids[start:end])
+
+class _ColumnFile:
+    """A 1-d .npy file written a chunk at a time"""
+    def __init__(self, path: str, dtype):
+        self.dtype = np.dtype(dtype)
+        self.length = 0
+        self.file = open(path, "wb")
+        self.file.write(b"\0" * _NPY_HEADER_SIZE)
+
+    def append(self, values: np.ndarray):
+        values = np.ascontiguousarray(values, dtype=self.dtype)
+        self.file.write(values.data)
+        self.length += len(values)
+
+    def close(self):
+        header = repr({"descr": np.lib.format.dtype_to_descr(self.dtype), "fortran_order": False, "shape": (self.length,)})
+        header = header.ljust(_NPY_HEADER_SIZE - len(_NPY_MAGIC) - 3) + "\n"
+        self.file.seek(0)
+        self.file.write(_NPY_MAGIC + struct.pack("<H", len(header)) + header.encode("latin1"))
+        self.file.close()
+
+class ReviewStoreWriter:
+    """Builds an entry in a scratch directory; commit moves it into place"""
+    def __init__(self, store: "ReviewStore", key: str, stamp: str):
+        self.store = store
+        self.key = key
+        self.stamp = stamp
+        self.path = os.path.join(store.root, f".{key}.{uuid.uuid4().hex}.tmp")
+        os.makedirs(self.path)
+        self.files = {name: _ColumnFile(os.path.join(self.path, f"{name}.npy"), dtype) for name, dtype in COLUMNS.items()}
+        self.files["offsets"].append(np.zeros(1, dtype=np.int64))
+        self.tokens = 0
+
+    def append(self, ids, offsets, ratings, timestamps, review_ids):
+        """Add a batch of reviews (offsets relative to the batch, len(reviews) + 1)"""
+        self.files["ids"].append(ids)
+        self.files["offsets"].append(np.asarray(offsets[1:]) + self.tokens)
+        self.files["ratings"].append(ratings)
+        self.files["timestamps"].append(timestamps)
+        self.files["review_ids"].append(review_ids)
+        self.tokens += len(ids)
+
+    def commit(self, words: list, duplicate_count: int, last_review_id: int):
+        for column in self.files.values():
+            column.close()
+        with open(os.path.join(self.path, _WORDS), "w", encoding="utf-8") as f:
+            f.write("\n".join(words))
+        meta = {"stamp": self.stamp, "reviews": self.files["ratings"].length, "tokens": self.tokens,
+                "duplicate_count": duplicate_count, "last_review_id": last_review_id,
+                "createdAt": datetime.utcnow().isoformat()}
+        with open(os.path.join(self.path, _META), "w") as f:
+            json.dump(meta, f)
+        self.store._install(self.key, self.path)
+
+    def abort(self):
+        for column in self.files.values():
+            if not column.file.closed:
+                column.file.close()
+        shutil.rmtree(self.path, ignore_errors=True)
+
+class ReviewStore:
+    """Directory of per-business entries with a total size cap"""
+    def __init__(self, root: str = REVIEW_STORE_DIR, max_bytes: int = REVIEW_STORE_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+    def _count(self, name: str, amount: int = 1):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + amount)
+
+    def open(self, key: str, stamp: str):
+        """The entry for key if it was built from review set stamp, else None"""
+        path = os.path.join(self.root, key)
+        try:
+            with open(os.path.join(path, _META)) as f:
+                meta = json.load(f)
+            if meta["stamp"] != stamp:
+                self._count("misses")
+                return None
+            with open(os.path.join(path, _WORDS), encoding="utf-8") as f:
+                words = f.read().split("\n")
+            columns = ReviewColumns(path, meta, words)
+        except (OSError, ValueError, KeyError):
+            # Missing, or replaced or evicted while we were reading it
+            self._count("misses")
+            return None
+        # The meta file's mtime is the entry's last use, for LRU eviction
+        os.utime(os.path.join(path, _META))
+        self._count("hits")
+        return columns
+
+    def writer(self, key: str, stamp: str) -> ReviewStoreWriter:
+        os.makedirs(self.root, exist_ok=True)
+        return ReviewStoreWriter(self, key, stamp)
+
+    def _install(self, key: str, scratch: str):
+        path = os.path.join(self.root, key)
+        # Readers keep their mappings of the old files after they are removed
+        shutil.rmtree(path, ignore_errors=True)
+        try:
+            os.rename(scratch, path)
+        except OSError:
+            # Another worker installed the same business first
+            shutil.rmtree(scratch, ignore_errors=True)
+            return
+        self._count("writes")
+        self.evict()
+
+    def entries(self):
+        """(last used, bytes, path) of every entry"""
+        result = []
+        try:
+            names = os.listdir(self.root)
+        except FileNotFoundError:
+            return result
+        for name in names:
+            path = os.path.join(self.root, name)
+            try:
+                used = os.stat(os.path.join(path, _META)).st_mtime
+                size = sum(entry.stat().st_size for entry in os.scandir(path))
+            except OSError:
+                continue
+            result.append((used, size, path))
+        return result
+
+    def evict(self):
+        """Remove least recently used entries until the store fits max_bytes"""
+        entries = sorted(self.entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+            self._count("evictions")
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "writes": self.writes,
+            "evictions": self.evictions,
+        }
+
+review_store = ReviewStore()
+metrics.register("review_store", review_store.stats)
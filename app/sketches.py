@@ -0,0 +1,133 @@
+"""
+Mergeable quantile sketch (KLL)
+
+A KLLSketch keeps a few hundred of the values it has seen, arranged in levels where
+an item on level h stands for 2**h original values. When a level fills up it is
+sorted and every other item is promoted to the level above, so memory stays
+O(k log(n / k)) while rank error stays around 1.7 / k. Two sketches of disjoint data
+merge into a sketch of the union, which is what lets report aggregates be updated
+incrementally and combined across workers.
+"""
+import struct
+import numpy as np
+
+DEFAULT_K = 200
+_FORMAT_VERSION = 1
+_HEADER = struct.Struct("<BHqddB")
+
+class KLLSketch:
+    """Streaming quantiles over float values"""
+    __slots__ = ("k", "count", "min", "max", "levels")
+
+    def __init__(self, k: int = DEFAULT_K):
+        self.k = k
+        self.count = 0
+        self.min = float("inf")
+        self.max = float("-inf")
+        self.levels = [np.zeros(0, dtype=np.float32)]
+
+    def __len__(self):
+        return self.count
+
+    def _capacity(self, level: int) -> int:
+        depth = len(self.levels) - level - 1
+        return max(2, int(np.ceil(self.k * (2 / 3) ** depth)))
+
+    def update(self, value: float):
+        self.update_many(np.asarray([value], dtype=np.float64))
+
+    def update_many(self, values):
+        """Add an array of values"""
+        values = np.asarray(values, dtype=np.float64)
+        values = values[~np.isnan(values)]
+        if len(values) == 0:
+            return
+        self.count += len(values)
+        self.min = min(self.min, float(values.min()))
+        self.max = max(self.max, float(values.max()))
+        self.levels[0] = np.concatenate([self.levels[0], values.astype(np.float32)])
+        self._compress()
+
+    def merge(self, other: "KLLSketch") -> "KLLSketch":
+        """A new sketch summarizing both inputs"""
+        merged = KLLSketch(max(self.k, other.k))
+        merged.count = self.count + other.count
+        merged.min = min(self.min, other.min)
+        merged.max = max(self.max, other.max)
+        depth = max(len(self.levels), len(other.levels))
+        merged.levels = [
+            np.concatenate([
+                self.levels[h] if h < len(self.levels) else np.zeros(0, dtype=np.float32),
+                other.levels[h] if h < len(other.levels) else np.zeros(0, dtype=np.float32),
+            ])
+            for h in range(depth)
+        ]
+        merged._compress()
+        return merged
+
+    def _compress(self):
+        level = 0
+        while level < len(self.levels):
+            items = self.levels[level]
+            if len(items) > self._capacity(level):
+                if level + 1 == len(self.levels):
+                    self.levels.append(np.zeros(0, dtype=np.float32))
+                items = np.sort(items)
+                # An odd item stays behind so the promoted half carries exactly twice its weight
+                leftover = items[-1:] if len(items) % 2 else items[:0]
+                paired = items[:len(items) - len(leftover)]
+                # Pseudo-random (but reproducible) choice of which half survives, so compactions do not skew low or high
+                offset = ((self.count * 0x9E3779B1 + level * 0x85EBCA6B) >> 16) & 1
+                self.levels[level + 1] = np.concatenate([self.levels[level + 1], paired[offset::2]])
+                self.levels[level] = leftover.copy()
+            level += 1
+
+    def _weighted(self):
+        values = np.concatenate(self.levels)
+        weights = np.concatenate([np.full(len(items), 1 << h, dtype=np.int64) for h, items in enumerate(self.levels)])
+        order = np.argsort(values, kind="stable")
+        return values[order], np.cumsum(weights[order])
+
+    def quantiles(self, qs) -> list:
+        """Approximate values at each quantile in qs (0..1); None when empty"""
+        if self.count == 0:
+            return [None for _ in qs]
+        values, cumulative = self._weighted()
+        total = cumulative[-1]
+        results = []
+        for q in qs:
+            if q <= 0:
+                results.append(self.min)
+            elif q >= 1:
+                results.append(self.max)
+            else:
+                index = min(int(np.searchsorted(cumulative, q * total, side="left")), len(values) - 1)
+                results.append(float(values[index]))
+        return results
+
+    def quantile(self, q: float):
+        return self.quantiles([q])[0]
+
+    def to_bytes(self) -> bytes:
+        """Compact binary form: header, level sizes, then float32 items"""
+        sizes = np.array([len(items) for items in self.levels], dtype=np.uint32)
+        return b"".join([
+            _HEADER.pack(_FORMAT_VERSION, self.k, self.count, self.min, self.max, len(self.levels)),
+            sizes.tobytes(),
+            np.concatenate(self.levels).astype(np.float32).tobytes(),
+        ])
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "KLLSketch":
+        version, k, count, low, high, depth = _HEADER.unpack_from(data)
+        if version != _FORMAT_VERSION:
+            raise ValueError(f"Unsupported sketch format {version}")
+        sketch = cls(k)
+        sketch.count, sketch.min, sketch.max = count, low, high
+        offset = _HEADER.size
+        sizes = np.frombuffer(data, dtype=np.uint32, count=depth, offset=offset)
+        items = np.frombuffer(data, dtype=np.float32, offset=offset + sizes.nbytes)
+        bounds = np.zeros(depth + 1, dtype=np.int64)
+        np.cumsum(sizes, out=bounds[1:])
+        sketch.levels = [items[bounds[h]:bounds[h + 1]].copy() for h in range(depth)]
+        return sketch
@@ -0,0 +1,319 @@
+"""
+Async Stripe API client
+
+Calls go through one pooled httpx.AsyncClient, so checkout requests await Stripe instead
+of blocking the event loop, and reuse keep-alive connections instead of paying a TLS
+handshake each. Every call has connect and read timeouts. Reads, and creates sent
+with an Idempotency-Key, are retried a bounded number of times on network errors,
+429s and 5xx responses (or whatever Stripe-Should-Retry says). A circuit breaker
+fails calls fast while Stripe is unreachable, letting one probe through every
+STRIPE_BREAKER_RESET_SECONDS.
+
+STRIPE_API_BASE points the client at app/fake_stripe.py for offline load tests.
+"""
+from app import metrics
+import asyncio
+import hashlib
+import hmac
+import json
+import os
+import random
+import threading
+import time
+import uuid
+import httpx
+
+STRIPE_API_BASE = os.getenv("STRIPE_API_BASE", "https://api.stripe.com")
+# Empty: the account's default API version
+STRIPE_API_VERSION = os.getenv("STRIPE_API_VERSION", "")
+STRIPE_CONNECT_TIMEOUT = float(os.getenv("STRIPE_CONNECT_TIMEOUT", "2"))
+STRIPE_TIMEOUT = float(os.getenv("STRIPE_TIMEOUT", "10"))
+STRIPE_MAX_CONNECTIONS = int(os.getenv("STRIPE_MAX_CONNECTIONS", "20"))
+STRIPE_MAX_RETRIES = int(os.getenv("STRIPE_MAX_RETRIES", "2"))
+STRIPE_RETRY_BASE_SECONDS = float(os.getenv("STRIPE_RETRY_BASE_SECONDS", "0.25"))
+STRIPE_BREAKER_FAILURES = int(os.getenv("STRIPE_BREAKER_FAILURES", "5"))
+STRIPE_BREAKER_RESET_SECONDS = float(os.getenv("STRIPE_BREAKER_RESET_SECONDS", "30"))
+# Stripe's default tolerance for the signed timestamp of a webhook
+WEBHOOK_TOLERANCE_SECONDS = int(os.getenv("WEBHOOK_TOLERANCE_SECONDS", "300"))
+
+class StripeError(Exception):
+    """A failed Stripe call; status and code are Stripe's when it answered"""
+    def __init__(self, message: str, status: int = None, code: str = None):
+        super().__init__(message)
+        self.status = status
+        self.code = code
+
+class StripeUnavailable(StripeError):
+    """Stripe could not be reached, timed out, or the circuit breaker is open"""
+
+class WebhookError(Exception):
+    """An event that cannot be accepted: bad signature, stale timestamp or malformed body"""
+
+class StripeObject(dict):
+    """A Stripe API object whose fields are also readable as attributes, like the stripe library's"""
+    def __getattr__(self, name):
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name)
+
+def encode_form(params: dict, prefix: str = None) -> list:
+    """Stripe's form encoding of nested parameters: metadata[email]=..., items[0][price]=..."""
+    pairs = []
+    for key, value in params.items():
+        name = f"{prefix}[{key}]" if prefix else str(key)
+        if value is None:
+            continue
+        if isinstance(value, dict):
+            pairs += encode_form(value, name)
+        elif isinstance(value, (list, tuple)):
+            pairs += encode_form(dict(enumerate(value)), name)
+        elif isinstance(value, bool):
+            pairs.append((name, "true" if value else "false"))
+        else:
+            pairs.append((name, str(value)))
+    return pairs
+
+def sign_payload(payload: bytes, secret: str, timestamp: int = None) -> str:
+    """A Stripe-Signature header for payload, as Stripe would send it"""
+    timestamp = int(time.time()) if timestamp is None else timestamp
+    signature = hmac.new(secret.encode(), f"{timestamp}.".encode() + payload, hashlib.sha256).hexdigest()
+    return f"t={timestamp},v1={signature}"
+
+def verify_signature(payload: bytes, header: str, secret: str, tolerance: int = WEBHOOK_TOLERANCE_SECONDS) -> dict:
+    """Check a Stripe-Signature header and return the parsed event"""
+    if not header:
+        raise WebhookError("Missing Stripe-Signature header")
+    timestamp, signatures = None, []
+    for item in header.split(","):
+        key, _, value = item.strip().partition("=")
+        if key == "t":
+            timestamp = value
+        elif key == "v1":
+            signatures.append(value)
+    if not timestamp or not timestamp.isdigit() or not signatures:
+        raise WebhookError("Malformed Stripe-Signature header")
+    expected = hmac.new(secret.encode(), timestamp.encode() + b"." + payload, hashlib.sha256).hexdigest()
+    if not any(hmac.compare_digest(expected, signature) for signature in signatures):
+        raise WebhookError("Signature does not match")
+    if tolerance and abs(time.time() - int(timestamp)) > tolerance:
+        raise WebhookError("Timestamp outside the tolerance zone")
+    try:
+        event = json.loads(payload, object_hook=StripeObject)
+    except ValueError:
+        raise WebhookError("Payload is not JSON")
+    if not isinstance(event, dict) or not event.get("id") or not event.get("type"):
+        raise WebhookError("Payload is not an event")
+    return event
+
+class CircuitBreaker:
+    """Opens after consecutive failures; once reset_seconds have passed, one probe call
+    is let through (half-open) and its outcome closes or re-opens the breaker"""
+    def __init__(self, failures: int = STRIPE_BREAKER_FAILURES, reset_seconds: float = STRIPE_BREAKER_RESET_SECONDS):
+        self.threshold = max(1, failures)
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+        self.opened = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if not self.probing and time.monotonic() - self.opened_at >= self.reset_seconds:
+                self.probing = True
+                return True
+            self.rejected += 1
+            return False
+
+    def success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self.probing = False
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.probing or (self.opened_at is None and self.failures >= self.threshold):
+                self.opened_at = time.monotonic()
+                self.opened += 1
+            self.probing = False
+
+    def abandon(self):
+        with self._lock:
+            self.probing = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        return "half_open" if self.probing else "open"
+
+class StripeClient:
+    """The subset of the Stripe API the app uses"""
+    def __init__(self, secret_key: str, webhook_secret: str = None, base_url: str = STRIPE_API_BASE,
+                 transport: httpx.AsyncBaseTransport = None, max_retries: int = STRIPE_MAX_RETRIES):
+        self.secret_key = secret_key
+        self.webhook_secret = webhook_secret
+        self.base_url = base_url
+        self.transport = transport
+        self.max_retries = max_retries
+        self.breaker = CircuitBreaker()
+        self.calls = 0
+        self.retries = 0
+        self.failures = 0
+        self.latency = {}
+        self._client = None
+        self._loop = None
+        self._lock = threading.Lock()
+
+    def configure(self, base_url: str = None, transport: httpx.AsyncBaseTransport = None):
+        """Point the client elsewhere (e.g. at the fake server); takes effect on the next call"""
+        self.base_url = base_url or self.base_url
+        self.transport = transport
+        self._client = None
+
+    def http(self) -> httpx.AsyncClient:
+        loop = asyncio.get_running_loop()
+        # Connections belong to the event loop that opened them
+        if self._client is None or self._loop is not loop:
+            headers = {"Authorization": f"Bearer {self.secret_key}"}
+            if STRIPE_API_VERSION:
+                headers["Stripe-Version"] = STRIPE_API_VERSION
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                headers=headers,
+                timeout=httpx.Timeout(STRIPE_TIMEOUT, connect=STRIPE_CONNECT_TIMEOUT),
+                limits=httpx.Limits(max_connections=STRIPE_MAX_CONNECTIONS, max_keepalive_connections=STRIPE_MAX_CONNECTIONS),
+                transport=self.transport
+            )
+            self._loop = loop
+        return self._client
+
+    async def aclose(self):
+        client, self._client = self._client, None
+        if client is not None:
+            await client.aclose()
+
+    def _count(self, name: str, amount: int = 1):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + amount)
+
+    def _histogram(self, operation: str) -> metrics.LatencyHistogram:
+        histogram = self.latency.get(operation)
+        if histogram is None:
+            with self._lock:
+                histogram = self.latency.setdefault(operation, metrics.LatencyHistogram())
+        return histogram
+
+    async def _request(self, operation: str, method: str, path: str, params: dict = None,
+                       idempotency_key: str = None, timeout: float = None) -> StripeObject:
+        """One API call, retried when that is safe: GETs, and POSTs with an idempotency key"""
+        headers = {"Idempotency-Key": idempotency_key} if idempotency_key else {}
+        retryable = method == "GET" or idempotency_key is not None
+        attempts = 1 + (self.max_retries if retryable else 0)
+        extra = {"timeout": httpx.Timeout(timeout, connect=min(timeout, STRIPE_CONNECT_TIMEOUT))} if timeout else {}
+        if method == "GET":
+            extra["params"] = encode_form(params or {})
+        else:
+            extra["data"] = dict(encode_form(params or {}))
+        self._count("calls")
+        for attempt in range(attempts):
+            if not self.breaker.allow():
+                self._count("failures")
+                raise StripeUnavailable("Stripe is unavailable (circuit breaker open)")
+            start = time.perf_counter()
+            try:
+                response = await self.http().request(method, path, headers=headers, **extra)
+            except httpx.TransportError as e:
+                self.breaker.failure()
+                error = StripeUnavailable(f"Stripe request failed: {type(e).__name__}: {str(e)}")
+                retry = True
+            except BaseException:
+                # Cancelled mid-call: a probe that never finished must not keep the breaker open
+                self.breaker.abandon()
+                raise
+            else:
+                if response.status_code < 400:
+                    self.breaker.success()
+                    return json.loads(response.content, object_hook=StripeObject)
+                error = self._error(response)
+                if response.status_code >= 500:
+                    self.breaker.failure()
+                else:
+                    # Stripe answered: the card or request was at fault, not its availability
+                    self.breaker.success()
+                should_retry = response.headers.get("stripe-should-retry")
+                retry = should_retry == "true" if should_retry else response.status_code in (409, 429) or response.status_code >= 500
+            finally:
+                self._histogram(operation).observe(time.perf_counter() - start)
+            if not retry or attempt == attempts - 1:
+                self._count("failures")
+                raise error
+            self._count("retries")
+            await asyncio.sleep(STRIPE_RETRY_BASE_SECONDS * (2 ** attempt) * random.uniform(0.5, 1.0))
+
+    @staticmethod
+    def _error(response: httpx.Response) -> StripeError:
+        try:
+            body = response.json().get("error", {})
+        except ValueError:
+            body = {}
+        message = body.get("message") or f"Stripe returned HTTP {response.status_code}"
+        if response.status_code >= 500:
+            return StripeUnavailable(message, response.status_code, body.get("code"))
+        return StripeError(message, response.status_code, body.get("code"))
+
+    async def create_payment_intent(self, amount: int, currency: str = "usd", description: str = None,
+                                    metadata: dict = None, receipt_email: str = None,
+                                    idempotency_key: str = None, timeout: float = None) -> StripeObject:
+        """Create a payment intent for amount (in cents); safe to retry under its idempotency key"""
+        params = {
+            "amount": amount,
+            "currency": currency,
+            "description": description,
+            "receipt_email": receipt_email,
+            "metadata": metadata,
+        }
+        return await self._request("create_payment_intent", "POST", "/v1/payment_intents", params,
+                                   idempotency_key=idempotency_key or uuid.uuid4().hex, timeout=timeout)
+
+    async def retrieve_payment_intent(self, payment_intent_id: str, timeout: float = None) -> StripeObject:
+        return await self._request("retrieve_payment_intent", "GET", f"/v1/payment_intents/{payment_intent_id}", timeout=timeout)
+
+    async def confirm_payment_intent(self, payment_intent_id: str, payment_method: str = None,
+                                     idempotency_key: str = None, timeout: float = None) -> StripeObject:
+        """Server-side confirmation (the checkout page normally confirms with Stripe.js)"""
+        return await self._request("confirm_payment_intent", "POST", f"/v1/payment_intents/{payment_intent_id}/confirm",
+                                   {"payment_method": payment_method},
+                                   idempotency_key=idempotency_key or uuid.uuid4().hex, timeout=timeout)
+
+    async def create_customer(self, email: str, name: str = None, idempotency_key: str = None) -> StripeObject:
+        return await self._request("create_customer", "POST", "/v1/customers", {"email": email, "name": name or email},
+                                   idempotency_key=idempotency_key or uuid.uuid4().hex)
+
+    async def retrieve_customer(self, customer_id: str) -> StripeObject:
+        return await self._request("retrieve_customer", "GET", f"/v1/customers/{customer_id}")
+
+    def verify_webhook(self, payload: bytes, header: str) -> dict:
+        """Check a webhook's Stripe-Signature against the endpoint secret and return the event"""
+        return verify_signature(payload, header, self.webhook_secret)
+
+    def sign_webhook(self, payload: bytes, timestamp: int = None) -> str:
+        """Stripe-Signature header for a locally generated event"""
+        return sign_payload(payload, self.webhook_secret, timestamp)
+
+    def stats(self) -> dict:
+        return {
+            "calls": self.calls,
+            "retries": self.retries,
+            "failures": self.failures,
+            "breaker": self.breaker.state,
+            "breaker_opened": self.breaker.opened,
+            "breaker_rejected": self.breaker.rejected,
+            "latency": {operation: histogram.snapshot() for operation, histogram in list(self.latency.items())},
+        }
@@ -0,0 +1,392 @@
+"""
+Stripe webhook inbox
+
+The webhook endpoint only checks the signature, stores the raw event in "WebhookEvent"
+(keyed by Stripe's event id, so redeliveries are stored once) and acknowledges; Stripe
+gives up on slow endpoints, so nothing else happens on that path. A background
+processor drains the inbox in batches and applies the events to "Payment" and to the
+orders paid with it:
+
+    payment_intent.succeeded       Payment -> succeeded; orders held for payment -> pending
+    payment_intent.payment_failed  Payment -> failed; its pending orders are held (awaiting_payment)
+    payment_intent.canceled        Payment -> canceled; its pending orders are held (awaiting_payment)
+    charge.refunded                Payment -> refunded, once the charge is fully refunded
+
+Events may arrive late or out of order, so a payment never moves from succeeded back to
+failed or canceled, nor out of refunded. Other event types are stored and ignored.
+
+    python -m app.webhooks --drain
+"""
+from datetime import datetime
+from sqlalchemy import text, column, Text, String, Integer, DateTime, Float
+from app.database import SessionLocal, engine
+from app.auth_db import record_payment, record_order_status_change, update_user_summary
+from app.stripe_config import stripe_api
+from app.stripe_client import WebhookError
+from app import metrics
+import argparse
+import json
+import os
+import sys
+import threading
+
+WEBHOOK_PROCESSOR_ENABLED = os.getenv("WEBHOOK_PROCESSOR_ENABLED", "true").lower() == "true"
+WEBHOOK_BATCH_SIZE = int(os.getenv("WEBHOOK_BATCH_SIZE", "100"))
+WEBHOOK_POLL_SECONDS = float(os.getenv("WEBHOOK_POLL_SECONDS", "1"))
+WEBHOOK_MAX_ATTEMPTS = int(os.getenv("WEBHOOK_MAX_ATTEMPTS", "5"))
+
+PAYMENT_STATUSES = {
+    "payment_intent.succeeded": "succeeded",
+    "payment_intent.payment_failed": "failed",
+    "payment_intent.canceled": "canceled",
+    "charge.refunded": "refunded",
+}
+# Statuses a payment in the given status may not be moved to by a (stale) event
+_BLOCKED = {
+    "succeeded": {"failed", "canceled"},
+    "refunded": {"succeeded", "failed", "canceled"},
+}
+# Orders held because their payment did not go through; neither the job queue
+# (app/jobs.py) nor requeue_order (app/ingest.py) picks up this status
+ORDER_AWAITING_PAYMENT = "awaiting_payment"
+ORDER_HOLD_ERROR = "Payment not completed"
+
+# Row locks are a Postgres feature; the SQLite stand-in has a single writer anyway
+_LOCK_CLAUSE = "FOR UPDATE SKIP LOCKED" if engine.dialect.name == "postgresql" else ""
+_ROW_LOCK_CLAUSE = "FOR UPDATE" if engine.dialect.name == "postgresql" else ""
+
+INSERT_EVENT = """
+INSERT INTO "WebhookEvent" (id, type, payload, status, attempts, received_at)
+VALUES (:id, :type, :payload, 'pending', 0, :now)
+ON CONFLICT (id) DO NOTHING
+"""
+
+SELECT_PENDING_EVENTS = f"""
+SELECT id, type, payload, attempts, received_at FROM "WebhookEvent"
+WHERE status = 'pending'
+ORDER BY received_at
+LIMIT :limit
+{_LOCK_CLAUSE}
+"""
+
+SELECT_PENDING_EVENT = f"""
+SELECT id, type, payload, attempts, received_at FROM "WebhookEvent"
+WHERE id = :id AND status = 'pending'
+{_LOCK_CLAUSE}
+"""
+
+FINISH_EVENT = """
+UPDATE "WebhookEvent" SET status = :status, attempts = attempts + 1, last_error = NULL, processed_at = :now
+WHERE id = :id
+"""
+
+RETRY_EVENT = """
+UPDATE "WebhookEvent" SET status = :status, attempts = attempts + 1, last_error = :error
+WHERE id = :id
+"""
+
+SELECT_BACKLOG = """SELECT COUNT(*), MIN(received_at) FROM "WebhookEvent" WHERE status = 'pending'"""
+
+SELECT_PAYMENT = f"""
+SELECT id, "userId", amount, status FROM "Payment" WHERE stripe_payment_intent_id = :intent_id
+{_ROW_LOCK_CLAUSE}
+"""
+
+UPDATE_PAYMENT = """
+UPDATE "Payment" SET status = :status, stripe_charge_id = COALESCE(:charge_id, stripe_charge_id), "updatedAt" = :now
+WHERE id = :id
+"""
+
+SELECT_PAYMENT_USER = 'SELECT id FROM "User" WHERE id = :user_id OR email = :email LIMIT 1'
+
+INSERT_PAYMENT = """
+INSERT INTO "Payment" ("userId", stripe_payment_intent_id, stripe_charge_id, amount, currency, status, description, "createdAt", "updatedAt")
+VALUES (:userId, :intent_id, :charge_id, :amount, :currency, 'succeeded', :description, :now, :now)
+ON CONFLICT (stripe_payment_intent_id) DO NOTHING
+"""
+
+HOLD_ORDERS = f"""
+UPDATE "Order" SET status = '{ORDER_AWAITING_PAYMENT}', last_error = :error, next_attempt_at = NULL, "updatedAt" = :now
+WHERE payment_id = :payment_id AND status = 'pending'
+RETURNING "userId"
+"""
+
+RELEASE_ORDERS = f"""
+UPDATE "Order" SET status = 'pending', last_error = NULL, next_attempt_at = NULL, "updatedAt" = :now
+WHERE payment_id = :payment_id AND status = '{ORDER_AWAITING_PAYMENT}'
+RETURNING "userId"
+"""
+
+class WebhookStats:
+    """Ack and processing counters for the inbox"""
+    def __init__(self):
+        self.received = 0
+        self.duplicates = 0
+        self.rejected = 0
+        self.processed = 0
+        self.ignored = 0
+        self.retried = 0
+        self.failed = 0
+        self.batches = 0
+        self.backlog = 0
+        self.oldest_pending_seconds = 0.0
+        self.ack = metrics.LatencyHistogram()
+        self.batch_time = metrics.LatencyHistogram()
+        self.delay = metrics.LatencyHistogram(
+            buckets=(0.01, 0.05, 0.1, 0.5, 1, 2, 5, 10, 30, 60, 300, 900, 3600)
+        )
+        self._lock = threading.Lock()
+
+    def incr(self, name: str, amount: int = 1):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + amount)
+
+    def snapshot(self) -> dict:
+        return {
+            "received": self.received,
+            "duplicates": self.duplicates,
+            "rejected": self.rejected,
+            "processed": self.processed,
+            "ignored": self.ignored,
+            "retried": self.retried,
+            "failed": self.failed,
+            "batches": self.batches,
+            "backlog": self.backlog,
+            "oldest_pending_seconds": self.oldest_pending_seconds,
+            "ack": self.ack.snapshot(),
+            "batch_time": self.batch_time.snapshot(),
+            "delay": self.delay.snapshot(),
+        }
+
+webhook_stats = WebhookStats()
+metrics.register("webhooks", webhook_stats.snapshot)
+
+def receive_event(payload: bytes, signature_header: str) -> bool:
+    """Verify and store an event; False if it was already in the inbox"""
+    try:
+        event = stripe_api.verify_webhook(payload, signature_header)
+    except WebhookError:
+        webhook_stats.incr("rejected")
+        raise
+    db = SessionLocal()
+    try:
+        result = db.execute(text(INSERT_EVENT), {
+            "id": event["id"],
+            "type": event["type"],
+            "payload": payload.decode(),
+            "now": datetime.utcnow()
+        })
+        db.commit()
+    finally:
+        db.close()
+    if result.rowcount != 1:
+        webhook_stats.incr("duplicates")
+        return False
+    webhook_stats.incr("received")
+    webhook_processor.wake()
+    return True
+
+def _intent_fields(event: dict):
+    """(payment intent id, charge id) named by a payment_intent.* or charge.* event"""
+    obj = event.get("data", {}).get("object", {})
+    if event["type"].startswith("charge."):
+        return obj.get("payment_intent"), obj.get("id")
+    charge_id = obj.get("latest_charge")
+    if charge_id is None:
+        charges = (obj.get("charges") or {}).get("data") or []
+        charge_id = charges[0]["id"] if charges else None
+    return obj.get("id"), charge_id
+
+def _change_orders(db, statement: str, payment_id: int, old_status: str, new_status: str, now: datetime):
+    for (user_id,) in db.execute(text(statement), {"payment_id": payment_id, "error": ORDER_HOLD_ERROR, "now": now}).fetchall():
+        record_order_status_change(db, user_id, old_status, new_status)
+
+def release_held_orders(db, payment_id: int, now: datetime = None):
+    """Send orders held for this payment back to the job queue, in the caller's transaction"""
+    _change_orders(db, RELEASE_ORDERS, payment_id, ORDER_AWAITING_PAYMENT, "pending", now or datetime.utcnow())
+
+def _insert_payment(db, event: dict, intent_id: str, charge_id: str, now: datetime) -> str:
+    """Record a succeeded payment we had no row for, if its metadata names one of our users"""
+    obj = event["data"]["object"]
+    metadata = obj.get("metadata") or {}
+    user_id = db.execute(text(SELECT_PAYMENT_USER), {
+        "user_id": metadata.get("user_id"),
+        "email": metadata.get("email") or obj.get("receipt_email")
+    }).scalar()
+    if user_id is None:
+        return "ignored"
+    amount = (obj.get("amount_received") or obj.get("amount") or 0) / 100
+    result = db.execute(text(INSERT_PAYMENT), {
+        "userId": user_id,
+        "intent_id": intent_id,
+        "charge_id": charge_id,
+        "amount": amount,
+        "currency": obj.get("currency", "usd"),
+        "description": obj.get("description"),
+        "now": now
+    })
+    if result.rowcount == 1:
+        record_payment(db, user_id, amount)
+    return "processed"
+
+def apply_event(db, event: dict) -> str:
+    """Apply one event in the caller's transaction; returns the event's new status"""
+    status = PAYMENT_STATUSES.get(event["type"])
+    if status is None:
+        return "ignored"
+    if event["type"] == "charge.refunded" and not event.get("data", {}).get("object", {}).get("refunded"):
+        # A partial refund: the payment still stands
+        return "ignored"
+    intent_id, charge_id = _intent_fields(event)
+    if not intent_id:
+        return "ignored"
+    now = datetime.utcnow()
+    query = text(SELECT_PAYMENT).columns(
+        column("id", Integer), column("userId", Text), column("amount", Float), column("status", String)
+    )
+    payment = db.execute(query, {"intent_id": intent_id}).fetchone()
+    if payment is None:
+        # The charge can land before the checkout page confirms it
+        return _insert_payment(db, event, intent_id, charge_id, now) if status == "succeeded" else "ignored"
+    if payment.status == status or status in _BLOCKED.get(payment.status, ()):
+        return "processed"
+    db.execute(text(UPDATE_PAYMENT), {"id": payment.id, "status": status, "charge_id": charge_id, "now": now})
+    if status == "succeeded":
+        record_payment(db, payment.userId, payment.amount)
+        release_held_orders(db, payment.id, now)
+    elif payment.status == "succeeded":
+        # Refunded: the payment no longer counts towards the user's totals
+        update_user_summary(db, payment.userId, payment_count=-1, total_spent=-payment.amount)
+    if status in ("failed", "canceled"):
+        _change_orders(db, HOLD_ORDERS, payment.id, "pending", ORDER_AWAITING_PAYMENT, now)
+    return "processed"
+
+def _finish(db, rows, statuses):
+    now = datetime.utcnow()
+    db.execute(text(FINISH_EVENT), [{"id": row.id, "status": status, "now": now} for row, status in zip(rows, statuses)])
+    for row, status in zip(rows, statuses):
+        webhook_stats.incr(status)
+        if row.received_at is not None:
+            webhook_stats.delay.observe(max(0.0, (now - row.received_at).total_seconds()))
+
+def _event_query(statement: str):
+    return text(statement).columns(
+        column("id", Text), column("type", String), column("payload", Text),
+        column("attempts", Integer), column("received_at", DateTime)
+    )
+
+def _process_one(db, event_id: str):
+    """Apply a single event in its own transaction, recording a failure against it"""
+    row = db.execute(_event_query(SELECT_PENDING_EVENT), {"id": event_id}).fetchone()
+    if row is None:
+        db.rollback()
+        return
+    try:
+        status = apply_event(db, json.loads(row.payload))
+        _finish(db, [row], [status])
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        print(f"Webhook event {row.id} ({row.type}) attempt {row.attempts + 1} failed: {str(e)}", file=sys.stderr)
+        failed = row.attempts + 1 >= WEBHOOK_MAX_ATTEMPTS
+        db.execute(text(RETRY_EVENT), {"id": row.id, "status": "failed" if failed else "pending", "error": str(e)[-4000:]})
+        db.commit()
+        webhook_stats.incr("failed" if failed else "retried")
+
+def process_batch(db, limit: int = WEBHOOK_BATCH_SIZE) -> int:
+    """Apply up to limit pending events in one transaction; returns the number taken"""
+    rows = db.execute(_event_query(SELECT_PENDING_EVENTS), {"limit": limit}).fetchall()
+    if not rows:
+        db.rollback()
+        return 0
+    with webhook_stats.batch_time.time():
+        try:
+            statuses = [apply_event(db, json.loads(row.payload)) for row in rows]
+            _finish(db, rows, statuses)
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            print(f"Webhook batch failed, applying its events one at a time: {str(e)}", file=sys.stderr)
+            for row in rows:
+                _process_one(db, row.id)
+    webhook_stats.incr("batches")
+    return len(rows)
+
+def measure_backlog(db):
+    count, oldest = db.execute(text(SELECT_BACKLOG).columns(column("count", Integer), column("oldest", DateTime))).fetchone()
+    db.rollback()
+    webhook_stats.backlog = count
+    webhook_stats.oldest_pending_seconds = max(0.0, (datetime.utcnow() - oldest).total_seconds()) if oldest else 0.0
+
+class WebhookProcessor:
+    """Drains the inbox on a background thread"""
+    def __init__(self, batch_size: int = WEBHOOK_BATCH_SIZE, poll_seconds: float = WEBHOOK_POLL_SECONDS,
+                 session_factory=SessionLocal):
+        self.batch_size = batch_size
+        self.poll_seconds = poll_seconds
+        self.session_factory = session_factory
+        self.stop_event = threading.Event()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def run_once(self) -> int:
+        db = self.session_factory()
+        try:
+            taken = process_batch(db, self.batch_size)
+            measure_backlog(db)
+            return taken
+        except Exception as e:
+            print(f"Error processing webhook events: {str(e)}", file=sys.stderr)
+            db.rollback()
+            return 0
+        finally:
+            db.close()
+
+    def drain(self) -> int:
+        """Process until the inbox has no pending events; returns the number taken"""
+        total = 0
+        while True:
+            taken = self.run_once()
+            total += taken
+            if taken == 0:
+                return total
+
+    def run(self):
+        while not self.stop_event.is_set():
+            self._wake.clear()
+            if self.run_once() < self.batch_size:
+                self._wake.wait(self.poll_seconds)
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self.stop_event.clear()
+            self._thread = threading.Thread(target=self.run, name="webhook-processor", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def wake(self):
+        self._wake.set()
+
+webhook_processor = WebhookProcessor()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Apply stored Stripe webhook events")
+    parser.add_argument("--drain", action="store_true", help="Exit once the inbox is empty")
+    args = parser.parse_args(argv)
+    if args.drain:
+        print(f"Applied {webhook_processor.drain()} webhook events", file=sys.stderr)
+    else:
+        try:
+            webhook_processor.run()
+        except KeyboardInterrupt:
+            pass
+    print(json.dumps(webhook_stats.snapshot(), default=str), file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+Vectorized review analysis (app/analysis.py) vs. a per-review Python loop
+
+Usage: python benchmarks/bench_analysis.py [reviews ...]   (default: 10000 100000 1000000)
+"""
+from collections import Counter
+import math
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.analysis import (
+    Analyzer, LEXICON, NEGATORS, INTENSIFIERS, STOPWORDS, ASPECTS, ASPECT_NAMES, TOKEN_RE,
+    NORMALIZATION_ALPHA, NEGATION_FACTOR, INTENSIFIER_FACTOR, POSITIVE_THRESHOLD, NEGATIVE_THRESHOLD
+)
+
+FRAGMENTS = [
+    "the food was amazing", "service was really slow", "not good at all", "very friendly staff",
+    "prices are a bit expensive", "the bathroom was dirty", "great atmosphere and music",
+    "we waited an hour", "the pizza was cold", "would recommend to anyone", "our waiter was rude",
+    "portions were generous", "totally overpriced for what you get", "clean tables and fast service",
+    "the steak was perfect", "never coming back", "decent value", "lovely patio with a view",
+]
+
+def make_reviews(count: int, seed: int = 7):
+    rng = random.Random(seed)
+    return [
+        (" ".join(rng.choice(FRAGMENTS) for _ in range(rng.randint(2, 6))) + ".", rng.randint(1, 5))
+        for _ in range(count)
+    ]
+
+def naive_analyze(reviews) -> dict:
+    """Same report, one review at a time"""
+    negators, intensifiers, stopwords = set(NEGATORS), set(INTENSIFIERS), set(STOPWORDS)
+    aspect_of = {word: name for name, words in ASPECTS.items() for word in words}
+    aspects = {name: [0, 0.0] for name in ASPECT_NAMES}
+    ratings = Counter()
+    phrase_counts, phrase_scores = Counter(), Counter()
+    polarity = Counter()
+    total = 0.0
+    for body, rating in reviews:
+        tokens = TOKEN_RE.findall(body.lower())
+        score = 0.0
+        for i, token in enumerate(tokens):
+            weight = LEXICON.get(token, 0.0)
+            if i and tokens[i - 1] in negators:
+                weight *= NEGATION_FACTOR
+            if i and tokens[i - 1] in intensifiers:
+                weight *= INTENSIFIER_FACTOR
+            score += weight
+        score = score / math.sqrt(score * score + NORMALIZATION_ALPHA)
+        total += score
+        polarity["positive" if score >= POSITIVE_THRESHOLD else "negative" if score <= NEGATIVE_THRESHOLD else "neutral"] += 1
+        if rating:
+            ratings[str(rating)] += 1
+        for name in {aspect_of[token] for token in tokens if token in aspect_of}:
+            aspects[name][0] += 1
+            aspects[name][1] += score
+        for i, token in enumerate(tokens):
+            if token not in stopwords and token not in negators and token not in intensifiers:
+                phrase_counts[token] += 1
+                phrase_scores[token] += score
+            if i and token not in stopwords and (tokens[i - 1] not in stopwords or tokens[i - 1] in negators):
+                bigram = f"{tokens[i - 1]} {token}"
+                phrase_counts[bigram] += 1
+                phrase_scores[bigram] += score
+    return {
+        "average_sentiment": total / len(reviews),
+        "sentiment_distribution": dict(polarity),
+        "rating_distribution": dict(ratings),
+        "aspects": {name: (mentions, total / mentions if mentions else 0.0) for name, (mentions, total) in aspects.items()},
+        # Sentiment totals of the top positive phrases (phrases that always co-occur tie)
+        "top_positive_phrases": sorted(
+            (phrase_scores[phrase] for phrase, mentions in phrase_counts.items()
+             if mentions >= max(2, len(reviews) // 1000) and phrase_scores[phrase] / mentions >= POSITIVE_THRESHOLD),
+            reverse=True
+        )[:3],
+    }
+
+def check(report: dict, expected: dict):
+    assert math.isclose(report["average_sentiment"], expected["average_sentiment"], rel_tol=1e-9)
+    for key, value in expected["sentiment_distribution"].items():
+        assert report["sentiment_distribution"][key] == value
+    for key, value in expected["rating_distribution"].items():
+        assert report["rating_distribution"][key] == value
+    for name, (mentions, score) in expected["aspects"].items():
+        assert report["aspects"][name]["mentions"] == mentions
+        assert math.isclose(report["aspects"][name]["score"], score, rel_tol=1e-9, abs_tol=1e-12)
+    totals = [phrase["mentions"] * phrase["score"] for phrase in report["top_positive_phrases"][:3]]
+    assert all(math.isclose(a, b, rel_tol=1e-9) for a, b in zip(totals, expected["top_positive_phrases"]))
+
+def main():
+    sizes = [int(arg) for arg in sys.argv[1:]] or [10_000, 100_000, 1_000_000]
+    for count in sizes:
+        reviews = make_reviews(count)
+
+        start = time.perf_counter()
+        expected = naive_analyze(reviews)
+        naive = time.perf_counter() - start
+
+        start = time.perf_counter()
+        report = Analyzer().analyze(reviews)
+        vectorized = time.perf_counter() - start
+
+        check(report, expected)
+        print(f"{count:>9,} reviews: naive {naive:7.2f}s ({count / naive:>9,.0f}/s)  "
+              f"vectorized {vectorized:7.2f}s ({count / vectorized:>9,.0f}/s)  {naive / vectorized:4.1f}x")
+        print(f"           top positive: {[p['phrase'] for p in report['top_positive_phrases'][:3]]}  "
+              f"top negative: {[p['phrase'] for p in report['top_negative_phrases'][:3]]}")
+
+if __name__ == "__main__":
+    main()
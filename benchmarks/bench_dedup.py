@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Precision, recall and throughput of MinHash/LSH duplicate detection (app/dedup.py)
+on synthetic reviews: distinct reviews plus lightly edited copies of some of them.
+
+Usage: python benchmarks/bench_dedup.py [reviews] [duplicate_fraction] [threshold]
+       (default: 100000 0.3 0.7)
+"""
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.dedup import DedupIndex, choose_bands, DEDUP_NUM_PERM
+
+WORDS = [f"w{i}" for i in range(5000)]
+
+def make_reviews(count: int, duplicate_fraction: float, edit_rate: float = 0.05, seed: int = 11):
+    """Reviews in arrival order and, for each, whether an earlier review was its source"""
+    rng = random.Random(seed)
+    originals = [[rng.choice(WORDS) for _ in range(rng.randint(15, 80))]
+                 for _ in range(int(count * (1 - duplicate_fraction)))]
+    reviews = [(words, index) for index, words in enumerate(originals)]
+    for _ in range(count - len(originals)):
+        index = rng.randrange(len(originals))
+        words = list(originals[index])
+        for _ in range(max(1, int(len(words) * edit_rate))):
+            position = rng.randrange(len(words))
+            edit = rng.random()
+            if edit < 0.4:
+                words[position] = rng.choice(WORDS)
+            elif edit < 0.7 and len(words) > 1:
+                del words[position]
+            else:
+                words.insert(position, rng.choice(WORDS))
+        reviews.append((words, index))
+    rng.shuffle(reviews)
+    first_seen = {}
+    texts, truth = [], []
+    for words, index in reviews:
+        texts.append(" ".join(words).capitalize() + ".")
+        # For copies: Jaccard similarity of shingles with the first review of the cluster
+        truth.append(jaccard(first_seen[index], words) if index in first_seen else None)
+        first_seen.setdefault(index, words)
+    return texts, truth
+
+def shingle_set(words, size: int = 3):
+    return {tuple(words[i:i + size]) for i in range(max(1, len(words) - size + 1))}
+
+def jaccard(left, right) -> float:
+    left, right = shingle_set(left), shingle_set(right)
+    return len(left & right) / len(left | right)
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    duplicate_fraction = float(sys.argv[2]) if len(sys.argv) > 2 else 0.3
+    threshold = float(sys.argv[3]) if len(sys.argv) > 3 else 0.7
+    texts, truth = make_reviews(count, duplicate_fraction)
+
+    index = DedupIndex(threshold=threshold)
+    start = time.perf_counter()
+    flags = []
+    for offset in range(0, count, 5000):
+        flags.extend(index.add_batch(texts[offset:offset + 5000]).tolist())
+    elapsed = time.perf_counter() - start
+
+    copies = [similarity is not None for similarity in truth]
+    similar = [similarity is not None and similarity >= threshold for similarity in truth]
+    flagged = sum(flags)
+    true_positives = sum(1 for flag, copy in zip(flags, copies) if flag and copy)
+    similar_found = sum(1 for flag, near in zip(flags, similar) if flag and near)
+    bands, rows = choose_bands(DEDUP_NUM_PERM, threshold)
+    print(f"{count:,} reviews, {sum(copies):,} edited copies ({sum(similar):,} with Jaccard >= {threshold}), "
+          f"{bands} bands x {rows} rows")
+    print(f"  precision {true_positives / flagged if flagged else 1.0:.4f}  "
+          f"recall {true_positives / sum(copies) if any(copies) else 1.0:.4f} of copies, "
+          f"{similar_found / sum(similar) if any(similar) else 1.0:.4f} of copies above threshold  flagged {flagged:,}")
+    print(f"  {elapsed:.2f}s, {count / elapsed:,.0f} reviews/s, "
+          f"{index.comparisons:,} signature comparisons ({index.comparisons / count:.2f} per review)")
+
+if __name__ == "__main__":
+    main()
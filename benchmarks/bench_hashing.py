@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+"""
+Event-loop latency under a burst of concurrent logins, with bcrypt inline vs. on the worker pool
+
+Usage: python benchmarks/bench_hashing.py [concurrent_logins]
+"""
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.auth import get_password_hash, verify_password
+from app.hashing import PasswordHasher
+
+TICK = 0.005
+
+async def measure_loop_lag(stop: asyncio.Event, samples: list):
+    """Record how late a 5ms timer fires while logins are running"""
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(TICK)
+        samples.append(time.perf_counter() - start - TICK)
+
+async def inline_login(hashed: str):
+    return verify_password("correct horse battery", hashed)
+
+async def pooled_login(hasher: PasswordHasher, hashed: str):
+    return await hasher.verify("correct horse battery", hashed)
+
+async def run(label: str, make_login, concurrency: int):
+    samples = []
+    stop = asyncio.Event()
+    ticker = asyncio.create_task(measure_loop_lag(stop, samples))
+    await asyncio.sleep(TICK * 2)
+    start = time.perf_counter()
+    await asyncio.gather(*(make_login() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await ticker
+    samples.sort()
+    p99 = samples[int(len(samples) * 0.99) - 1] if samples else 0.0
+    print(f"{label:<8} logins={concurrency} total={elapsed * 1000:8.1f}ms "
+          f"loop_lag_max={max(samples, default=0.0) * 1000:8.1f}ms loop_lag_p99={p99 * 1000:8.1f}ms")
+
+async def main():
+    concurrency = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    hashed = get_password_hash("correct horse battery")
+    hasher = PasswordHasher(queue_limit=concurrency)
+    await run("inline", lambda: inline_login(hashed), concurrency)
+    await run("pooled", lambda: pooled_login(hasher, hashed), concurrency)
+    print(hasher.stats()["hash_latency"])
+    hasher.shutdown()
+
+if __name__ == "__main__":
+    asyncio.run(main())
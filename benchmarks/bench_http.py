@@ -0,0 +1,322 @@
+#!/usr/bin/env python3
+"""
+HTTP load test of app.main:app with per-route throughput and latency percentiles,
+and a regression check against a stored baseline
+
+Drives the ASGI app in-process with httpx.ASGITransport through these scenarios:
+  marketing  anonymous GETs of /, /pricing, /login and /signup
+  login      POST /login with valid credentials (one bcrypt verify each)
+  dashboard  GET /dashboard for a user seeded with --orders orders
+  checkout   create a payment intent, confirm it at the in-process fake Stripe
+             (app/fake_stripe.py), which posts its signed webhook back, then
+             POST /api/confirm-payment
+  webhooks   a burst of signed payment_intent.* events with ~10% redeliveries
+
+Runs against DATABASE_URL, or a throwaway SQLite stand-in if it is not set. Request
+mixes are drawn from --seed, so repeated runs send the same load. Rate limiting and
+the background webhook processor are switched off so they don't shed or compete
+with the load; the webhook inbox is drained once at the end.
+
+Usage:
+  python benchmarks/bench_http.py --output results.json
+  python benchmarks/bench_http.py --save-baseline benchmarks/baseline.json
+  python benchmarks/bench_http.py --baseline benchmarks/baseline.json --threshold 0.25
+
+With --baseline, exits with status 1 when a route's p95 grows, or its throughput
+drops, by more than the threshold, or when any request got an unexpected status.
+Baselines are only comparable when recorded on the same machine and database.
+"""
+from datetime import datetime
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+import uuid
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+# Jinja2Templates resolves app/templates against the working directory
+os.chdir(ROOT)
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{tempfile.mkdtemp()}/bench_http.db")
+os.environ["WEBHOOK_PROCESSOR_ENABLED"] = "false"
+os.environ["RATE_LIMIT_ENABLED"] = "false"
+
+import httpx
+from sqlalchemy import text
+from app.auth import get_password_hash
+from app.auth_db import record_order_created
+from app.database import SessionLocal, engine
+from app.fake_stripe import create_app as create_fake_stripe, DECLINED_PAYMENT_METHOD
+from app.models import Base
+from app.main import app
+from app.stripe_config import stripe_api
+from app.webhooks import webhook_processor
+
+SCENARIOS = ("marketing", "login", "dashboard", "checkout", "webhooks")
+PASSWORD = "correct horse battery 1"
+BASE_URL = "https://bench"
+STRIPE_URL = "https://stripe.bench"
+
+class Recorder:
+    """Latencies and unexpected statuses per route for one run"""
+    def __init__(self):
+        self.latencies = {}
+        self.errors = {}
+        self.elapsed = {}
+
+    async def call(self, route: str, request, expected=(200,)):
+        start = time.perf_counter()
+        response = await request
+        self.latencies.setdefault(route, []).append(time.perf_counter() - start)
+        if response.status_code not in expected:
+            self.errors[route] = self.errors.get(route, 0) + 1
+        return response
+
+    def report(self) -> dict:
+        routes = {}
+        for route, samples in self.latencies.items():
+            samples = sorted(samples)
+            quantile = lambda q: samples[min(len(samples) - 1, int(q * len(samples)))] * 1000
+            elapsed = self.elapsed[route]
+            routes[route] = {
+                "requests": len(samples),
+                "errors": self.errors.get(route, 0),
+                "throughput": round(len(samples) / elapsed, 1) if elapsed else None,
+                "p50_ms": round(quantile(0.50), 3),
+                "p95_ms": round(quantile(0.95), 3),
+                "p99_ms": round(quantile(0.99), 3),
+                "max_ms": round(samples[-1] * 1000, 3),
+            }
+        return routes
+
+def seed_user(db, tag: str, orders: int, rng: random.Random) -> dict:
+    """A user with a known password and orders in a mix of statuses"""
+    now = datetime.utcnow()
+    user = {"id": f"user-{tag}", "email": f"{tag}@bench.local"}
+    db.execute(
+        text('INSERT INTO "User" (id, name, email, password, "createdAt", "updatedAt") VALUES (:id, \'Bench\', :email, :password, :now, :now)'),
+        {**user, "password": get_password_hash(PASSWORD), "now": now}
+    )
+    for i in range(orders):
+        status = rng.choice(("done", "done", "done", "pending", "running", "failed"))
+        db.execute(
+            text('INSERT INTO "Order" (id, "userId", business_name, business_address, status, price, attempts, review_count, reviews_version, "createdAt", "updatedAt") '
+                 'VALUES (:id, :user_id, :name, :address, :status, 29.99, 0, 0, 0, :now, :now)'),
+            {"id": f"order-{tag}-{i}", "user_id": user["id"], "name": f"Bench Cafe {i}",
+             "address": f"{i} Main St", "status": status, "now": now}
+        )
+        record_order_created(db, user["id"], status)
+    db.commit()
+    return user
+
+def seed_payments(db, tag: str, user: dict, count: int) -> list:
+    """Pending payments for the webhook burst to settle"""
+    now = datetime.utcnow()
+    intents = [f"pi_{tag}_{i}" for i in range(count)]
+    for intent in intents:
+        db.execute(
+            text('INSERT INTO "Payment" ("userId", stripe_payment_intent_id, amount, currency, status, "createdAt", "updatedAt") '
+                 'VALUES (:user_id, :intent, 29.99, \'usd\', \'pending\', :now, :now)'),
+            {"user_id": user["id"], "intent": intent, "now": now}
+        )
+    db.commit()
+    return intents
+
+def webhook_events(tag: str, intents: list, rng: random.Random) -> list:
+    events = []
+    for intent in intents:
+        event_type = "payment_intent.succeeded" if rng.random() < 0.9 else "payment_intent.payment_failed"
+        events.append(json.dumps({
+            "id": f"evt_{tag}_{len(events)}",
+            "object": "event",
+            "type": event_type,
+            "created": int(time.time()),
+            "data": {"object": {"id": intent, "object": "payment_intent", "amount": 2999, "currency": "usd",
+                                "latest_charge": f"ch_{intent}"}},
+        }).encode())
+    return events + rng.sample(events, len(events) // 10)
+
+async def run_workers(count: int, concurrency: int, work):
+    """Call work(i) for i in range(count) from `concurrency` concurrent workers"""
+    counter = iter(range(count))
+
+    async def worker():
+        for i in counter:
+            await work(i)
+
+    await asyncio.gather(*(worker() for _ in range(max(1, concurrency))))
+
+async def scenario(recorder: Recorder, routes, count: int, concurrency: int, work, warmup: int = 5):
+    """Warm up unrecorded, then run work and credit the wall time to each of its routes"""
+    discarded = Recorder()
+    await run_workers(min(warmup, count), concurrency, lambda i: work(discarded, i))
+    start = time.perf_counter()
+    await run_workers(count, concurrency, lambda i: work(recorder, i))
+    elapsed = time.perf_counter() - start
+    for route in routes:
+        recorder.elapsed[route] = elapsed
+
+async def run(args) -> dict:
+    rng = random.Random(args.seed)
+    tag = f"{args.seed}-{uuid.uuid4().hex[:8]}"
+    Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    try:
+        user = seed_user(db, tag, args.orders, rng)
+        intents = seed_payments(db, tag, user, args.webhooks)
+    finally:
+        db.close()
+    events = webhook_events(tag, intents, rng)
+
+    recorder = Recorder()
+    transport = httpx.ASGITransport(app=app)
+    fake_stripe = create_fake_stripe(latency_ms=args.stripe_latency_ms, error_rate=0,
+                                      webhook_url=f"{BASE_URL}/webhook/stripe", webhook_transport=transport, seed=args.seed)
+    stripe_api.configure(base_url=STRIPE_URL, transport=httpx.ASGITransport(app=fake_stripe))
+    login_form = {"email": user["email"], "password": PASSWORD}
+    requests = args.requests
+
+    async with httpx.AsyncClient(transport=transport, base_url=BASE_URL) as anonymous, \
+            httpx.AsyncClient(transport=transport, base_url=BASE_URL) as member:
+        response = await member.post("/login", data=login_form)
+        assert response.status_code == 303, f"login failed with {response.status_code}"
+
+        if "marketing" in args.scenarios:
+            for page in ("/", "/pricing", "/login", "/signup"):
+                await scenario(recorder, [f"GET {page}"], requests, args.concurrency,
+                               lambda rec, i, page=page: rec.call(f"GET {page}", anonymous.get(page)))
+
+        if "login" in args.scenarios:
+            # Separate clients so concurrent logins don't share a cookie jar
+            async def login(rec, i):
+                async with httpx.AsyncClient(transport=transport, base_url=BASE_URL) as client:
+                    await rec.call("POST /login", client.post("/login", data=login_form), expected=(303,))
+            await scenario(recorder, ["POST /login"], args.logins, args.concurrency, login, warmup=1)
+
+        if "dashboard" in args.scenarios:
+            await scenario(recorder, ["GET /dashboard"], requests, args.concurrency,
+                           lambda rec, i: rec.call("GET /dashboard", member.get("/dashboard")))
+
+        if "checkout" in args.scenarios:
+            declined = {i for i in range(args.checkouts) if rng.random() < 0.1}
+
+            async def checkout(rec, i):
+                response = await rec.call("POST /api/create-payment-intent",
+                                          member.post("/api/create-payment-intent", json={"plan": "basic"}))
+                intent_id = response.json()["paymentIntentId"]
+                # Stands in for Stripe.js confirming the card in the browser
+                await stripe_api.confirm_payment_intent(intent_id, DECLINED_PAYMENT_METHOD if i in declined else "pm_card_visa")
+                await rec.call("POST /api/confirm-payment",
+                               member.post("/api/confirm-payment", json={"paymentIntentId": intent_id}),
+                               expected=(400,) if i in declined else (200,))
+            await scenario(recorder, ["POST /api/create-payment-intent", "POST /api/confirm-payment"],
+                           args.checkouts, args.concurrency, checkout, warmup=0)
+
+        if "webhooks" in args.scenarios:
+            await scenario(recorder, ["POST /webhook/stripe"], len(events), args.webhook_concurrency,
+                           lambda rec, i: rec.call("POST /webhook/stripe", anonymous.post(
+                               "/webhook/stripe", content=events[i], headers={"Stripe-Signature": stripe_api.sign_webhook(events[i])})),
+                           warmup=0)
+    await stripe_api.aclose()
+
+    start = time.perf_counter()
+    applied = webhook_processor.drain()
+    return {
+        "meta": {
+            "created": datetime.utcnow().isoformat(timespec="seconds") + "Z",
+            "database": engine.dialect.name,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "seed": args.seed,
+            "scenarios": list(args.scenarios),
+            "settings": {name: getattr(args, name) for name in
+                         ("requests", "logins", "checkouts", "webhooks", "orders", "concurrency", "webhook_concurrency", "stripe_latency_ms")},
+            "webhooks_applied": applied,
+            "webhook_drain_seconds": round(time.perf_counter() - start, 3),
+        },
+        "routes": recorder.report(),
+    }
+
+def compare(results: dict, baseline: dict, threshold: float) -> list:
+    """Regressions of the results against a baseline, as printable lines"""
+    regressions = []
+    for route, current in sorted(results["routes"].items()):
+        if current["errors"]:
+            regressions.append(f"{route}: {current['errors']} unexpected responses")
+        before = baseline.get("routes", {}).get(route)
+        if not before:
+            continue
+        if before["p95_ms"] and current["p95_ms"] > before["p95_ms"] * (1 + threshold):
+            regressions.append(f"{route}: p95 {before['p95_ms']:.2f} -> {current['p95_ms']:.2f} ms "
+                               f"(+{current['p95_ms'] / before['p95_ms'] - 1:.0%})")
+        if before["throughput"] and current["throughput"] < before["throughput"] * (1 - threshold):
+            regressions.append(f"{route}: throughput {before['throughput']:,.0f} -> {current['throughput']:,.0f} req/s "
+                               f"({current['throughput'] / before['throughput'] - 1:.0%})")
+    return regressions
+
+def print_table(results: dict, baseline: dict = None):
+    print(f"{'route':34} {'requests':>8} {'errors':>6} {'req/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'p95 vs base':>12}")
+    for route, row in results["routes"].items():
+        before = (baseline or {}).get("routes", {}).get(route)
+        change = f"{row['p95_ms'] / before['p95_ms'] - 1:+.0%}" if before and before["p95_ms"] else ""
+        print(f"{route:34} {row['requests']:8d} {row['errors']:6d} {row['throughput']:9,.0f} "
+              f"{row['p50_ms']:8.2f} {row['p95_ms']:8.2f} {row['p99_ms']:8.2f} {change:>12}")
+    meta = results["meta"]
+    print(f"{meta['database']}, {meta['cpus']} CPUs, seed {meta['seed']}; "
+          f"drained {meta['webhooks_applied']} webhook events in {meta['webhook_drain_seconds']:.2f}s")
+
+def write_json(path: str, results: dict):
+    with open(path, "w") as f:
+        json.dump(results, f, indent=2)
+        f.write("\n")
+    print(f"wrote {path}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="HTTP load test and latency regression check for app.main:app")
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--requests", type=int, default=1000, help="Requests per marketing page and to the dashboard")
+    parser.add_argument("--logins", type=int, default=50, help="Logins (each a full bcrypt verify)")
+    parser.add_argument("--checkouts", type=int, default=200)
+    parser.add_argument("--webhooks", type=int, default=1000, help="Payments settled by the webhook burst")
+    parser.add_argument("--orders", type=int, default=200, help="Orders seeded for the dashboard user")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--webhook-concurrency", type=int, default=32)
+    parser.add_argument("--stripe-latency-ms", type=float, default=0, help="Delay added by the fake Stripe")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="Write the results as JSON")
+    parser.add_argument("--save-baseline", help="Write the results as the baseline to compare later runs with")
+    parser.add_argument("--baseline", help="Fail on regressions against this baseline")
+    parser.add_argument("--threshold", type=float, default=0.25,
+                        help="Allowed p95 growth / throughput drop against the baseline (0.25 = 25%%)")
+    args = parser.parse_args(argv)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    results = asyncio.run(run(args))
+    print_table(results, baseline)
+    if args.output:
+        write_json(args.output, results)
+    if args.save_baseline:
+        write_json(args.save_baseline, results)
+
+    if baseline and baseline["meta"]["settings"] != results["meta"]["settings"]:
+        print("note: the baseline was recorded with different settings:", baseline["meta"]["settings"])
+    regressions = compare(results, baseline or {}, args.threshold)
+    if regressions:
+        print(f"\n{len(regressions)} regression(s) beyond {args.threshold:.0%}:")
+        for line in regressions:
+            print(f"  {line}")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
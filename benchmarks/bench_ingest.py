@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""
+Review ingestion throughput and peak memory at increasing dump sizes
+
+Runs against DATABASE_URL, or a throwaway SQLite stand-in if it is not set.
+
+Usage: python benchmarks/bench_ingest.py [rows ...]
+"""
+from datetime import datetime
+import os
+import random
+import sys
+import tempfile
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{tempfile.mkdtemp()}/bench_ingest.db")
+
+from sqlalchemy import text
+from app.database import SessionLocal, engine
+from app.models import Base
+from app.ingest import load_reviews
+
+WORDS = ("great food friendly staff slow service cold pizza amazing coffee rude waiter "
+         "clean tables long wait fresh bread noisy room lovely patio overpriced drinks").split()
+
+def synthetic_reviews(count: int):
+    """Yield review records without ever materializing the dump"""
+    rng = random.Random(count)
+    for i in range(count):
+        yield {
+            "review_id": f"r{i}",
+            "author": f"Customer {i % 997}",
+            "stars": str(rng.randint(1, 5)),
+            "text": " ".join(rng.choice(WORDS) for _ in range(rng.randint(5, 40))),
+            "date": f"2024-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}T12:00:00Z",
+        }
+
+def create_order(db, order_id: str):
+    now = datetime.utcnow()
+    db.execute(
+        text('INSERT INTO "User" (id, name, email, password, "createdAt", "updatedAt") VALUES (:id, \'Bench\', :email, \'x\', :now, :now)'),
+        {"id": f"user-{order_id}", "email": f"{order_id}@bench.local", "now": now}
+    )
+    db.execute(
+        text('INSERT INTO "Order" (id, "userId", business_name, business_address, status, price, attempts, review_count, reviews_version, "createdAt", "updatedAt") '
+             'VALUES (:id, :user_id, \'Bench Cafe\', \'1 Main St\', \'pending\', 29.99, 0, 0, 0, :now, :now)'),
+        {"id": order_id, "user_id": f"user-{order_id}", "now": now}
+    )
+    db.commit()
+
+def main():
+    sizes = [int(arg) for arg in sys.argv[1:]] or [10000, 100000]
+    Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    try:
+        for size in sizes:
+            order_id = f"bench-{size}-{random.randrange(1 << 30)}"
+            create_order(db, order_id)
+            tracemalloc.start()
+            report = load_reviews(db, order_id, synthetic_reviews(size))
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            print(f"{size:>10,} reviews  {report.rows_per_second:>10,.0f} rows/s  peak {peak / 1e6:6.1f} MB")
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    main()
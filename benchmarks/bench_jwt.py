@@ -0,0 +1,33 @@
+#!/usr/bin/env python3
+"""
+Per-request decode_token cost with a cold vs. warm verified-token cache
+
+Usage: python benchmarks/bench_jwt.py [iterations]
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import auth
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    token = auth.create_access_token({"sub": "bench@example.com"})
+
+    auth.JWT_CACHE_ENABLED = False
+    cold = timeit.timeit(lambda: auth.decode_token(token), number=iterations)
+
+    auth.JWT_CACHE_ENABLED = True
+    auth.token_cache.clear()
+    auth.decode_token(token)
+    warm = timeit.timeit(lambda: auth.decode_token(token), number=iterations)
+
+    print(f"cold decode: {cold / iterations * 1e6:8.2f} us/request")
+    print(f"warm decode: {warm / iterations * 1e6:8.2f} us/request")
+    print(f"speedup:     {cold / warm:8.1f}x")
+    print(auth.token_cache.stats())
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+"""
+Requests/sec on the home page rendered per request vs. served from the page cache
+(app/pages.py), and for revalidations answered with 304
+
+Usage: python benchmarks/bench_pages.py [requests] [path]
+"""
+import asyncio
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+# Jinja2Templates resolves app/templates against the working directory
+os.chdir(ROOT)
+
+import httpx
+from app import pages
+from app.main import app, page_cache
+
+async def rate(client, path: str, requests: int, headers=None) -> float:
+    start = time.perf_counter()
+    for _ in range(requests):
+        await client.get(path, headers=headers)
+    return requests / (time.perf_counter() - start)
+
+async def measure(path: str, requests: int):
+    # In-process ASGI calls, so the numbers are the app's cost rather than the network's
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench") as client:
+        pages.PAGE_CACHE_ENABLED = False
+        await client.get(path)
+        uncached = await rate(client, path, requests)
+
+        pages.PAGE_CACHE_ENABLED = True
+        page_cache.pages.clear()
+        etag = (await client.get(path)).headers["etag"]
+        cached = await rate(client, path, requests)
+        revalidated = await rate(client, path, requests, headers={"If-None-Match": etag})
+    return uncached, cached, revalidated
+
+def main():
+    requests = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    path = sys.argv[2] if len(sys.argv) > 2 else "/"
+    uncached, cached, revalidated = asyncio.run(measure(path, requests))
+
+    print(f"GET {path}, {requests} requests")
+    print(f"rendered per request: {uncached:8.0f} req/s")
+    print(f"page cache:           {cached:8.0f} req/s  ({cached / uncached:.1f}x)")
+    print(f"304 revalidation:     {revalidated:8.0f} req/s  ({revalidated / uncached:.1f}x)")
+    print(page_cache.stats())
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+"""
+Scaling of multi-core review analysis (app/parallel.py) from 1 to N worker processes,
+against the in-process Analyzer on the same reviews.
+
+Usage: python benchmarks/bench_parallel.py [reviews] [max_workers] [batch_size]
+       (default: 1000000, os.cpu_count(), 20000)
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.analysis import Analyzer
+from app.parallel import ParallelAnalyzer, get_pool, shutdown_pool
+from bench_analysis import make_reviews
+
+def same_report(left: dict, right: dict) -> bool:
+    keys = ("review_count", "sentiment_distribution", "rating_distribution", "top_positive_phrases", "top_negative_phrases")
+    return (all(left[key] == right[key] for key in keys)
+            and abs(left["average_sentiment"] - right["average_sentiment"]) < 1e-9)
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    max_workers = int(sys.argv[2]) if len(sys.argv) > 2 else os.cpu_count()
+    batch_size = int(sys.argv[3]) if len(sys.argv) > 3 else 20_000
+    reviews = make_reviews(count)
+    print(f"{count:,} reviews, batches of {batch_size:,}, {os.cpu_count()} CPUs")
+
+    start = time.perf_counter()
+    expected = Analyzer().analyze(reviews, batch_size=batch_size)
+    baseline = time.perf_counter() - start
+    print(f"  in-process  {baseline:7.2f}s  {count / baseline:>10,.0f} reviews/s")
+
+    for workers in sorted({1 << power for power in range(max_workers.bit_length()) if 1 << power <= max_workers} | {max_workers}):
+        # Start the pool outside the timing: its processes are reused across jobs
+        list(get_pool(workers).map(int, range(workers)))
+        start = time.perf_counter()
+        report = ParallelAnalyzer(workers=workers).analyze(reviews, batch_size=batch_size)
+        elapsed = time.perf_counter() - start
+        print(f"  {workers:2d} workers  {elapsed:7.2f}s  {count / elapsed:>10,.0f} reviews/s  "
+              f"speedup {baseline / elapsed:5.2f}x  efficiency {baseline / elapsed / workers:4.0%}  "
+              f"{'ok' if same_report(expected, report) else 'MISMATCH'}")
+    shutdown_pool()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+Memory and mapping throughput of order rows as dicts vs. OrderRow tuples
+
+Usage: python benchmarks/bench_records.py [rows]
+"""
+from datetime import datetime, timedelta
+import gc
+import os
+import sys
+import time
+import tracemalloc
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.auth_db import make_order_row
+
+def make_rows(count: int):
+    user_id = str(uuid.uuid4())
+    start = datetime(2025, 1, 1)
+    return [
+        (str(uuid.uuid4()), user_id, f"Business {i}", f"{i} Main Street, Springfield",
+         "done", 199.99, start + timedelta(minutes=i), start + timedelta(minutes=i))
+        for i in range(count)
+    ]
+
+def as_dicts(rows):
+    orders = []
+    for row in rows:
+        orders.append({
+            'id': row[0],
+            'userId': row[1],
+            'business_name': row[2],
+            'business_address': row[3],
+            'status': row[4],
+            'price': row[5],
+            'createdAt': row[6],
+            'updatedAt': row[7]
+        })
+    return orders
+
+def as_records(rows):
+    return list(map(make_order_row, rows))
+
+def measure(label: str, mapper, rows, repeat: int = 3):
+    gc.disable()
+    try:
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            mapper(rows)
+            timings.append(time.perf_counter() - start)
+    finally:
+        gc.enable()
+    elapsed = min(timings)
+
+    tracemalloc.start()
+    result = mapper(rows)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+
+    print(f"{label:<10} {len(rows) / elapsed:12,.0f} rows/s  {peak / len(rows):8.1f} bytes/row")
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    rows = make_rows(count)
+    measure("dict", as_dicts, rows)
+    measure("OrderRow", as_records, rows)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+Stripe webhook ack latency and background apply throughput (app/webhooks.py),
+driven with locally signed fake events
+
+Acks are measured with the processor stopped, so the inbox backlog builds up; the
+backlog is then drained in batches and the resulting Payment and Order rows checked.
+Includes redelivered duplicates, stale failure events arriving after the success,
+and a request with a bad signature.
+
+Runs against DATABASE_URL, or a throwaway SQLite stand-in if it is not set.
+
+Usage: python benchmarks/bench_webhooks.py [payments]
+"""
+from datetime import datetime
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{tempfile.mkdtemp()}/bench_webhooks.db")
+os.environ["WEBHOOK_PROCESSOR_ENABLED"] = "false"
+
+import httpx
+from sqlalchemy import text
+from app.database import SessionLocal, engine
+from app.models import Base
+from app.main import app
+from app.stripe_config import stripe_api
+from app.webhooks import webhook_processor, webhook_stats
+
+def seed(db, payments: int, tag: str):
+    now = datetime.utcnow()
+    user_id = f"user-{tag}"
+    db.execute(
+        text('INSERT INTO "User" (id, name, email, password, "createdAt", "updatedAt") VALUES (:id, \'Bench\', :email, \'x\', :now, :now)'),
+        {"id": user_id, "email": f"{tag}@bench.local", "now": now}
+    )
+    for i in range(payments):
+        payment_id = db.execute(
+            text('INSERT INTO "Payment" ("userId", stripe_payment_intent_id, amount, currency, status, "createdAt", "updatedAt") '
+                 'VALUES (:user_id, :intent, 29.99, \'usd\', \'pending\', :now, :now) RETURNING id'),
+            {"user_id": user_id, "intent": f"pi_{tag}_{i}", "now": now}
+        ).scalar()
+        db.execute(
+            text('INSERT INTO "Order" (id, "userId", business_name, business_address, status, price, payment_id, attempts, review_count, reviews_version, "createdAt", "updatedAt") '
+                 'VALUES (:id, :user_id, \'Bench Cafe\', \'1 Main St\', \'pending\', 29.99, :payment_id, 0, 0, 0, :now, :now)'),
+            {"id": f"order-{tag}-{i}", "user_id": user_id, "payment_id": payment_id, "now": now}
+        )
+    db.commit()
+
+def fake_event(tag: str, number: int, event_type: str, intent: str) -> bytes:
+    return json.dumps({
+        "id": f"evt_{tag}_{number}",
+        "object": "event",
+        "type": event_type,
+        "created": int(time.time()),
+        "data": {"object": {"id": intent, "object": "payment_intent", "amount": 2999, "currency": "usd",
+                            "latest_charge": f"ch_{intent}"}},
+    }).encode()
+
+def make_events(tag: str, payments: int):
+    """(payload, expected final payment status) with ~10% redeliveries and stale failures"""
+    rng = random.Random(payments)
+    events, expected = [], {}
+    for i in range(payments):
+        intent = f"pi_{tag}_{i}"
+        if rng.random() < 0.8:
+            events.append(fake_event(tag, len(events), "payment_intent.succeeded", intent))
+            expected[intent] = "succeeded"
+            if rng.random() < 0.1:
+                # A failure from an earlier attempt, delivered late
+                events.append(fake_event(tag, len(events), "payment_intent.payment_failed", intent))
+        else:
+            events.append(fake_event(tag, len(events), "payment_intent.payment_failed", intent))
+            expected[intent] = "failed"
+    events += rng.sample(events, len(events) // 10)
+    return events, expected
+
+async def send(events):
+    latencies = []
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench") as client:
+        bad = await client.post("/webhook/stripe", content=events[0], headers={"Stripe-Signature": "t=1,v1=00"})
+        assert bad.status_code == 400, bad.status_code
+        for payload in events:
+            start = time.perf_counter()
+            response = await client.post("/webhook/stripe", content=payload, headers={"Stripe-Signature": stripe_api.sign_webhook(payload)})
+            latencies.append(time.perf_counter() - start)
+            assert response.status_code == 200, response.text
+    return sorted(latencies)
+
+def main():
+    payments = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    tag = f"{random.randrange(1 << 30):x}"
+    Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    try:
+        seed(db, payments, tag)
+        events, expected = make_events(tag, payments)
+
+        latencies = asyncio.run(send(events))
+        quantile = lambda q: latencies[min(len(latencies) - 1, int(q * len(latencies)))] * 1000
+        print(f"{len(events)} events ({webhook_stats.received} new, {webhook_stats.duplicates} duplicates, "
+              f"{webhook_stats.rejected} rejected)")
+        print(f"ack latency  p50 {quantile(0.5):6.2f} ms  p95 {quantile(0.95):6.2f} ms  p99 {quantile(0.99):6.2f} ms")
+
+        start = time.perf_counter()
+        applied = webhook_processor.drain()
+        elapsed = time.perf_counter() - start
+        print(f"applied {applied} events in {elapsed:.2f}s ({applied / elapsed:,.0f}/s, "
+              f"{webhook_stats.batches} batches), backlog now {webhook_stats.backlog}")
+
+        statuses = dict(db.execute(
+            text('SELECT stripe_payment_intent_id, status FROM "Payment" WHERE "userId" = :user_id'), {"user_id": f"user-{tag}"}
+        ).fetchall())
+        orders = dict(db.execute(
+            text('SELECT o.status, COUNT(*) FROM "Order" o WHERE o."userId" = :user_id GROUP BY o.status'), {"user_id": f"user-{tag}"}
+        ).fetchall())
+        wrong = sum(statuses.get(intent) != status for intent, status in expected.items())
+        held = sum(status == "failed" for status in expected.values())
+        print(f"payments: {wrong} with the wrong status; orders: {orders} (expected {held} held)")
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    main()
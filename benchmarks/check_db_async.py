@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+"""
+Check that DB_ASYNC=true and DB_ASYNC=false serve the same pages and data
+
+Each mode runs in its own process against its own throwaway SQLite database, since
+DB_ASYNC is read when app.database is imported. A run:
+  - drives POST /signup, POST /login (good and bad password), GET /dashboard and the
+    next page of orders through the ASGI app with httpx.ASGITransport
+  - calls every app.auth_db_async helper (on an AsyncSession with DB_ASYNC=true, on a
+    sync Session in the threadpool otherwise) next to its app.auth_db counterpart
+    and compares the results
+The two runs' HTTP outcomes are then compared with each other.
+
+Usage: python benchmarks/check_db_async.py
+"""
+from datetime import datetime, timedelta
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import uuid
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+NAME = "Async Check"
+PASSWORD = "Check-password-123"
+ORDERS = 25
+
+def normalize(value):
+    """Comparable plain data from User objects, NamedTuples and lists of them"""
+    if hasattr(value, "__slots__") and not isinstance(value, tuple):
+        return {name: normalize(getattr(value, name)) for name in value.__slots__}
+    if isinstance(value, (list, tuple)):
+        return [normalize(item) for item in value]
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+def seed_orders(db, user_id: str):
+    from sqlalchemy import text
+    from app.auth_db import record_order_created
+    start = datetime.utcnow() - timedelta(days=1)
+    for i in range(ORDERS):
+        created = start + timedelta(minutes=i)
+        db.execute(
+            text('INSERT INTO "Order" (id, "userId", business_name, business_address, status, price, attempts, review_count, reviews_version, "createdAt", "updatedAt") '
+                 'VALUES (:id, :user_id, :name, \'1 Main St\', \'pending\', 29.99, 0, 0, 0, :created, :created)'),
+            {"id": f"order-{i:03d}", "user_id": user_id, "name": f"Cafe {i}", "created": created}
+        )
+        record_order_created(db, user_id)
+    db.commit()
+
+async def drive_http(email: str) -> dict:
+    """Status codes and page facts for the signup, login and dashboard flow"""
+    import httpx
+    from app.main import app
+    from app.database import SessionLocal
+    from app import auth_db
+
+    outcome = {}
+    transport = httpx.ASGITransport(app=app)
+    # The auth cookie is Secure, so the client has to talk https
+    async with httpx.AsyncClient(transport=transport, base_url="https://app") as client:
+        response = await client.post("/signup", data={"name": NAME, "email": email, "password": PASSWORD})
+        outcome["signup"] = response.status_code
+        response = await client.post("/signup", data={"name": NAME, "email": email, "password": PASSWORD})
+        outcome["signup_again"] = [response.status_code, "already exists" in response.text]
+
+        db = SessionLocal()
+        try:
+            seed_orders(db, auth_db.get_user_by_email(db, email).id)
+        finally:
+            db.close()
+
+    async with httpx.AsyncClient(transport=transport, base_url="https://app") as client:
+        response = await client.post("/login", data={"email": email, "password": "wrong-password"})
+        outcome["bad_login"] = [response.status_code, "Invalid email or password" in response.text]
+        response = await client.post("/login", data={"email": email.upper(), "password": PASSWORD})
+        outcome["login"] = [response.status_code, "access_token" in client.cookies]
+        response = await client.get("/dashboard")
+        page = response.text
+        outcome["dashboard"] = [response.status_code, NAME in page, page.count("Cafe ")]
+        cursor = page.split("after=", 1)[1].split('"', 1)[0] if "after=" in page else None
+        outcome["has_next_page"] = cursor is not None
+        if cursor:
+            response = await client.get(f"/dashboard/orders?after={cursor}")
+            outcome["next_page"] = [response.status_code, response.text.count("Cafe ")]
+    return outcome
+
+async def compare_helpers(email: str) -> list:
+    """Names of the app.auth_db_async helpers whose results differ from app.auth_db"""
+    from app import auth_db, auth_db_async
+    from app.database import SessionLocal, AsyncSessionLocal, DB_ASYNC
+
+    sync_db = SessionLocal()
+    async_db = AsyncSessionLocal() if DB_ASYNC else SessionLocal()
+    user_id = auth_db.get_user_by_email(sync_db, email).id
+    _, cursor = auth_db.get_user_orders_page(sync_db, user_id, limit=10)
+    calls = [
+        ("get_user_by_email", (email,)),
+        ("get_user_by_email", ("nobody@check.local",)),
+        ("get_user_for_auth", (email,)),
+        ("get_user_display_by_email", (email,)),
+        ("get_user_by_id", (user_id,)),
+        ("user_exists", (email,)),
+        ("user_exists", ("nobody@check.local",)),
+        ("get_user_orders", (user_id,)),
+        ("get_user_orders_page", (user_id, 10)),
+        ("get_user_orders_page", (user_id, 10, cursor)),
+        ("get_dashboard_snapshot", (email,)),
+        ("get_dashboard_snapshot", ("nobody@check.local",)),
+    ]
+    mismatches = []
+    try:
+        for name, args in calls:
+            expected = normalize(getattr(auth_db, name)(sync_db, *args))
+            actual = normalize(await getattr(auth_db_async, name)(async_db, *args))
+            if actual != expected:
+                mismatches.append(f"{name}{args}")
+        # A user created through each path reads back the same through the other
+        hashed = auth_db.get_user_for_auth(sync_db, email).password
+        created = {
+            "async": await auth_db_async.create_user(async_db, NAME, f"async-{email}", PASSWORD, hashed),
+            "sync": auth_db.create_user(sync_db, NAME, f"sync-{email}", PASSWORD, hashed),
+        }
+        for path, user in created.items():
+            expected = normalize(auth_db.get_user_display_by_email(sync_db, user.email))
+            actual = normalize(await auth_db_async.get_user_display_by_email(async_db, user.email))
+            if actual != expected or expected != [user.id, NAME, user.email]:
+                mismatches.append(f"create_user ({path})")
+    finally:
+        sync_db.close()
+        if DB_ASYNC:
+            await async_db.close()
+        else:
+            async_db.close()
+    return mismatches
+
+async def run_mode():
+    os.chdir(ROOT)
+    from app.database import engine, async_engine, DB_ASYNC
+    from app.models import Base
+
+    Base.metadata.create_all(bind=engine)
+    email = f"check-{uuid.uuid4().hex[:8]}@check.local"
+    try:
+        outcome = await drive_http(email)
+        mismatches = await compare_helpers(email)
+    finally:
+        if async_engine is not None:
+            # Pooled aiosqlite connections each hold a thread that would keep the process alive
+            await async_engine.dispose()
+    print(json.dumps({"db_async": DB_ASYNC, "http": outcome, "mismatches": mismatches}))
+
+EXPECTED_HTTP = {
+    "signup": 303,
+    "signup_again": [200, True],
+    "bad_login": [200, True],
+    "login": [303, True],
+    "has_next_page": True,
+}
+
+def main():
+    results = {}
+    for mode in ("false", "true"):
+        env = dict(os.environ, DB_ASYNC=mode, RATE_LIMIT_ENABLED="false", WEBHOOK_PROCESSOR_ENABLED="false",
+                   DATABASE_URL=f"sqlite:///{tempfile.mkdtemp()}/check_db_async.db", PYTHONPATH=ROOT)
+        child = subprocess.run([sys.executable, os.path.abspath(__file__), "--mode"], env=env,
+                               capture_output=True, text=True)
+        lines = child.stdout.strip().splitlines()
+        if child.returncode != 0 or not lines:
+            print(f"DB_ASYNC={mode}: run failed\n{child.stderr}")
+            sys.exit(1)
+        results[mode] = json.loads(lines[-1])
+
+    failed = False
+    for mode, result in results.items():
+        http, mismatches = result["http"], result["mismatches"]
+        problems = [f"{key} {http.get(key)!r} != {value!r}" for key, value in EXPECTED_HTTP.items() if http.get(key) != value]
+        if http.get("dashboard", [None])[0] != 200 or not http["dashboard"][1]:
+            problems.append(f"dashboard {http.get('dashboard')!r}")
+        problems += [f"helper mismatch: {name}" for name in mismatches]
+        print(f"DB_ASYNC={mode:5}  {'ok' if not problems else 'FAILED'}  {json.dumps(http)}")
+        for problem in problems:
+            print(f"  {problem}")
+        failed = failed or bool(problems)
+    if results["false"]["http"] != results["true"]["http"]:
+        print("HTTP outcomes differ between DB_ASYNC=false and DB_ASYNC=true")
+        failed = True
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    if "--mode" in sys.argv[1:]:
+        sys.path.insert(0, ROOT)
+        asyncio.run(run_mode())
+    else:
+        main()
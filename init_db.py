@@ -5,10 +5,95 @@ Creates all necessary tables in PostgreSQL
 """
 
 import os
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, text
 from app.models import Base, User, Order, Payment
 from app.database import DATABASE_URL
 
+# Columns added after the tables were first created. Postgres only: on SQLite the
+# stand-in database is always created fresh by create_all.
+COLUMN_MIGRATIONS = [
+    'ALTER TABLE "Order" ADD COLUMN IF NOT EXISTS attempts INTEGER NOT NULL DEFAULT 0',
+    'ALTER TABLE "Order" ADD COLUMN IF NOT EXISTS worker_id VARCHAR',
+    'ALTER TABLE "Order" ADD COLUMN IF NOT EXISTS lease_expires_at TIMESTAMP',
+    'ALTER TABLE "Order" ADD COLUMN IF NOT EXISTS heartbeat_at TIMESTAMP',
+    'ALTER TABLE "Order" ADD COLUMN IF NOT EXISTS next_attempt_at TIMESTAMP',
+    'ALTER TABLE "Order" ADD COLUMN IF NOT EXISTS last_error TEXT',
+    'ALTER TABLE "Order" ADD COLUMN IF NOT EXISTS review_count INTEGER NOT NULL DEFAULT 0',
+    'ALTER TABLE "Order" ADD COLUMN IF NOT EXISTS reviews_version INTEGER NOT NULL DEFAULT 0',
+    'ALTER TABLE "Order" ADD COLUMN IF NOT EXISTS reviews_digest BIGINT',
+    'ALTER TABLE "Review" ADD COLUMN IF NOT EXISTS is_duplicate BOOLEAN NOT NULL DEFAULT false',
+    'ALTER TABLE "AnalysisReport" ADD COLUMN IF NOT EXISTS last_review_id BIGINT NOT NULL DEFAULT 0',
+    'ALTER TABLE "AnalysisReport" ADD COLUMN IF NOT EXISTS state BYTEA',
+]
+
+def migrate_columns(engine):
+    """Add missing columns to existing tables"""
+    if engine.dialect.name != "postgresql":
+        return
+    with engine.begin() as conn:
+        for statement in COLUMN_MIGRATIONS:
+            conn.execute(text(statement))
+
+# Orders held for an unpaid payment used to be parked as failed, where requeue_order
+# could send them back to the job queue; move them to their own status
+MIGRATE_HELD_ORDERS = [
+    """UPDATE "UserSummary" SET failed_count = failed_count - (
+        SELECT COUNT(*) FROM "Order" o
+        WHERE o."userId" = "UserSummary"."userId" AND o.status = 'failed'
+          AND o.last_error = 'Payment not completed' AND o.payment_id IS NOT NULL
+    )""",
+    """UPDATE "Order" SET status = 'awaiting_payment'
+    WHERE status = 'failed' AND last_error = 'Payment not completed' AND payment_id IS NOT NULL""",
+]
+
+def migrate_held_orders(engine):
+    """Move orders held for payment out of the failed status"""
+    with engine.begin() as conn:
+        for statement in MIGRATE_HELD_ORDERS:
+            conn.execute(text(statement))
+
+# Indexes the raw-SQL queries in app/auth_db.py, app/jobs.py and app/webhooks.py rely on. The tables
+# may have been created by Prisma, so these are applied with IF NOT EXISTS rather than via the models.
+INDEXES = [
+    # Keyset pagination of a user's order history (get_user_orders_page)
+    'CREATE INDEX IF NOT EXISTS "Order_userId_createdAt_id_idx" ON "Order" ("userId", "createdAt" DESC, id DESC)',
+    # Claiming runnable orders in app/jobs.py
+    'CREATE INDEX IF NOT EXISTS "Order_runnable_idx" ON "Order" (status, "createdAt") WHERE status IN (\'pending\', \'running\')',
+    # Draining the webhook inbox in app/webhooks.py
+    'CREATE INDEX IF NOT EXISTS "WebhookEvent_pending_idx" ON "WebhookEvent" (received_at) WHERE status = \'pending\'',
+    # Linking orders to the payment a webhook event names
+    'CREATE INDEX IF NOT EXISTS "Order_payment_id_idx" ON "Order" (payment_id)',
+]
+
+# Seed "UserSummary" from existing history; rows that already exist are kept,
+# since from then on the app keeps them current on every order and payment write
+BACKFILL_USER_SUMMARY = """
+INSERT INTO "UserSummary" ("userId", order_count, pending_count, running_count, done_count, failed_count, payment_count, total_spent, "updatedAt")
+SELECT u.id,
+       (SELECT COUNT(*) FROM "Order" o WHERE o."userId" = u.id),
+       (SELECT COUNT(*) FROM "Order" o WHERE o."userId" = u.id AND o.status = 'pending'),
+       (SELECT COUNT(*) FROM "Order" o WHERE o."userId" = u.id AND o.status = 'running'),
+       (SELECT COUNT(*) FROM "Order" o WHERE o."userId" = u.id AND o.status = 'done'),
+       (SELECT COUNT(*) FROM "Order" o WHERE o."userId" = u.id AND o.status = 'failed'),
+       (SELECT COUNT(*) FROM "Payment" p WHERE p."userId" = u.id AND p.status = 'succeeded'),
+       (SELECT COALESCE(SUM(p.amount), 0) FROM "Payment" p WHERE p."userId" = u.id AND p.status = 'succeeded'),
+       CURRENT_TIMESTAMP
+FROM "User" u
+WHERE 1 = 1
+ON CONFLICT ("userId") DO NOTHING
+"""
+
+def backfill_user_summary(engine):
+    """Create missing per-user summary rows"""
+    with engine.begin() as conn:
+        conn.execute(text(BACKFILL_USER_SUMMARY))
+
+def create_indexes(engine):
+    """Create supporting indexes"""
+    with engine.begin() as conn:
+        for statement in INDEXES:
+            conn.execute(text(statement))
+
 def init_db():
     """Initialize database tables"""
     try:
@@ -18,11 +103,30 @@ def init_db():
         print("📊 Creating tables...")
         Base.metadata.create_all(bind=engine)
         
+        print("🧱 Adding new columns...")
+        migrate_columns(engine)
+        
+        print("💳 Moving orders held for payment...")
+        migrate_held_orders(engine)
+        
+        print("📇 Creating indexes...")
+        create_indexes(engine)
+        
+        print("🧮 Backfilling user summaries...")
+        backfill_user_summary(engine)
+        
         print("✅ Database tables created successfully!")
         print("\nTables created:")
         print("  ✓ users")
         print("  ✓ orders")
         print("  ✓ payments")
+        print("  ✓ reviews")
+        print("  ✓ review signatures and bands")
+        print("  ✓ analysis reports")
+        print("  ✓ report aggregates")
+        print("  ✓ analysis cache")
+        print("  ✓ webhook events")
+        print("  ✓ user summaries")
         
         return True
     except Exception as e: